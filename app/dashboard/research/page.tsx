@@ -444,13 +444,13 @@ export default function ResearchPage() {
                   <div className="mb-8">
                     <h3 className="text-lg font-semibold text-gray-900 dark:text-white mb-4 flex justify-between items-center">
                       <span>Secondary Research Analysis</span>
-                      {secondaryResults.timestamp && (
+                      {secondaryResults.jobId && (
                         <Button 
                           variant="outline" 
                           size="sm" 
                           className="flex items-center" 
                           onClick={() => {
-                            window.open(`${FASTAPI_SECONDARY_URL}/download_secondary_report/${secondaryResults.timestamp}`, '_blank')
+                            window.open(`${FASTAPI_SECONDARY_URL}/download_secondary_report/${secondaryResults.jobId}`, '_blank')
                           }}
                         >
                           <svg xmlns="http://www.w3.org/2000/svg" className="h-4 w-4 mr-1" fill="none" viewBox="0 0 24 24" stroke="currentColor">
@@ -522,13 +522,13 @@ export default function ResearchPage() {
                   <div className="mb-8 pt-8 border-t dark:border-gray-700">
                     <h3 className="text-lg font-semibold text-gray-900 dark:text-white mb-4 flex justify-between items-center">
                       <span>Primary Research Analysis</span>
-                      {primaryResults.timestamp && (
+                      {primaryResults.jobId && (
                         <Button 
                           variant="outline" 
                           size="sm" 
                           className="flex items-center" 
                           onClick={() => {
-                            window.open(`${FASTAPI_SERVER_URL}/download_primary_report/${primaryResults.timestamp}`, '_blank')
+                            window.open(`${FASTAPI_SERVER_URL}/download_primary_report/${primaryResults.jobId}`, '_blank')
                           }}
                         >
                           <svg xmlns="http://www.w3.org/2000/svg" className="h-4 w-4 mr-1" fill="none" viewBox="0 0 24 24" stroke="currentColor">
@@ -0,0 +1,180 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import importlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi import HTTPException
+
+# Workers per pool. The primary, secondary and niche market APIs each start
+# their own pool, so by default each gets a third of the CPUs; set it per app
+# when they don't all run on one machine
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", str(max(1, (os.cpu_count() or 3) // 3))))
+ANALYSIS_MAX_QUEUE = int(os.environ.get("ANALYSIS_MAX_QUEUE", "8"))
+ANALYSIS_RETRY_AFTER = int(os.environ.get("ANALYSIS_RETRY_AFTER", "5"))
+
+# Imported by every worker on start-up so the first analysis doesn't pay for them
+WARM_IMPORTS = ["pandas", "numpy", "matplotlib.figure", "matplotlib.backends.backend_agg",
+                "sklearn.feature_extraction.text"]
+
+
+# Set while run() should wait for room in the queue instead of answering 503
+_waiting = contextvars.ContextVar("analysis_pool_waiting", default=False)
+
+
+@contextlib.contextmanager
+def waiting_for_capacity():
+    """
+    Within this block (and tasks started from it) AnalysisPool.run() waits
+    until the pool has room instead of raising the 503 'busy' response; for
+    callers that already bound how many analyses they run, like batches
+    """
+    token = _waiting.set(True)
+    try:
+        yield
+    finally:
+        _waiting.reset(token)
+
+
+class AnalysisError(Exception):
+    """Picklable stand-in for an HTTPException raised inside a worker"""
+
+    def __init__(self, status_code, detail):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _warm_worker(modules):
+    # Charts are only ever written to files, never shown
+    import matplotlib
+    matplotlib.use("Agg")
+
+    for name in WARM_IMPORTS + list(modules):
+        importlib.import_module(name)
+
+
+def _ping():
+    # Long enough that each worker picks up one of the start-up pings
+    time.sleep(0.2)
+    return os.getpid()
+
+
+def _call(func, args):
+    # HTTPException can't be unpickled in the parent, so send its fields instead
+    try:
+        return func(*args)
+    except HTTPException as e:
+        raise AnalysisError(e.status_code, e.detail)
+
+
+class AnalysisPool:
+    """
+    Runs CPU-bound analysis functions in pre-warmed worker processes so the
+    asyncio event loop stays free for other requests.
+
+    At most `workers` analyses run at once and at most `max_queue` more may
+    wait for a free worker; beyond that run() answers 503 straight away,
+    unless called within waiting_for_capacity(). An optional on_start
+    callback fires when an analysis gets a worker.
+    """
+
+    def __init__(self, warm_modules=(), workers=None, max_queue=None):
+        self.warm_modules = list(warm_modules)
+        self.workers = max(1, workers or ANALYSIS_WORKERS)
+        self.max_queue = ANALYSIS_MAX_QUEUE if max_queue is None else max_queue
+        self.executor = None
+        self.in_flight = 0
+        self.slots = None
+        self.restarting = None
+        self.waiters = collections.deque()
+
+    def start(self):
+        """Create the worker processes and wait until they have warmed up"""
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_worker,
+            initargs=(self.warm_modules,)
+        )
+        # One task per worker forces all of them to spawn (and warm up) now
+        pids = set(f.result() for f in [self.executor.submit(_ping) for _ in range(self.workers)])
+        print(f"Analysis pool ready with {len(pids)} of {self.workers} workers")
+
+    async def _restart(self):
+        # Spawning and warming the workers takes seconds, so it runs off the
+        # event loop, and only once however many requests are waiting for it
+        if self.restarting is None:
+            self.restarting = asyncio.Lock()
+        async with self.restarting:
+            if self.executor is None:
+                await asyncio.to_thread(self.start)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def is_saturated(self):
+        return self.in_flight >= self.workers + self.max_queue
+
+    def check_capacity(self):
+        """Raise the 503 'busy' response if no more analyses can be accepted"""
+        if self.is_saturated():
+            raise HTTPException(
+                status_code=503,
+                detail="Analysis workers are busy. Please retry shortly.",
+                headers={"Retry-After": str(ANALYSIS_RETRY_AFTER)}
+            )
+
+    async def _wait_for_capacity(self):
+        # Woken one at a time, in order, as analyses finish
+        while self.is_saturated():
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+
+    def _wake_waiter(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def run(self, func, *args, on_start=None):
+        """Run func(*args) in a worker process and return its result"""
+        if _waiting.get():
+            await self._wait_for_capacity()
+        else:
+            self.check_capacity()
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.workers)
+
+        self.in_flight += 1
+        try:
+            async with self.slots:
+                if self.executor is None:
+                    await self._restart()
+                if on_start is not None:
+                    on_start()
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, _call, func, args)
+        except AnalysisError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); replace the pool for later requests
+            print("Analysis worker crashed, restarting the pool")
+            self.shutdown()
+            raise
+        finally:
+            self.in_flight -= 1
+            self._wake_waiter()
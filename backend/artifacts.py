@@ -0,0 +1,233 @@
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+from charts import discard_pending_charts
+from result_store import RESULTS_DB, delete_job_results, expire_results
+
+# Jobs older than this are deleted, as are loose files left in the root by older versions
+ARTIFACT_TTL_SECONDS = float(os.environ.get("ARTIFACT_TTL_HOURS", "168")) * 3600
+
+# Disk budget for all job directories together; the oldest jobs go first
+ARTIFACT_MAX_BYTES = int(os.environ.get("ARTIFACT_MAX_MB", "2048")) * 1024 * 1024
+
+# How often the background sweep enforces both
+ARTIFACT_SWEEP_SECONDS = float(os.environ.get("ARTIFACT_SWEEP_SECONDS", "600"))
+
+
+def new_job_id(kind):
+    """Collision-free name for a job's directory, e.g. secondary-20250623-9f1c2b7a04d3e6f5"""
+    return f"{kind}-{time.strftime('%Y%m%d')}-{uuid.uuid4().hex[:16]}"
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class ArtifactStore:
+    """
+    Per-job directories for the charts and files an analysis writes under
+    the served temp/output root.
+
+    create_job() reserves a directory named by a collision-free job id;
+    index_job() records the files written into it once the analysis is done,
+    and delete_job() removes it. The index (jobs with their kind, creation
+    time and size, plus every file) lives in the results database.
+
+    sweep(), run every sweep_seconds by a background thread between start()
+    and stop(), deletes jobs older than ttl and then the oldest jobs until
+    the total is within max_bytes. A job's stored results go with it, and
+    results older than ttl expire too. It also re-indexes jobs whose directory
+    changed (lazy charts are drawn after the analysis) and clears out
+    anything in the root the index doesn't know about once it is older than
+    ttl. Several processes may share one root; sweeps are idempotent.
+    """
+
+    def __init__(self, root, ttl=ARTIFACT_TTL_SECONDS, max_bytes=ARTIFACT_MAX_BYTES,
+                 sweep_seconds=ARTIFACT_SWEEP_SECONDS):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_seconds = sweep_seconds
+        self._stop = None
+
+    def _connect(self):
+        conn = sqlite3.connect(RESULTS_DB, timeout=30)
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS artifact_jobs (
+                   job_id TEXT PRIMARY KEY,
+                   kind TEXT NOT NULL,
+                   created_at REAL NOT NULL,
+                   indexed_at REAL,
+                   size_bytes INTEGER NOT NULL
+               )"""
+        )
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS artifacts (
+                   job_id TEXT NOT NULL,
+                   name TEXT NOT NULL,
+                   size_bytes INTEGER NOT NULL,
+                   PRIMARY KEY (job_id, name)
+               )"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS artifact_jobs_age ON artifact_jobs (created_at)")
+        return conn
+
+    def job_dir(self, job_id):
+        return os.path.join(self.root, job_id)
+
+    def create_job(self, kind):
+        """Make a new, empty job directory and return its job id"""
+        job_id = new_job_id(kind)
+        os.makedirs(self.job_dir(job_id))
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO artifact_jobs (job_id, kind, created_at, indexed_at, size_bytes) VALUES (?, ?, ?, NULL, 0)",
+                    (job_id, kind, time.time())
+                )
+        finally:
+            conn.close()
+        return job_id
+
+    def index_job(self, job_id, conn=None):
+        """Record the files currently in a job's directory; returns their total size"""
+        job_dir = self.job_dir(job_id)
+        indexed_at = time.time()
+        files = [(name, _size(os.path.join(job_dir, name))) for name in sorted(os.listdir(job_dir))]
+        total = sum(size for _, size in files)
+
+        own_conn = conn is None
+        conn = conn or self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM artifacts WHERE job_id = ?", (job_id,))
+                conn.executemany(
+                    "INSERT INTO artifacts (job_id, name, size_bytes) VALUES (?, ?, ?)",
+                    [(job_id, name, size) for name, size in files]
+                )
+                conn.execute(
+                    "UPDATE artifact_jobs SET indexed_at = ?, size_bytes = ? WHERE job_id = ?",
+                    (indexed_at, total, job_id)
+                )
+        finally:
+            if own_conn:
+                conn.close()
+        return total
+
+    def artifacts(self, job_id):
+        """[(name, size in bytes)] of the files indexed for a job"""
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT name, size_bytes FROM artifacts WHERE job_id = ? ORDER BY name", (job_id,)
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def delete_job(self, job_id, conn=None):
+        """Remove a job's directory, its pending charts, its stored results and its index entries"""
+        _remove(self.job_dir(job_id))
+        discard_pending_charts(job_id)
+        delete_job_results(job_id)
+
+        own_conn = conn is None
+        conn = conn or self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM artifacts WHERE job_id = ?", (job_id,))
+                conn.execute("DELETE FROM artifact_jobs WHERE job_id = ?", (job_id,))
+        finally:
+            if own_conn:
+                conn.close()
+
+    def sweep(self, now=None):
+        """Enforce the TTL and the disk budget; returns what was removed"""
+        now = time.time() if now is None else now
+        removed = {"expired": 0, "evicted": 0, "strays": 0, "results": 0}
+        conn = self._connect()
+        try:
+            jobs = conn.execute(
+                "SELECT job_id, created_at, indexed_at FROM artifact_jobs ORDER BY created_at"
+            ).fetchall()
+            known = set()
+            finished = []
+            for job_id, created_at, indexed_at in jobs:
+                job_dir = self.job_dir(job_id)
+                if created_at < now - self.ttl or not os.path.isdir(job_dir):
+                    # Expired, or already deleted by another process
+                    if os.path.isdir(job_dir):
+                        removed["expired"] += 1
+                    self.delete_job(job_id, conn)
+                    continue
+
+                known.add(job_id)
+                # Jobs still being analyzed haven't been indexed yet
+                if indexed_at is not None:
+                    if os.path.getmtime(job_dir) > indexed_at:
+                        self.index_job(job_id, conn)
+                    finished.append(job_id)
+
+            # Anything else in the root: files from before per-job
+            # directories, or directories whose index entry was lost
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if name in known or name.startswith("."):
+                    continue
+                if os.path.getmtime(path) < now - self.ttl:
+                    _remove(path)
+                    discard_pending_charts(name)
+                    removed["strays"] += 1
+
+            total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM artifact_jobs").fetchone()[0]
+            for job_id in finished:
+                if total <= self.max_bytes:
+                    break
+                size = conn.execute(
+                    "SELECT size_bytes FROM artifact_jobs WHERE job_id = ?", (job_id,)
+                ).fetchone()[0]
+                self.delete_job(job_id, conn)
+                total -= size
+                removed["evicted"] += 1
+        finally:
+            conn.close()
+
+        # Results whose charts are gone, including ones from before results were kept per job
+        removed["results"] = expire_results(now - self.ttl)
+        return removed
+
+    def _run(self, stop):
+        while not stop.wait(self.sweep_seconds):
+            try:
+                removed = self.sweep()
+                if any(removed.values()):
+                    print(f"Artifact sweep removed {removed}")
+            except Exception as e:
+                print(f"Artifact sweep failed: {e}")
+
+    def start(self):
+        """Sweep once now, then every sweep_seconds in a background thread"""
+        os.makedirs(self.root, exist_ok=True)
+        self.sweep()
+        self._stop = threading.Event()
+        threading.Thread(target=self._run, args=(self._stop,), name="artifact-sweep", daemon=True).start()
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
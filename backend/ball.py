@@ -1,89 +1,82 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import sys
 import json
+import contextlib
 import os
 import traceback
+import shutil
+import tempfile
+import time
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 
-# Get command line arguments
-# Usage: python ball.py input_csv_path output_image_path
-csv_file_path = sys.argv[1] if len(sys.argv) > 1 else "sample.csv"
-output_file_path = sys.argv[2] if len(sys.argv) > 2 else "bcg_matrix_output.png"
+from bcg import bcg_evolution, classify_quadrants, stream_medians, threshold
+from charts import chart_spec, render_chart
+from invoice_metrics import (INVOICE_COLUMNS, has_invoice_columns, market_metrics, product_snapshot,
+                             rollup_invoice_chunks, rollup_invoices)
+from quantile_sketch import QuantileSketch
+from table_loader import is_table_name, read_table
 
-print(f"Processing file: {csv_file_path}")
-print(f"Output will be saved to: {output_file_path}")
+# Streaming mode: rows read per chunk and the most products drawn on its chart
+STREAM_CHUNK_ROWS = int(os.environ.get("BCG_STREAM_CHUNK_ROWS", "100000"))
+STREAM_PLOT_POINTS = int(os.environ.get("BCG_STREAM_PLOT_POINTS", "20000"))
+# Rank error of the threshold sketches, unless exact thresholds are asked for
+STREAM_SKETCH_ERROR = float(os.environ.get("BCG_STREAM_SKETCH_ERROR", "0.001"))
+
+TOP_PRODUCTS = 10
+
+# Batch mode: files analyzed side by side, one per worker process (all cores by default)
+BATCH_WORKERS = int(os.environ.get("BCG_BATCH_WORKERS", str(os.cpu_count() or 1)))
+
+# Shown when the top products can't be extracted
+SAMPLE_TOP_PRODUCTS = [
+    {"name": "Sample Product 1", "quantity": 100, "category": "Star", "market_share": 8, "growth_rate": 15},
+    {"name": "Sample Product 2", "quantity": 80, "category": "Cash Cow", "market_share": 12, "growth_rate": 5},
+    {"name": "Sample Product 3", "quantity": 60, "category": "Question Mark", "market_share": 3, "growth_rate": 20},
+    {"name": "Sample Product 4", "quantity": 40, "category": "Dog", "market_share": 5, "growth_rate": -2}
+]
+
+
+def prepare_products(df, plan=None):
+    """
+    Find the product name, MarketShare, MarketGrowth and Quantity columns of
+    a freshly read CSV and clean them to numbers.
+
+    Returns (df, name_column). If plan is a dict, every decision taken is
+    recorded in it so replay_plan() can repeat them on later chunks of the
+    same file.
+    """
+    def note(*step):
+        if plan is not None:
+            plan.setdefault("steps", []).append(step)
+
+    if plan is not None:
+        plan["columns"] = df.columns.tolist()
 
-try:
-    # Load Dataset with more robust error handling
-    print(f"Reading CSV file...")
-    try:
-        # First try with standard parameters
-        df = pd.read_csv(csv_file_path)
-        print(f"Successfully read CSV with {len(df)} rows and {len(df.columns)} columns")
-    except Exception as e:
-        print(f"Error with standard CSV reading: {str(e)}")
-        print("Trying with error recovery options...")
-        
-        try:
-            # Try with error_bad_lines=False (skip bad lines)
-            df = pd.read_csv(csv_file_path, on_bad_lines='skip', escapechar='\\', quoting=1)
-            print(f"Successfully read CSV with error recovery: {len(df)} rows and {len(df.columns)} columns")
-        except Exception as e2:
-            print(f"Error with first recovery attempt: {str(e2)}")
-            
-            try:
-                # Try with even more permissive settings
-                df = pd.read_csv(csv_file_path, on_bad_lines='skip', escapechar='\\', 
-                                quoting=3, encoding='utf-8', engine='python')
-                print(f"Successfully read CSV with python engine: {len(df)} rows and {len(df.columns)} columns")
-            except Exception as e3:
-                print(f"Error with second recovery attempt: {str(e3)}")
-                
-                # Last resort: try to read with maximum flexibility
-                try:
-                    df = pd.read_csv(csv_file_path, sep=None, engine='python', on_bad_lines='skip')
-                    print(f"Successfully read CSV with auto-detection: {len(df)} rows and {len(df.columns)} columns")
-                except Exception as e4:
-                    print(f"All CSV reading attempts failed: {str(e4)}")
-                    if os.path.exists(csv_file_path):
-                        print(f"File exists but can't be read. Size: {os.path.getsize(csv_file_path)} bytes")
-                        with open(csv_file_path, 'r', errors='replace') as f:
-                            try:
-                                first_lines = [next(f) for _ in range(5)]
-                                print(f"First 5 lines of file:")
-                                for line in first_lines:
-                                    print(line.strip())
-                            except Exception as e5:
-                                print(f"Error reading file directly: {str(e5)}")
-                    else:
-                        print(f"File does not exist at path: {csv_file_path}")
-                    raise Exception("Could not read CSV file with any method")
-
-    print(f"Column names: {df.columns.tolist()}")
-    
     # Step 0: Rename columns to expected names
     def auto_rename_columns(df):
         rename_map = {}
         print("Attempting to identify important columns...")
-        
+    
         # Column name mappings
         mappings = {
             "MarketShare": ["share", "marketshare", "sharerate", "market_share", "marketvalue"],
             "MarketGrowth": ["growth", "marketgrowth", "growthrate", "growth_rate", "marketgrowthrate"],
             "Quantity": ["quantity", "count", "units", "sold", "qty", "volume", "amount"]
         }
-        
+    
         for col in df.columns:
             col_lower = col.lower().strip().replace(" ", "").replace("_", "")
             for target, terms in mappings.items():
                 if any(term in col_lower for term in terms):
                     rename_map[col] = target
                     print(f"Identified '{col}' as {target}")
-        
+    
         if not rename_map:
             print("WARNING: Could not identify any standard columns. Using numeric columns.")
+        note("rename", rename_map)
         return df.rename(columns=rename_map)
 
     df = auto_rename_columns(df)
@@ -91,17 +84,17 @@ try:
     # Find product/item name column
     print("Searching for product name column...")
     name_column = None
-    
+
     # First, try to find columns with specific names
     name_patterns = ['name', 'product', 'item', 'description', 'title', 'sku', 'model']
-    
+
     # Exclude columns that start with 'Unnamed:'
     valid_columns = [col for col in df.columns if not col.startswith('Unnamed:')]
-    
+
     # If no valid columns, use all columns
     if not valid_columns:
         valid_columns = df.columns
-    
+
     # First pass: Look for exact matches in column names
     for pattern in name_patterns:
         matches = [col for col in valid_columns if pattern.lower() in col.lower()]
@@ -109,43 +102,44 @@ try:
             name_column = matches[0]
             print(f"Found product name column: '{name_column}'")
             break
-    
+
     # Second pass: If no match found, look for the first string column that's not an index or unnamed column
     if not name_column:
         print("No specific name column found. Looking for string columns...")
         string_columns = []
-        
+    
         for col in valid_columns:
             if df[col].dtype == 'object':  # String columns are 'object' type
                 # Skip columns that are likely to be indices
                 if col.lower() in ['index', 'id', 'unnamed', '#']:
                     continue
-                
+            
                 # Check if column has unique values (not good for product names)
                 if df[col].nunique() == len(df):
                     continue
-                
+            
                 string_columns.append(col)
-        
+    
         if string_columns:
             name_column = string_columns[0]
             print(f"Using string column '{name_column}' for product names")
-    
+
     # If still no name column, create a dummy one
     if not name_column:
         print("No suitable name column found. Creating dummy product names.")
         df['ProductName'] = [f'Product {i+1}' for i in range(len(df))]
         name_column = 'ProductName'
+        note("names", name_column)
 
     # Ensure required columns exist
     required_columns = ["MarketShare", "MarketGrowth"]
     missing_columns = [col for col in required_columns if col not in df.columns]
-    
+
     if missing_columns:
         print(f"Missing required columns: {missing_columns}")
         # Try to find columns that might be applicable
         numeric_columns = df.select_dtypes(include=['number']).columns.tolist()
-        
+    
         if len(numeric_columns) >= 2:
             print(f"Found {len(numeric_columns)} numeric columns: {numeric_columns}")
             # Use the first two numeric columns as fallback
@@ -154,15 +148,18 @@ try:
                     print(f"Using '{numeric_columns[i]}' as {col}")
                     # Create a new column instead of renaming to preserve original data
                     df[col] = df[numeric_columns[i]]
+                    note("copy", col, numeric_columns[i])
         else:
             print("Error: Not enough numeric columns for analysis")
             # Create synthetic columns with random data to avoid crashing
             print("Creating synthetic data for analysis")
             if "MarketShare" not in df.columns:
                 df["MarketShare"] = np.random.uniform(0, 10, size=len(df))
+                note("random", "MarketShare", 0, 10)
                 print("Created synthetic MarketShare column")
             if "MarketGrowth" not in df.columns:
                 df["MarketGrowth"] = np.random.uniform(-5, 15, size=len(df))
+                note("random", "MarketGrowth", -5, 15)
                 print("Created synthetic MarketGrowth column")
 
     # Look for Quantity column if not already found
@@ -173,7 +170,7 @@ try:
             col for col in df.select_dtypes(include=['number']).columns 
             if col not in ["MarketShare", "MarketGrowth"]
         ]
-        
+    
         if potential_quantity_cols:
             print(f"Found {len(potential_quantity_cols)} potential quantity columns: {potential_quantity_cols}")
             for col in potential_quantity_cols:
@@ -181,17 +178,20 @@ try:
                 if df[col].dropna().size > 0 and (df[col] >= 0).all() and df[col].mean() > 1:
                     # Create a new column instead of renaming
                     df["Quantity"] = df[col]
+                    note("copy", "Quantity", col)
                     print(f"Selected '{col}' as Quantity column")
                     break
-            
+        
             # If no suitable column found yet, use the first one
             if "Quantity" not in df.columns and potential_quantity_cols:
                 df["Quantity"] = df[potential_quantity_cols[0]]
+                note("copy", "Quantity", potential_quantity_cols[0])
                 print(f"Using '{potential_quantity_cols[0]}' as Quantity column (fallback)")
         else:
             # If no column found, create a synthetic one
             print("No numeric columns available for quantity. Using default value of 1.")
             df["Quantity"] = 1
+            note("fill", "Quantity", 1)
 
     # Display identified columns
     print("\nUsing the following columns for analysis:")
@@ -204,339 +204,364 @@ try:
     for col in ["MarketShare", "MarketGrowth", "Quantity"]:
         try:
             df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+            note("clean", col)
         except Exception as e:
             print(f"Error converting {col} to numeric: {str(e)}")
             # Create a new column with default values
             df[col] = 1
+            note("fill", col, 1)
             print(f"Created default values for {col}")
 
-    # Make sure we have at least some data
-    if len(df) == 0:
-        print("Warning: DataFrame is empty. Creating sample data for demonstration.")
-        # Create sample data
-        df = pd.DataFrame({
-            name_column: ["Sample Product 1", "Sample Product 2", "Sample Product 3", "Sample Product 4"],
-            "MarketShare": [8, 12, 3, 5],
-            "MarketGrowth": [15, 5, 20, -2],
-            "Quantity": [100, 200, 50, 80],
-        })
-    elif len(df) < 4:
-        print(f"Warning: Only {len(df)} data points. Adding sample data points.")
-        # Add some sample data points
-        sample_data = pd.DataFrame({
-            name_column: ["Sample Product 1", "Sample Product 2", "Sample Product 3"],
-            "MarketShare": [8, 12, 3],
-            "MarketGrowth": [15, 5, 20],
-            "Quantity": [100, 200, 50],
-        })
-        df = pd.concat([df, sample_data], ignore_index=True)
-
-    # Display data summary
-    print("\nData Summary:")
-    for col in ["MarketShare", "MarketGrowth", "Quantity"]:
-        try:
-            # Handle potential errors with min/max/mean calculations
-            min_val = float(df[col].min()) if not pd.isna(df[col].min()) else 0
-            max_val = float(df[col].max()) if not pd.isna(df[col].max()) else 0
-            mean_val = float(df[col].mean()) if not pd.isna(df[col].mean()) else 0
-            median_val = float(df[col].median()) if not pd.isna(df[col].median()) else 0
-            
-            print(f"  {col}: Min={min_val:.2f}, Max={max_val:.2f}, Mean={mean_val:.2f}, Median={median_val:.2f}")
-        except Exception as e:
-            print(f"  {col}: Error calculating statistics - {str(e)}")
-            print(f"  {col}: Using default values")
-            print(f"  {col}: Min=0.00, Max=10.00, Mean=5.00, Median=5.00")
+    if plan is not None:
+        plan["name_column"] = name_column
+    return df, name_column
 
-    # Step 1: Compute dynamic thresholds using median
-    try:
-        share_thresh = float(df["MarketShare"].median()) if not pd.isna(df["MarketShare"].median()) else 5.0
-        growth_thresh = float(df["MarketGrowth"].median()) if not pd.isna(df["MarketGrowth"].median()) else 5.0
-    except Exception as e:
-        print(f"Error calculating thresholds: {str(e)}")
-        print("Using default thresholds")
-        share_thresh = 5.0
-        growth_thresh = 5.0
 
-    print(f"\nCalculated Thresholds:")
-    print(f"  Market Share Threshold: {share_thresh:.2f}")
-    print(f"  Market Growth Threshold: {growth_thresh:.2f}")
+def first_column(df, name):
+    # auto_rename_columns can map several columns to one name; use the first
+    values = df[name]
+    return values.iloc[:, 0] if values.ndim > 1 else values
 
-    # Step 2: Classification Logic
-    def classify_bcg(row):
+
+def top_product_rows(top_products, name_column):
+    """Summary entries for the rows of top_products"""
+    top_products_list = []
+    for _, row in top_products.iterrows():
         try:
-            share = float(row['MarketShare']) if not pd.isna(row['MarketShare']) else 0
-            growth = float(row['MarketGrowth']) if not pd.isna(row['MarketGrowth']) else 0
-            
-            if share >= share_thresh and growth >= growth_thresh:
-                return "Star"
-            elif share >= share_thresh and growth < growth_thresh:
-                return "Cash Cow"
-            elif share < share_thresh and growth >= growth_thresh:
-                return "Question Mark"
-            else:
-                return "Dog"
+            product_name = str(row[name_column]) if not pd.isna(row[name_column]) else f"Product {_}"
+            product_info = {
+                "name": product_name[:50],  # Limit name length to avoid issues
+                "quantity": int(float(row["Quantity"])) if not pd.isna(row["Quantity"]) else 0,
+                "category": str(row["BCG Category"]),
+                "market_share": float(row["MarketShare"]) if not pd.isna(row["MarketShare"]) else 0,
+                "growth_rate": float(row["MarketGrowth"]) if not pd.isna(row["MarketGrowth"]) else 0
+            }
+            top_products_list.append(product_info)
         except Exception as e:
-            print(f"Error in classification: {str(e)}")
-            # Default to "Dog" if there's an error
-            return "Dog"
+            print(f"Error processing product {_}: {str(e)}")
+            # Add a placeholder product
+            top_products_list.append({
+                "name": f"Product {_}",
+                "quantity": 0,
+                "category": "Unknown",
+                "market_share": 0,
+                "growth_rate": 0
+            })
+    return top_products_list
 
-    # Apply classification and handle errors
-    try:
-        df['BCG Category'] = df.apply(classify_bcg, axis=1)
-    except Exception as e:
-        print(f"Error applying classification: {str(e)}")
-        print("Creating default classification")
-        # Create default classification
-        df['BCG Category'] = ["Star", "Cash Cow", "Question Mark", "Dog"] * (len(df) // 4 + 1)
-        df['BCG Category'] = df['BCG Category'].head(len(df))
 
-    # Extract top products by Quantity
+def load_table(csv_file_path):
+    """
+    Read the file to analyze. Invoice-level files (like sample.csv) come
+    back as per-product monthly metrics (see invoice_metrics.market_metrics)
+    and None, anything else as None and the table itself.
+    """
+    # Load Dataset: CSVs are parsed once with options sniffed from the
+    # start of the file, skipping malformed lines; Parquet, Feather and
+    # Arrow files are read as they are
+    print(f"Reading data file...")
+    read_report = {}
     try:
-        # Make sure we have enough products
-        if len(df) < 10:
-            print(f"Warning: Only {len(df)} products available for top products list")
-            top_products = df
-        else:
-            top_products = df.sort_values("Quantity", ascending=False).head(10)
-        
-        top_products_list = []
-        
-        for _, row in top_products.iterrows():
-            try:
-                product_name = str(row[name_column]) if not pd.isna(row[name_column]) else f"Product {_}"
-                product_info = {
-                    "name": product_name[:50],  # Limit name length to avoid issues
-                    "quantity": int(float(row["Quantity"])) if not pd.isna(row["Quantity"]) else 0,
-                    "category": str(row["BCG Category"]),
-                    "market_share": float(row["MarketShare"]) if not pd.isna(row["MarketShare"]) else 0,
-                    "growth_rate": float(row["MarketGrowth"]) if not pd.isna(row["MarketGrowth"]) else 0
-                }
-                top_products_list.append(product_info)
-            except Exception as e:
-                print(f"Error processing product {_}: {str(e)}")
-                # Add a placeholder product
-                top_products_list.append({
-                    "name": f"Product {_}",
-                    "quantity": 0,
-                    "category": "Unknown",
-                    "market_share": 0,
-                    "growth_rate": 0
-                })
-        
-        print(f"\nTop {len(top_products_list)} products by quantity identified")
+        df = read_table(csv_file_path, read_report)
+        dialect = (f"delimiter {read_report['delimiter']!r}, {read_report['encoding']}, "
+                   if read_report["format"] == "csv" else "")
+        print(f"Successfully read {read_report['format']} file with {len(df)} rows and {len(df.columns)} columns "
+              f"({dialect}{read_report['skippedLines']} malformed lines skipped)")
     except Exception as e:
-        print(f"Error extracting top products: {e}")
-        print(traceback.format_exc())
-        # Create sample top products
-        top_products_list = [
-            {"name": "Sample Product 1", "quantity": 100, "category": "Star", "market_share": 8, "growth_rate": 15},
-            {"name": "Sample Product 2", "quantity": 80, "category": "Cash Cow", "market_share": 12, "growth_rate": 5},
-            {"name": "Sample Product 3", "quantity": 60, "category": "Question Mark", "market_share": 3, "growth_rate": 20},
-            {"name": "Sample Product 4", "quantity": 40, "category": "Dog", "market_share": 5, "growth_rate": -2}
-        ]
+        print(f"Error reading CSV: {str(e)}")
+        if os.path.exists(csv_file_path):
+            print(f"File exists but can't be read. Size: {os.path.getsize(csv_file_path)} bytes")
+            with open(csv_file_path, 'r', errors='replace') as f:
+                try:
+                    first_lines = [next(f) for _ in range(5)]
+                    print(f"First 5 lines of file:")
+                    for line in first_lines:
+                        print(line.strip())
+                except Exception as e5:
+                    print(f"Error reading file directly: {str(e5)}")
+        else:
+            print(f"File does not exist at path: {csv_file_path}")
+        raise Exception(f"Could not read CSV file: {str(e)}")
+
+    if has_invoice_columns(df.columns):
+        return market_metrics(rollup_invoices(df)), None
+    return None, df
+
 
-    # Print classification counts
-    category_counts = df['BCG Category'].value_counts().to_dict()
-    print("\nBCG Classification Results:")
-    print(f"  Stars: {category_counts.get('Star', 0)}")
-    print(f"  Cash Cows: {category_counts.get('Cash Cow', 0)}")
-    print(f"  Question Marks: {category_counts.get('Question Mark', 0)}")
-    print(f"  Dogs: {category_counts.get('Dog', 0)}")
-    print(f"  Total Products: {len(df)}")
+def invoice_products(metrics):
+    """
+    Products to classify from market_metrics(): each product's share of the
+    market and revenue growth in the latest month, derived from the
+    invoices themselves rather than any precomputed columns
+    """
+    products = product_snapshot(metrics)
+    print(f"Rolled {int(metrics['lines'].sum())} invoice lines up into {len(products)} products "
+          f"(market share and growth for {metrics['YearMonth'].max()})")
+    return products
+
+
+def product_evolution(metrics, df=None, name_column=None):
+    """
+    Time-sliced BCG matrix (see bcg.bcg_evolution) with each month
+    classified against its own median thresholds: over the monthly metrics
+    of an invoice-level file, or else over the rows of a prepared table
+    that has a YearMonth column. None if there are no periods.
+    """
+    if metrics is not None:
+        products, periods = metrics['Product'], metrics['YearMonth']
+        share, growth = metrics['marketShare'], metrics['growth']
+    elif df is not None and 'YearMonth' in df.columns:
+        products, periods = first_column(df, name_column), df['YearMonth'].astype(str)
+        share = pd.to_numeric(first_column(df, 'MarketShare'), errors='coerce')
+        growth = pd.to_numeric(first_column(df, 'MarketGrowth'), errors='coerce')
+    else:
+        print("Over-time analysis needs invoice-level data or a YearMonth column, skipping it")
+        return None
+
+    evolution = bcg_evolution(products, periods, share, growth)
+    print(f"BCG categories over {len(evolution['periods'])} periods for {len(evolution['trajectories'])} products")
+    return evolution
+
+
+def run_bcg_analysis(csv_file_path, output_file_path, metrics=None, over_time=False):
+    """
+    Classify the products of one CSV into BCG quadrants, or those of the
+    already computed invoice metrics if given.
+
+    Writes the matrix image to output_file_path and the summary next to it
+    (<name>_summary.json) and returns the summary. With over_time the
+    summary also gets an "evolution": the categories of every product
+    month by month, how products moved between them and each product's
+    trajectory (see product_evolution). If the analysis fails outright an
+    error image and a minimal summary are written before the exception is
+    re-raised.
+    """
+    print(f"Processing file: {csv_file_path}")
+    print(f"Output will be saved to: {output_file_path}")
 
-    # Step 3: Plot BCG Matrix with improved styling
     try:
-        plt.figure(figsize=(12, 8))
-        plt.style.use('seaborn-v0_8-whitegrid')
-
-        # Create scatter plot
-        scatter = sns.scatterplot(
-            data=df,
-            x="MarketShare", 
-            y="MarketGrowth",
-            hue="BCG Category", 
-            style="BCG Category", 
-            s=150,
-            alpha=0.8,
-            palette={
-                "Star": "#FFD700",      # Gold
-                "Cash Cow": "#32CD32",  # Lime Green
-                "Question Mark": "#1E90FF", # Dodger Blue
-                "Dog": "#FF6347"        # Tomato
-            }
-        )
+        df = None
+        if metrics is None:
+            metrics, df = load_table(csv_file_path)
+        if metrics is not None:
+            df = invoice_products(metrics)
+        print(f"Column names: {df.columns.tolist()}")
+    
+        df, name_column = prepare_products(df)
+        evolution = product_evolution(metrics, df, name_column) if over_time else None
 
-        # Add product names as labels with limit to prevent overcrowding
-        max_labels = min(15, len(df))
-        for idx, row in df.head(max_labels).iterrows():
+        # Make sure we have at least some data
+        if len(df) == 0:
+            print("Warning: DataFrame is empty. Creating sample data for demonstration.")
+            # Create sample data
+            df = pd.DataFrame({
+                name_column: ["Sample Product 1", "Sample Product 2", "Sample Product 3", "Sample Product 4"],
+                "MarketShare": [8, 12, 3, 5],
+                "MarketGrowth": [15, 5, 20, -2],
+                "Quantity": [100, 200, 50, 80],
+            })
+        elif len(df) < 4:
+            print(f"Warning: Only {len(df)} data points. Adding sample data points.")
+            # Add some sample data points
+            sample_data = pd.DataFrame({
+                name_column: ["Sample Product 1", "Sample Product 2", "Sample Product 3"],
+                "MarketShare": [8, 12, 3],
+                "MarketGrowth": [15, 5, 20],
+                "Quantity": [100, 200, 50],
+            })
+            df = pd.concat([df, sample_data], ignore_index=True)
+
+        # Display data summary
+        print("\nData Summary:")
+        for col in ["MarketShare", "MarketGrowth", "Quantity"]:
             try:
-                label = str(row[name_column]) if not pd.isna(row[name_column]) else f"Product {idx}"
-                label = label[:15] + '...' if len(label) > 15 else label
-                plt.annotate(
-                    label,
-                    xy=(row['MarketShare'], row['MarketGrowth']),
-                    xytext=(5, 5),
-                    textcoords='offset points',
-                    fontsize=8
-                )
+                # Handle potential errors with min/max/mean calculations
+                min_val = float(df[col].min()) if not pd.isna(df[col].min()) else 0
+                max_val = float(df[col].max()) if not pd.isna(df[col].max()) else 0
+                mean_val = float(df[col].mean()) if not pd.isna(df[col].mean()) else 0
+                median_val = float(df[col].median()) if not pd.isna(df[col].median()) else 0
+            
+                print(f"  {col}: Min={min_val:.2f}, Max={max_val:.2f}, Mean={mean_val:.2f}, Median={median_val:.2f}")
             except Exception as e:
-                print(f"Error annotating label for row {idx}: {e}")
+                print(f"  {col}: Error calculating statistics - {str(e)}")
+                print(f"  {col}: Using default values")
+                print(f"  {col}: Min=0.00, Max=10.00, Mean=5.00, Median=5.00")
 
-        # Get axis limits with error handling
+        # Step 1: Compute dynamic thresholds using median, as every BCG path does
         try:
-            x_min = float(df['MarketShare'].min()) if not pd.isna(df['MarketShare'].min()) else 0
-            x_max = float(df['MarketShare'].max()) if not pd.isna(df['MarketShare'].max()) else 10
-            y_min = float(df['MarketGrowth'].min()) if not pd.isna(df['MarketGrowth'].min()) else 0
-            y_max = float(df['MarketGrowth'].max()) if not pd.isna(df['MarketGrowth'].max()) else 10
-            
-            # Ensure we have valid ranges
-            if x_min >= x_max:
-                x_min = 0
-                x_max = 10
-            if y_min >= y_max:
-                y_min = 0
-                y_max = 10
-                
-            # Add some padding
-            x_range = x_max - x_min
-            y_range = y_max - y_min
-            x_min -= x_range * 0.1
-            x_max += x_range * 0.1
-            y_min -= y_range * 0.1
-            y_max += y_range * 0.1
-            
-            plt.xlim(x_min, x_max)
-            plt.ylim(y_min, y_max)
+            medians = {col: threshold(df[col], 0.5) for col in ["MarketShare", "MarketGrowth"]}
+            share_thresh = medians["MarketShare"] if not np.isnan(medians["MarketShare"]) else 5.0
+            growth_thresh = medians["MarketGrowth"] if not np.isnan(medians["MarketGrowth"]) else 5.0
         except Exception as e:
-            print(f"Error setting axis limits: {e}")
-            # Use default limits
-            plt.xlim(0, 10)
-            plt.ylim(0, 10)
+            print(f"Error calculating thresholds: {str(e)}")
+            print("Using default thresholds")
+            share_thresh = 5.0
+            growth_thresh = 5.0
 
-        # Add quadrant lines
-        plt.axvline(x=share_thresh, color='grey', linestyle='--', alpha=0.6)
-        plt.axhline(y=growth_thresh, color='grey', linestyle='--', alpha=0.6)
+        print(f"\nCalculated Thresholds:")
+        print(f"  Market Share Threshold: {share_thresh:.2f}")
+        print(f"  Market Growth Threshold: {growth_thresh:.2f}")
 
-        # Add quadrant labels with safe positioning
+        # Step 2: Classification Logic
+        # Classify every product in one vectorized pass (missing values count as 0)
         try:
-            plt.text(x_max*0.75, y_max*0.9, 'STARS', fontsize=14, fontweight='bold', color='#FFD700')
-            plt.text(x_max*0.75, y_min*0.9, 'CASH COWS', fontsize=14, fontweight='bold', color='#32CD32')
-            plt.text(x_min*1.1, y_max*0.9, 'QUESTION MARKS', fontsize=14, fontweight='bold', color='#1E90FF')
-            plt.text(x_min*1.1, y_min*0.9, 'DOGS', fontsize=14, fontweight='bold', color='#FF6347')
+            df['BCG Category'] = classify_quadrants(
+                pd.to_numeric(first_column(df, 'MarketShare'), errors='coerce').fillna(0),
+                pd.to_numeric(first_column(df, 'MarketGrowth'), errors='coerce').fillna(0),
+                share_thresh,
+                growth_thresh
+            )
         except Exception as e:
-            print(f"Error adding quadrant labels: {e}")
-
-        # Styling
-        plt.title("BCG Matrix Analysis", fontsize=16, fontweight='bold')
-        plt.xlabel(f"Market Share (Threshold: {share_thresh:.2f})", fontsize=12)
-        plt.ylabel(f"Market Growth Rate (Threshold: {growth_thresh:.2f})", fontsize=12)
-        plt.legend(title="Categories", fontsize=10, title_fontsize=12)
-        plt.grid(True, alpha=0.3)
-        plt.tight_layout()
-
-        # Save the figure
-        output_dir = os.path.dirname(output_file_path)
-        if output_dir and not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-            
-        plt.savefig(output_file_path, dpi=300, bbox_inches='tight')
-        print(f"\nBCG Matrix visualization saved to: {output_file_path}")
-    except Exception as e:
-        print(f"Error creating BCG Matrix plot: {e}")
-        print(traceback.format_exc())
-        # Create a simple fallback plot
+            print(f"Error applying classification: {str(e)}")
+            print("Creating default classification")
+            # Create default classification
+            df['BCG Category'] = ["Star", "Cash Cow", "Question Mark", "Dog"] * (len(df) // 4 + 1)
+            df['BCG Category'] = df['BCG Category'].head(len(df))
+
+        # Extract top products by Quantity
         try:
-            plt.figure(figsize=(12, 8))
-            plt.text(0.5, 0.5, "Error generating BCG Matrix\nPlease check your data", 
-                    horizontalalignment='center', fontsize=20)
-            plt.axis('off')
-            plt.savefig(output_file_path, dpi=300, bbox_inches='tight')
-            print(f"Created fallback image at: {output_file_path}")
-        except Exception as e2:
-            print(f"Error creating fallback plot: {e2}")
-            # If all else fails, create an empty file
-            with open(output_file_path, 'w') as f:
-                f.write('')
-
-    # Generate summary statistics
-    try:
-        # Get category counts with error handling
-        category_counts = df['BCG Category'].value_counts().to_dict()
+            # Make sure we have enough products
+            if len(df) < 10:
+                print(f"Warning: Only {len(df)} products available for top products list")
+                top_products = df
+            else:
+                top_products = df.sort_values("Quantity", ascending=False, kind="stable").head(10)
         
+            top_products_list = top_product_rows(top_products, name_column)
+        
+            print(f"\nTop {len(top_products_list)} products by quantity identified")
+        except Exception as e:
+            print(f"Error extracting top products: {e}")
+            print(traceback.format_exc())
+            # Create sample top products
+            top_products_list = [dict(product) for product in SAMPLE_TOP_PRODUCTS]
+
         # Print classification counts
+        category_counts = df['BCG Category'].value_counts().to_dict()
         print("\nBCG Classification Results:")
         print(f"  Stars: {category_counts.get('Star', 0)}")
         print(f"  Cash Cows: {category_counts.get('Cash Cow', 0)}")
         print(f"  Question Marks: {category_counts.get('Question Mark', 0)}")
         print(f"  Dogs: {category_counts.get('Dog', 0)}")
         print(f"  Total Products: {len(df)}")
+
+        # Step 3: Plot BCG Matrix with improved styling
+        try:
+            # Save the figure
+            output_dir = os.path.dirname(output_file_path)
+            if output_dir and not os.path.exists(output_dir):
+                os.makedirs(output_dir)
         
-        summary = {
-            'thresholds': {
-                'market_share': float(share_thresh),
-                'growth_rate': float(growth_thresh)
-            },
-            'counts': {
-                'star': int(category_counts.get('Star', 0)),
-                'cash_cow': int(category_counts.get('Cash Cow', 0)),
-                'question_mark': int(category_counts.get('Question Mark', 0)),
-                'dog': int(category_counts.get('Dog', 0)),
-                'total': int(len(df))
-            },
-            'top_products': top_products_list
-        }
+            names = [
+                str(name) if not pd.isna(name) else f"Product {idx}"
+                for idx, name in df[name_column].items()
+            ]
+            render_chart(chart_spec(
+                "bcg_quadrants", output_file_path,
+                names=names,
+                shares=df['MarketShare'].astype(float).tolist(),
+                growths=df['MarketGrowth'].astype(float).tolist(),
+                categories=df['BCG Category'].astype(str).tolist(),
+                share_thresh=share_thresh,
+                growth_thresh=growth_thresh
+            ))
+            print(f"\nBCG Matrix visualization saved to: {output_file_path}")
+        except Exception as e:
+            print(f"Error creating BCG Matrix plot: {e}")
+            print(traceback.format_exc())
+            # Create a simple fallback plot
+            try:
+                render_chart(chart_spec(
+                    "message_image", output_file_path,
+                    message="Error generating BCG Matrix\nPlease check your data"
+                ))
+                print(f"Created fallback image at: {output_file_path}")
+            except Exception as e2:
+                print(f"Error creating fallback plot: {e2}")
+                # If all else fails, create an empty file
+                with open(output_file_path, 'w') as f:
+                    f.write('')
 
-        # Write summary to file
-        summary_path = output_file_path.replace('.png', '_summary.json')
-        with open(summary_path, 'w') as f:
-            json.dump(summary, f)
-        print(f"Summary data saved to: {summary_path}")
+        # Generate summary statistics
+        try:
+            # Get category counts with error handling
+            category_counts = df['BCG Category'].value_counts().to_dict()
+        
+            # Print classification counts
+            print("\nBCG Classification Results:")
+            print(f"  Stars: {category_counts.get('Star', 0)}")
+            print(f"  Cash Cows: {category_counts.get('Cash Cow', 0)}")
+            print(f"  Question Marks: {category_counts.get('Question Mark', 0)}")
+            print(f"  Dogs: {category_counts.get('Dog', 0)}")
+            print(f"  Total Products: {len(df)}")
+        
+            summary = {
+                'thresholds': {
+                    'market_share': float(share_thresh),
+                    'growth_rate': float(growth_thresh)
+                },
+                'counts': {
+                    'star': int(category_counts.get('Star', 0)),
+                    'cash_cow': int(category_counts.get('Cash Cow', 0)),
+                    'question_mark': int(category_counts.get('Question Mark', 0)),
+                    'dog': int(category_counts.get('Dog', 0)),
+                    'total': int(len(df))
+                },
+                'top_products': top_products_list
+            }
+            if evolution is not None:
+                summary['evolution'] = evolution
 
-        print("\nAnalysis complete. Ready for AI processing.")
-    except Exception as e:
-        print(f"Error generating summary: {e}")
-        print(traceback.format_exc())
+            # Write summary to file
+            summary_path = output_file_path.replace('.png', '_summary.json')
+            with open(summary_path, 'w') as f:
+                json.dump(summary, f)
+            print(f"Summary data saved to: {summary_path}")
+
+            print("\nAnalysis complete. Ready for AI processing.")
+            return summary
+        except Exception as e:
+            print(f"Error generating summary: {e}")
+            print(traceback.format_exc())
         
-        # Create a default summary
-        default_summary = {
-            'thresholds': {
-                'market_share': 5.0,
-                'growth_rate': 5.0
-            },
-            'counts': {
-                'star': 1,
-                'cash_cow': 1,
-                'question_mark': 1,
-                'dog': 1,
-                'total': 4
-            },
-            'top_products': top_products_list if top_products_list else [
-                {"name": "Sample Product 1", "quantity": 100, "category": "Star", "market_share": 8, "growth_rate": 15},
-                {"name": "Sample Product 2", "quantity": 80, "category": "Cash Cow", "market_share": 12, "growth_rate": 5},
-                {"name": "Sample Product 3", "quantity": 60, "category": "Question Mark", "market_share": 3, "growth_rate": 20},
-                {"name": "Sample Product 4", "quantity": 40, "category": "Dog", "market_share": 5, "growth_rate": -2}
-            ]
-        }
+            # Create a default summary
+            default_summary = {
+                'thresholds': {
+                    'market_share': 5.0,
+                    'growth_rate': 5.0
+                },
+                'counts': {
+                    'star': 1,
+                    'cash_cow': 1,
+                    'question_mark': 1,
+                    'dog': 1,
+                    'total': 4
+                },
+                'top_products': top_products_list if top_products_list else [dict(product) for product in SAMPLE_TOP_PRODUCTS]
+            }
         
-        # Write default summary to file
-        summary_path = output_file_path.replace('.png', '_summary.json')
-        with open(summary_path, 'w') as f:
-            json.dump(default_summary, f)
-        print(f"Default summary data saved to: {summary_path}")
+            # Write default summary to file
+            summary_path = output_file_path.replace('.png', '_summary.json')
+            with open(summary_path, 'w') as f:
+                json.dump(default_summary, f)
+            print(f"Default summary data saved to: {summary_path}")
+            return default_summary
         
-except Exception as e:
+    except Exception as e:
+        write_failure(output_file_path, e)
+        raise
+
+
+def write_failure(output_file_path, e):
+    """Error image and minimal summary for an analysis that failed outright"""
     print(f"ERROR: An unhandled exception occurred: {str(e)}")
     print(traceback.format_exc())
-    
+
     # Try to create minimal output files to prevent complete failure
     try:
         # Create a simple error image
-        plt.figure(figsize=(12, 8))
-        plt.text(0.5, 0.5, f"Error: {str(e)}\n\nPlease check your data", 
-                horizontalalignment='center', fontsize=20)
-        plt.axis('off')
-        plt.savefig(output_file_path, dpi=300, bbox_inches='tight')
-        
+        render_chart(chart_spec("message_image", output_file_path, message=f"Error: {str(e)}\n\nPlease check your data"))
+    
         # Create a minimal summary
         minimal_summary = {
             'thresholds': {'market_share': 5.0, 'growth_rate': 5.0},
@@ -544,12 +569,475 @@ except Exception as e:
             'top_products': [],
             'error': str(e)
         }
-        
+    
         # Write minimal summary to file
         summary_path = output_file_path.replace('.png', '_summary.json')
         with open(summary_path, 'w') as f:
             json.dump(minimal_summary, f)
     except:
         pass
-        
-    sys.exit(1) 
\ No newline at end of file
+
+
+def replay_plan(chunk, plan, chunk_no):
+    """Repeat the column decisions prepare_products() recorded in plan on one chunk"""
+    df = chunk
+    # Synthetic columns must come out the same on every pass over the file
+    rng = np.random.default_rng(chunk_no)
+    for step, *args in plan["steps"]:
+        if step == "rename":
+            df = df.rename(columns=args[0])
+        elif step == "names":
+            df[args[0]] = [f'Product {i+1}' for i in df.index]
+        elif step == "copy":
+            df[args[0]] = df[args[1]]
+        elif step == "random":
+            df[args[0]] = rng.uniform(args[1], args[2], size=len(df))
+        elif step == "fill":
+            df[args[0]] = args[1]
+        elif step == "clean":
+            df[args[0]] = pd.to_numeric(df[args[0]], errors='coerce').fillna(0)
+    return df
+
+
+def _plan_columns(plan):
+    # Positions of the CSV columns the plan reads; positions rather than names
+    # because pandas renames duplicate headers ("a", "a.1")
+    needed = {plan["name_column"], "MarketShare", "MarketGrowth", "Quantity"}
+    needed.update(args[1] for step, *args in plan["steps"] if step == "copy")
+    rename = next((args[0] for step, *args in plan["steps"] if step == "rename"), {})
+    columns = [i for i, col in enumerate(plan["columns"]) if rename.get(col, col) in needed]
+    return columns or None
+
+
+def run_bcg_analysis_streaming(csv_file_path, output_file_path, chunksize=None, sketch_error=None, over_time=False,
+                               exact=False):
+    """
+    run_bcg_analysis for files too big to load: the file (CSV or columnar)
+    is read chunksize rows at a time, so memory stays flat however many
+    rows it has.
+
+    The columns are picked on the first chunk and reused for the rest.
+    The file is read twice: once for the median thresholds, from
+    QuantileSketches within about sketch_error (STREAM_SKETCH_ERROR by
+    default) * rows ranks of the exact median, and once to classify every
+    chunk and keep the category counts and the top products by Quantity.
+    With exact the thresholds are the exact medians instead, which takes
+    one to three more reads (see bcg.stream_medians), and the summary is
+    the same as run_bcg_analysis gives; ties in Quantity keep file order in
+    both modes. The chart draws a random sample of at most
+    STREAM_PLOT_POINTS products over the axes of the full data. Files that
+    fit in one chunk go through run_bcg_analysis.
+
+    Invoice-level files are rolled up chunk by chunk and then analyzed,
+    over_time included, by run_bcg_analysis; other files get no over-time
+    analysis when streamed.
+    """
+    chunksize = max(chunksize or STREAM_CHUNK_ROWS, TOP_PRODUCTS)
+    print(f"Streaming file: {csv_file_path} ({chunksize} rows per chunk)")
+    print(f"Output will be saved to: {output_file_path}")
+
+    try:
+        try:
+            first = next(read_table(csv_file_path, chunksize=chunksize), None)
+        except Exception as e:
+            raise Exception(f"Could not read CSV file: {str(e)}")
+
+        if first is None or len(first) < chunksize:
+            print("File fits in one chunk, analyzing it in memory")
+            return run_bcg_analysis(csv_file_path, output_file_path, over_time=over_time)
+
+        if has_invoice_columns(first.columns):
+            # Invoices are rolled up chunk by chunk; the products fit in memory
+            print("Invoice-level file, rolling it up into products")
+            del first
+            rollup = rollup_invoice_chunks(read_table(csv_file_path, columns=INVOICE_COLUMNS, chunksize=chunksize))
+            return run_bcg_analysis(csv_file_path, output_file_path, metrics=market_metrics(rollup),
+                                    over_time=over_time)
+        if over_time:
+            print("Over-time analysis needs invoice-level data when streaming, skipping it")
+
+        plan = {}
+        _, name_column = prepare_products(first, plan)
+        columns = _plan_columns(plan)
+        del first
+
+        read_report = {}
+
+        def chunks():
+            reader = read_table(csv_file_path, read_report, columns=columns, chunksize=chunksize)
+            for chunk_no, chunk in enumerate(reader):
+                yield replay_plan(chunk, plan, chunk_no)
+
+        # Step 1: Median thresholds
+        def numeric_chunks():
+            for chunk in chunks():
+                for col in ["MarketShare", "MarketGrowth"]:
+                    if chunk[col].ndim > 1:
+                        raise ValueError(f"The column label '{col}' is not unique.")
+                yield chunk[["MarketShare", "MarketGrowth"]]
+
+        try:
+            if exact:
+                medians = stream_medians(numeric_chunks, ["MarketShare", "MarketGrowth"])
+            else:
+                error = sketch_error or STREAM_SKETCH_ERROR
+                sketches = {col: QuantileSketch(error) for col in ["MarketShare", "MarketGrowth"]}
+                for chunk in numeric_chunks():
+                    for col, sketch in sketches.items():
+                        sketch.update(chunk[col])
+                medians = {col: threshold(sketch) for col, sketch in sketches.items()}
+            share_thresh = medians["MarketShare"] if not np.isnan(medians["MarketShare"]) else 5.0
+            growth_thresh = medians["MarketGrowth"] if not np.isnan(medians["MarketGrowth"]) else 5.0
+        except Exception as e:
+            print(f"Error calculating thresholds: {str(e)}")
+            print("Using default thresholds")
+            share_thresh = 5.0
+            growth_thresh = 5.0
+
+        print(f"\nCalculated Thresholds:")
+        print(f"  Market Share Threshold: {share_thresh:.2f}")
+        print(f"  Market Growth Threshold: {growth_thresh:.2f}")
+
+        # Step 2: Classify chunk by chunk, keeping counts, the top products
+        # and a bounded random sample of points for the chart
+        category_counts = {}
+        total = 0
+        top_products = None
+        top_error = None
+        sample = None
+        extent = [np.inf, -np.inf, np.inf, -np.inf]
+        sampler = np.random.default_rng(0)
+
+        for chunk in chunks():
+            shares = pd.to_numeric(first_column(chunk, 'MarketShare'), errors='coerce').fillna(0)
+            growths = pd.to_numeric(first_column(chunk, 'MarketGrowth'), errors='coerce').fillna(0)
+            chunk['BCG Category'] = classify_quadrants(shares, growths, share_thresh, growth_thresh)
+
+            total += len(chunk)
+            for category, count in chunk['BCG Category'].value_counts().items():
+                category_counts[category] = category_counts.get(category, 0) + int(count)
+
+            if top_error is None:
+                try:
+                    best = chunk.nlargest(TOP_PRODUCTS, "Quantity")
+                    if top_products is not None:
+                        best = pd.concat([top_products, best]).nlargest(TOP_PRODUCTS, "Quantity")
+                    top_products = best
+                except Exception as e:
+                    top_error = e
+
+            extent = [
+                min(extent[0], shares.min()), max(extent[1], shares.max()),
+                min(extent[2], growths.min()), max(extent[3], growths.max())
+            ]
+            points = pd.DataFrame({
+                "name": chunk[name_column],
+                "share": shares,
+                "growth": growths,
+                "category": chunk['BCG Category'],
+                "key": sampler.random(len(chunk))
+            })
+            if sample is not None:
+                points = pd.concat([sample, points])
+            sample = points.nsmallest(STREAM_PLOT_POINTS, "key")
+            del chunk, points
+
+        try:
+            if top_error is not None:
+                raise top_error
+            top_products_list = top_product_rows(top_products, name_column)
+            print(f"\nTop {len(top_products_list)} products by quantity identified")
+        except Exception as e:
+            print(f"Error extracting top products: {e}")
+            top_products_list = [dict(product) for product in SAMPLE_TOP_PRODUCTS]
+
+        print(f"\nRead {total} rows in chunks ({read_report['skippedLines']} malformed lines skipped)")
+        print("\nBCG Classification Results:")
+        print(f"  Stars: {category_counts.get('Star', 0)}")
+        print(f"  Cash Cows: {category_counts.get('Cash Cow', 0)}")
+        print(f"  Question Marks: {category_counts.get('Question Mark', 0)}")
+        print(f"  Dogs: {category_counts.get('Dog', 0)}")
+        print(f"  Total Products: {total}")
+
+        # Step 3: Plot the sampled products in file order
+        try:
+            output_dir = os.path.dirname(output_file_path)
+            if output_dir and not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+
+            sample = sample.sort_index(kind="stable")
+            render_chart(chart_spec(
+                "bcg_quadrants", output_file_path,
+                names=[
+                    str(name) if not pd.isna(name) else f"Product {idx}"
+                    for idx, name in sample["name"].items()
+                ],
+                shares=sample["share"].astype(float).tolist(),
+                growths=sample["growth"].astype(float).tolist(),
+                categories=sample["category"].astype(str).tolist(),
+                share_thresh=share_thresh,
+                growth_thresh=growth_thresh,
+                extent=[float(value) for value in extent]
+            ))
+            print(f"\nBCG Matrix visualization saved to: {output_file_path} ({len(sample)} of {total} products shown)")
+        except Exception as e:
+            print(f"Error creating BCG Matrix plot: {e}")
+            print(traceback.format_exc())
+            render_chart(chart_spec(
+                "message_image", output_file_path,
+                message="Error generating BCG Matrix\nPlease check your data"
+            ))
+
+        summary = {
+            'thresholds': {
+                'market_share': float(share_thresh),
+                'growth_rate': float(growth_thresh)
+            },
+            'counts': {
+                'star': int(category_counts.get('Star', 0)),
+                'cash_cow': int(category_counts.get('Cash Cow', 0)),
+                'question_mark': int(category_counts.get('Question Mark', 0)),
+                'dog': int(category_counts.get('Dog', 0)),
+                'total': int(total)
+            },
+            'top_products': top_products_list
+        }
+
+        summary_path = output_file_path.replace('.png', '_summary.json')
+        with open(summary_path, 'w') as f:
+            json.dump(summary, f)
+        print(f"Summary data saved to: {summary_path}")
+        return summary
+
+    except Exception as e:
+        write_failure(output_file_path, e)
+        raise
+
+
+def batch_inputs(paths, scratch_dir):
+    """
+    The files a batch analyzes: files as given, the tables directly inside
+    directories (in name order) and those inside zip archives, which are
+    extracted into scratch_dir
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if is_table_name(name) and os.path.isfile(os.path.join(path, name)))
+        elif zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                for member in archive.infolist():
+                    if member.is_dir() or not is_table_name(member.filename):
+                        continue
+                    # Flattened, so no member can land outside scratch_dir
+                    target_dir = os.path.join(scratch_dir, str(len(files)))
+                    os.makedirs(target_dir)
+                    target = os.path.join(target_dir, os.path.basename(member.filename))
+                    with archive.open(member) as source, open(target, "wb") as extracted:
+                        shutil.copyfileobj(source, extracted, 1024 * 1024)
+                    files.append(target)
+        else:
+            files.append(path)
+    return files
+
+
+def _analyze_batch_file(csv_file_path, output_file_path, stream, sketch_error, over_time, exact):
+    # Runs in a batch worker; progress messages go to the file's own log
+    started = time.time()
+    log_path = os.path.splitext(output_file_path)[0] + ".log"
+    with open(log_path, "w") as log, contextlib.redirect_stdout(log):
+        try:
+            if stream:
+                summary = run_bcg_analysis_streaming(csv_file_path, output_file_path, sketch_error=sketch_error,
+                                                     over_time=over_time, exact=exact)
+            else:
+                summary = run_bcg_analysis(csv_file_path, output_file_path, over_time=over_time)
+            entry = {"ok": True, "imagePath": output_file_path, "summary": summary}
+        except Exception as e:
+            entry = {"ok": False, "error": str(e)}
+    entry.update(seconds=round(time.time() - started, 3), log=log_path)
+    return entry
+
+
+def merge_summaries(summaries):
+    """
+    Portfolio summary of a batch: the files' category counts (and, from
+    over-time analyses, transitions) added up and the top products by
+    quantity across all of them, each tagged with its file
+    """
+    counts = {key: 0 for key in ["star", "cash_cow", "question_mark", "dog", "total"]}
+    transitions = None
+    top_products = []
+    for name, summary in summaries:
+        for key in counts:
+            counts[key] += summary["counts"].get(key, 0)
+        top_products.extend(dict(product, file=name) for product in summary.get("top_products", []))
+        if "evolution" in summary:
+            if transitions is None:
+                transitions = {source: dict.fromkeys(targets, 0)
+                               for source, targets in summary["evolution"]["transitions"].items()}
+            for source, targets in summary["evolution"]["transitions"].items():
+                for target, count in targets.items():
+                    transitions[source][target] += count
+
+    portfolio = {
+        "files": len(summaries),
+        "counts": counts,
+        "top_products": sorted(top_products, key=lambda product: product["quantity"], reverse=True)[:TOP_PRODUCTS]
+    }
+    if transitions is not None:
+        portfolio["transitions"] = transitions
+    return portfolio
+
+
+def run_bcg_batch(paths, output_dir, workers=None, stream=False, sketch_error=None, over_time=False, exact=False):
+    """
+    run_bcg_analysis (or, with stream, run_bcg_analysis_streaming) for
+    many files at once, side by side in up to workers processes.
+
+    paths may name files, directories and zip archives (see batch_inputs).
+    Each file gets <name>.png, <name>_summary.json and <name>.log in
+    output_dir; a file failing doesn't stop the others. The per-file
+    entries and merge_summaries() of the successful ones are written to
+    output_dir/batch_summary.json and returned.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    scratch_dir = tempfile.mkdtemp(prefix="bcg_batch_")
+    try:
+        files = batch_inputs(paths, scratch_dir)
+        if not files:
+            raise Exception("No files to analyze")
+
+        # One output name per file, even when two share a name
+        outputs = []
+        for path in files:
+            stem = os.path.splitext(os.path.basename(path))[0]
+            name = stem if stem not in outputs else f"{stem}_{len(outputs)}"
+            outputs.append(name)
+
+        workers = max(1, min(workers or BATCH_WORKERS, len(files)))
+        print(f"Analyzing {len(files)} files with {workers} workers")
+        started = time.time()
+        entries = [None] * len(files)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {
+                executor.submit(_analyze_batch_file, path, os.path.join(output_dir, f"{name}.png"),
+                                stream, sketch_error, over_time, exact): index
+                for index, (path, name) in enumerate(zip(files, outputs))
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                index = futures[future]
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    # The worker itself died, e.g. killed for memory
+                    entry = {"ok": False, "error": str(e)}
+                entries[index] = dict({"file": os.path.basename(files[index]), "name": outputs[index]}, **entry)
+                status = "ok" if entry["ok"] else f"failed: {entry['error']}"
+                print(f"[{done}/{len(files)}] {os.path.basename(files[index])}: {status}")
+
+        succeeded = [(entry["file"], entry["summary"]) for entry in entries if entry["ok"]]
+        batch_summary = {
+            "files": entries,
+            "analyzed": len(succeeded),
+            "failed": len(entries) - len(succeeded),
+            "seconds": round(time.time() - started, 3),
+            "portfolio": merge_summaries(succeeded)
+        }
+        summary_path = os.path.join(output_dir, "batch_summary.json")
+        with open(summary_path, "w") as f:
+            json.dump(batch_summary, f)
+        print(f"Analyzed {len(succeeded)} of {len(files)} files in {batch_summary['seconds']:.1f}s, "
+              f"summary saved to: {summary_path}")
+        return batch_summary
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def serve(stdin=None, stdout=None):
+    """
+    Resident mode: keep pandas/matplotlib/seaborn loaded and analyze one CSV
+    per request.
+
+    Requests are JSON lines on stdin, e.g.
+        {"id": 1, "csv": "in.csv", "output": "bcg_matrix_1.png"}
+    ("stream": true reads the CSV in chunks, with "sketchError": 0.01 or
+    "exact": true for its thresholds, see run_bcg_analysis_streaming; "overTime":
+    true adds the evolution of the categories, see run_bcg_analysis)
+    and each gets one JSON line back on stdout:
+        {"id": 1, "ok": true, "imagePath": "bcg_matrix_1.png", "summary": {...}}
+        {"id": 1, "ok": false, "error": "..."}
+    Progress messages go to stderr so stdout only carries responses.
+    """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+
+    # Pay the import cost once, before the first request
+    import seaborn  # noqa: F401
+    from matplotlib.backends.backend_agg import FigureCanvasAgg  # noqa: F401
+
+    stdout.write(json.dumps({"ready": True}) + "\n")
+    stdout.flush()
+
+    for line in stdin:
+        if not line.strip():
+            continue
+
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            with contextlib.redirect_stdout(sys.stderr):
+                if request.get("stream"):
+                    summary = run_bcg_analysis_streaming(
+                        request["csv"], request["output"], sketch_error=request.get("sketchError"),
+                        over_time=bool(request.get("overTime")), exact=bool(request.get("exact"))
+                    )
+                else:
+                    summary = run_bcg_analysis(request["csv"], request["output"], over_time=bool(request.get("overTime")))
+            response = {"id": request_id, "ok": True, "imagePath": request["output"], "summary": summary}
+        except Exception as e:
+            response = {"id": request_id, "ok": False, "error": str(e)}
+
+        stdout.write(json.dumps(response) + "\n")
+        stdout.flush()
+
+
+def main(argv):
+    # Usage: python ball.py input_csv_path output_image_path [--stream [--sketch-error=0.01 | --exact]] [--over-time]
+    #        python ball.py --batch output_dir inputs... [--workers=4] [--stream [--exact]] [--over-time]
+    #        python ball.py --serve
+    if len(argv) > 1 and argv[1] == "--serve":
+        serve()
+        return
+
+    stream = "--stream" in argv
+    over_time = "--over-time" in argv
+    exact = "--exact" in argv
+    sketch_error = next((float(arg.split("=", 1)[1]) for arg in argv if arg.startswith("--sketch-error=")), None)
+    args = [arg for arg in argv if not arg.startswith("--")]
+
+    # Inputs may be files, directories or zip archives
+    if len(argv) > 1 and argv[1] == "--batch":
+        workers = next((int(arg.split("=", 1)[1]) for arg in argv if arg.startswith("--workers=")), None)
+        try:
+            batch = run_bcg_batch(args[2:], args[1], workers, stream, sketch_error, over_time, exact)
+        except Exception as e:
+            print(f"Batch failed: {e}")
+            sys.exit(1)
+        sys.exit(1 if batch["failed"] else 0)
+    csv_file_path = args[1] if len(args) > 1 else "sample.csv"
+    output_file_path = args[2] if len(args) > 2 else "bcg_matrix_output.png"
+    try:
+        if stream:
+            run_bcg_analysis_streaming(csv_file_path, output_file_path, sketch_error=sketch_error,
+                                       over_time=over_time, exact=exact)
+        else:
+            run_bcg_analysis(csv_file_path, output_file_path, over_time=over_time)
+    except Exception:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,207 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from typing import List, Optional
+
+from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+
+from analysis_pool import waiting_for_capacity
+from charts import RENDER_MODES
+from table_loader import is_table_name
+from uploads import UPLOAD_SPILL_DIR, Upload
+
+# Most files one batch may analyze, counting those inside zips and directories
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "500"))
+
+# Server directory whose subdirectories batches may name; unset, directories are refused
+BATCH_INPUT_DIR = os.environ.get("BATCH_INPUT_DIR")
+
+# Bytes of one batch's files held in memory; the rest are spilled to files
+BATCH_MEMORY_BYTES = int(os.environ.get("BATCH_MEMORY_MB", "64")) * 1024 * 1024
+
+
+def _memory_used(uploads):
+    return sum(len(upload.data) for upload in uploads if upload.data is not None)
+
+
+def zip_uploads(fileobj, memory_bytes=BATCH_MEMORY_BYTES, spill_dir=UPLOAD_SPILL_DIR):
+    """
+    An Upload per table in a zip archive (see table_loader.is_table_name),
+    in archive order. Members are kept in memory while they add up to at
+    most memory_bytes; the others are spilled to files
+    """
+    uploads = []
+    in_memory = 0
+    try:
+        with zipfile.ZipFile(fileobj) as archive:
+            for member in archive.infolist():
+                if member.is_dir() or not is_table_name(member.filename):
+                    continue
+                if len(uploads) >= BATCH_MAX_FILES:
+                    raise HTTPException(status_code=400, detail=f"A batch takes at most {BATCH_MAX_FILES} files")
+                if in_memory + member.file_size <= memory_bytes:
+                    uploads.append(Upload(member.filename, data=archive.read(member)))
+                    in_memory += member.file_size
+                    continue
+                suffix = os.path.splitext(member.filename)[1]
+                fd, path = tempfile.mkstemp(prefix="upload_", suffix=suffix, dir=spill_dir)
+                uploads.append(Upload(member.filename, path=path))
+                with os.fdopen(fd, "wb") as spill, archive.open(member) as source:
+                    shutil.copyfileobj(source, spill, 1024 * 1024)
+    except zipfile.BadZipFile as e:
+        discard_all(uploads)
+        raise HTTPException(status_code=400, detail=f"Error reading zip file: {str(e)}")
+    except BaseException:
+        discard_all(uploads)
+        raise
+    return uploads
+
+
+def directory_uploads(directory, root=BATCH_INPUT_DIR):
+    """
+    An Upload per table directly inside a directory under root, in name
+    order; the files are read where they are and never deleted
+    """
+    if not root:
+        raise HTTPException(status_code=400, detail="Directory batches are disabled: BATCH_INPUT_DIR is not set")
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, directory))
+    if os.path.commonpath([root, path]) != root or not os.path.isdir(path):
+        raise HTTPException(status_code=404, detail="Directory not found")
+    names = sorted(name for name in os.listdir(path)
+                   if is_table_name(name) and os.path.isfile(os.path.join(path, name)))
+    return [Upload(name, path=os.path.join(path, name), keep=True) for name in names]
+
+
+def receive_batch(files=(), directory=None):
+    """
+    The Uploads of a batch request: each uploaded file, with zip archives
+    opened up into the tables they hold, then the tables of directory.
+    Together they hold at most BATCH_MEMORY_BYTES in memory; files past
+    that are spilled to disk however small they are
+    """
+    uploads = []
+    try:
+        for file in files:
+            room = max(0, BATCH_MEMORY_BYTES - _memory_used(uploads))
+            if zipfile.is_zipfile(file.file):
+                uploads.extend(zip_uploads(file.file, room))
+            else:
+                uploads.append(Upload.receive(file, max_bytes=room))
+            if len(uploads) > BATCH_MAX_FILES:
+                raise HTTPException(status_code=400, detail=f"A batch takes at most {BATCH_MAX_FILES} files")
+        if directory is not None:
+            uploads.extend(directory_uploads(directory))
+    except BaseException:
+        discard_all(uploads)
+        raise
+
+    if not uploads:
+        raise HTTPException(status_code=400, detail="The batch has no files to analyze")
+    if len(uploads) > BATCH_MAX_FILES:
+        discard_all(uploads)
+        raise HTTPException(status_code=400, detail=f"A batch takes at most {BATCH_MAX_FILES} files")
+    return uploads
+
+
+def discard_all(uploads):
+    for upload in uploads:
+        upload.discard()
+
+
+async def run_batch(uploads, analyze, timestamp, concurrency, *args, on_start=None):
+    """
+    `await analyze(upload, timestamp, *args)` for every upload, at most
+    concurrency at a time so a batch never fills an AnalysisPool's queue on
+    its own. When other requests have filled it, files wait for room (see
+    analysis_pool.waiting_for_capacity) rather than failing with a 503.
+    Each file is its own job and so gets its own stored result.
+    One file failing doesn't stop the others: returns an entry per upload,
+    in order, with either its result or its error.
+    """
+    slots = asyncio.Semaphore(max(1, concurrency))
+    if on_start is not None:
+        on_start()
+
+    async def one(index, upload):
+        async with slots:
+            try:
+                with waiting_for_capacity():
+                    result = await analyze(upload, timestamp, *args)
+                if result.get("success") is False:
+                    # Analyses that catch their own errors answer with success false
+                    return {"file": upload.name, "ok": False, "error": result.get("error", "Analysis failed")}
+                return {"file": upload.name, "ok": True, "result": result}
+            except HTTPException as e:
+                return {"file": upload.name, "ok": False, "error": e.detail}
+            except Exception as e:
+                return {"file": upload.name, "ok": False, "error": f"Analysis failed: {str(e)}"}
+
+    try:
+        return await asyncio.gather(*(one(index, upload) for index, upload in enumerate(uploads)))
+    finally:
+        # Files served from the result cache never reached a worker
+        discard_all(uploads)
+
+
+def create_batch_router(path, kind, pool, job_store, analyze, merge):
+    """
+    A POST route analyzing many files at once, fanned out over all the
+    workers of the given AnalysisPool.
+
+    analyze(upload, timestamp, render) analyzes one file as the app's own
+    analyze endpoint would; merge(results) folds the successful results
+    into one portfolio summary. Files come as a multi-file upload (zip
+    archives are opened up) and/or a directory under BATCH_INPUT_DIR.
+    """
+    router = APIRouter()
+
+    async def analyze_batch(uploads, timestamp, render, on_start=None):
+        files = await run_batch(uploads, analyze, timestamp, pool.workers, render, on_start=on_start)
+        succeeded = [entry["result"] for entry in files if entry["ok"]]
+        return {
+            "success": bool(succeeded),
+            "timestamp": timestamp,
+            "files": files,
+            "analyzed": len(succeeded),
+            "failed": len(files) - len(succeeded),
+            "portfolio": merge(succeeded)
+        }
+
+    @router.post(path)
+    async def analyze_batch_request(
+        files: Optional[List[UploadFile]] = File(None),
+        directory: Optional[str] = Form(None),
+        job: bool = Form(False),
+        render: str = Form("png")
+    ):
+        """
+        Analyze every file of a batch and merge them into one portfolio
+        summary; per-file results are stored and cached as single analyses are.
+        """
+        timestamp = int(time.time() * 1000)
+        try:
+            if render not in RENDER_MODES:
+                raise HTTPException(status_code=400, detail=f"render must be one of: {', '.join(RENDER_MODES)}")
+            if job:
+                pool.check_capacity()
+            uploads = await run_in_threadpool(receive_batch, files or [], directory)
+
+            # In job mode, answer right away and let the client poll /jobs/{id}
+            if job:
+                queued = job_store.submit(f"{kind}_batch", analyze_batch, uploads, timestamp, render)
+                return JSONResponse(status_code=202, content=job_store.status(queued["jobId"]))
+
+            return JSONResponse(content=await analyze_batch(uploads, timestamp, render))
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Batch analysis failed: {str(e)}")
+
+    return router
@@ -0,0 +1,285 @@
+import numpy as np
+import pandas as pd
+
+from quantile_sketch import QuantileSketch
+
+BCG_CATEGORIES = ["Star", "Cash Cow", "Question Mark", "Dog"]
+
+# stream_medians() picks a rank directly once this few values are left to search
+STREAM_COLLECT_LIMIT = 1 << 20
+
+_SIGN_BIT = np.uint64(1 << 63)
+
+
+def threshold(values, q=0.5):
+    """
+    Quantile of a numeric column ignoring NaNs (q=0.5 is the median), like
+    Series.quantile. values may also be a QuantileSketch, e.g. one merged
+    from the sketches of several files or workers.
+    """
+    if isinstance(values, QuantileSketch):
+        return values.quantile(q)
+    values = np.asarray(values, dtype=np.float64)
+    if np.isnan(values).all():
+        return float("nan")
+    return float(np.nanquantile(values, q))
+
+
+def _order_keys(values):
+    # Reinterpret float64 bits as uint64 so that unsigned order matches numeric order
+    bits = np.ascontiguousarray(values, dtype=np.float64).view(np.uint64)
+    return np.where(bits & _SIGN_BIT, ~bits, bits | _SIGN_BIT)
+
+
+def _from_order_key(key):
+    key = np.uint64(key)
+    bits = key & ~_SIGN_BIT if key & _SIGN_BIT else ~key
+    return float(np.array(bits, dtype=np.uint64).view(np.float64))
+
+
+def stream_medians(scan, columns, collect_limit=STREAM_COLLECT_LIMIT):
+    """
+    Exact median of each column of a table read in chunks, like Series.median.
+
+    scan() must return a fresh iterator over the table's chunks (DataFrames)
+    each time it is called; it is called once per round. The first round
+    counts the values of every column and bins them by the top 16 bits of an
+    order-preserving key. Every later round narrows the two middle ranks to
+    a 16 bits longer key prefix, until at most collect_limit values share
+    it and the rank is picked directly. Memory stays at 2**16 counters (or
+    collect_limit values) per rank whatever the size of the table; most
+    columns need two or three rounds. Columns without values get NaN.
+    """
+    def column_keys(chunk, column):
+        values = np.asarray(chunk[column], dtype=np.float64)
+        return _order_keys(values[~np.isnan(values)])
+
+    counts = {column: np.zeros(1 << 16, dtype=np.int64) for column in columns}
+    for chunk in scan():
+        for column in columns:
+            counts[column] += np.bincount(
+                (column_keys(chunk, column) >> np.uint64(48)).astype(np.intp), minlength=1 << 16
+            )
+
+    # One search per (column, rank): the key prefix found so far, how many
+    # bits long it is, the rank within it and the histogram of the last round
+    searches = {}
+    for column in columns:
+        n = int(counts[column].sum())
+        for rank in {(n - 1) // 2, n // 2} if n else ():
+            searches[(column, rank)] = {"prefix": 0, "bits": 0, "rank": rank, "hist": counts[column]}
+
+    found = {}
+    while True:
+        for key, search in searches.items():
+            if key in found or "values" in search:
+                continue
+            # Descend into the bucket holding the rank
+            cumulative = np.cumsum(search["hist"])
+            bucket = int(np.searchsorted(cumulative, search["rank"], side="right"))
+            search["rank"] -= int(cumulative[bucket - 1]) if bucket else 0
+            search["prefix"] = (search["prefix"] << 16) | bucket
+            search["bits"] += 16
+            if search["bits"] == 64:
+                found[key] = _from_order_key(search["prefix"])
+            elif search["hist"][bucket] <= collect_limit:
+                search["values"] = []
+            else:
+                search["hist"] = np.zeros(1 << 16, dtype=np.int64)
+
+        live = {key: search for key, search in searches.items() if key not in found}
+        if not live:
+            break
+
+        for chunk in scan():
+            for (column, _), search in live.items():
+                keys = column_keys(chunk, column)
+                keys = keys[(keys >> np.uint64(64 - search["bits"])) == np.uint64(search["prefix"])]
+                if "values" in search:
+                    search["values"].append(keys)
+                else:
+                    search["hist"] += np.bincount(
+                        ((keys >> np.uint64(48 - search["bits"])) & np.uint64(0xFFFF)).astype(np.intp),
+                        minlength=1 << 16
+                    )
+
+        for key, search in live.items():
+            if "values" in search:
+                keys = np.concatenate(search["values"])
+                found[key] = _from_order_key(np.partition(keys, search["rank"])[search["rank"]])
+
+    medians = {}
+    for column in columns:
+        middle = [value for (name, _), value in sorted(found.items()) if name == column]
+        medians[column] = float(np.mean(middle)) if middle else float("nan")
+    return medians
+
+
+def _label_codes(conditions, labels):
+    # Index of the first condition that holds, len(labels) where none does
+    return np.select(conditions, list(range(len(labels))), default=len(labels))
+
+
+def _labels(conditions, labels, default):
+    # Pick label codes with np.select and map them back in one take
+    return np.array(list(labels) + [default], dtype=object)[_label_codes(conditions, labels)]
+
+
+def _quadrant_conditions(share, growth, share_thresh, growth_thresh, share_low=None):
+    share = np.asarray(share, dtype=np.float64)
+    growth = np.asarray(growth, dtype=np.float64)
+    if share_low is None:
+        share_low = share_thresh
+
+    high_share = share >= share_thresh
+    high_growth = growth >= growth_thresh
+    return [
+        high_share & high_growth,
+        high_share & (growth < growth_thresh),
+        (share < share_low) & high_growth,
+        ~np.isnan(share) & ~np.isnan(growth)
+    ]
+
+
+def classify_quadrants(share, growth, share_thresh, growth_thresh, share_low=None, unclassified="Dog"):
+    """
+    BCG category of every product in one vectorized pass.
+
+    Star:          share >= share_thresh and growth >= growth_thresh
+    Cash Cow:      share >= share_thresh and growth <  growth_thresh
+    Question Mark: share <  share_low    and growth >= growth_thresh
+    Dog:           everything else
+
+    share_low defaults to share_thresh (a plain 2x2 split); a lower cut-off
+    leaves the middle band of market share in Dog. Rows where share or
+    growth is missing get `unclassified`. Returns an object array of labels.
+    """
+    conditions = _quadrant_conditions(share, growth, share_thresh, growth_thresh, share_low)
+    return _labels(conditions, BCG_CATEGORIES, unclassified)
+
+
+def classify_tiers(share, growth, share_high, growth_high, share_low, growth_low):
+    """
+    Performance tier of every product in one vectorized pass.
+
+    High: share >= share_high and growth >= growth_high
+    Poor: share <= share_low  and growth <= growth_low
+    Average: everything else (including missing values)
+    """
+    share = np.asarray(share, dtype=np.float64)
+    growth = np.asarray(growth, dtype=np.float64)
+    conditions = [
+        (share >= share_high) & (growth >= growth_high),
+        (share <= share_low) & (growth <= growth_low)
+    ]
+    return _labels(conditions, ["High", "Poor"], "Average")
+
+
+def _number(value):
+    # JSON has no NaN
+    return None if pd.isna(value) else float(value)
+
+
+def _period_quadrants(periods, share, growth, share_q, growth_q, share_low_q):
+    # Category codes (len(BCG_CATEGORIES) for unclassified), period codes,
+    # and the thresholds of each period in code order
+    share = np.asarray(share, dtype=np.float64)
+    growth = np.asarray(growth, dtype=np.float64)
+    codes, uniques = pd.factorize(pd.Series(periods), sort=True)
+    complete = ~np.isnan(share) & ~np.isnan(growth) & (codes >= 0)
+
+    frame = pd.DataFrame({"share": share[complete], "growth": growth[complete]})
+    grouped = frame.groupby(codes[complete], sort=True)
+    thresholds = pd.DataFrame({"share": grouped["share"].quantile(share_q), "growth": grouped["growth"].quantile(growth_q)})
+    if share_low_q is not None:
+        thresholds["shareLow"] = grouped["share"].quantile(share_low_q)
+    thresholds = thresholds.reindex(range(len(uniques)))
+    thresholds.index = uniques
+
+    def per_row(column):
+        return np.r_[thresholds[column].to_numpy(dtype=np.float64), np.nan][codes]
+
+    conditions = _quadrant_conditions(
+        share, growth, per_row("share"), per_row("growth"),
+        share_low=per_row("shareLow") if share_low_q is not None else None
+    )
+    return _label_codes(conditions, BCG_CATEGORIES), codes, thresholds
+
+
+def classify_periods(periods, share, growth, share_q=0.5, growth_q=0.5, share_low_q=None, unclassified="Dog"):
+    """
+    classify_quadrants() for rows that each belong to a period (product x
+    month), every period against its own thresholds: the share_q and
+    growth_q quantiles of its rows that have both values (and share_low_q
+    for share_low). The quantiles come from one group-by and every row is
+    classified in a single vectorized pass, however many periods there are.
+
+    Returns (categories, thresholds): an object array of labels and a
+    DataFrame of the share, growth (and shareLow) thresholds per period.
+    """
+    categories, _, thresholds = _period_quadrants(periods, share, growth, share_q, growth_q, share_low_q)
+    return np.array(BCG_CATEGORIES + [unclassified], dtype=object)[categories], thresholds
+
+
+def bcg_evolution(products, periods, share, growth, share_q=0.5, growth_q=0.5, share_low_q=None):
+    """
+    Time-sliced BCG matrix: how products move between categories over
+    periods, computed in one pass over product x period rows.
+
+    Rows are classified as by classify_periods(); ones missing share or
+    growth (e.g. a product's first month) are left out. One integer sort
+    by product and period then lines each product's periods up: the
+    transition matrix counts the category pairs of a product's consecutive
+    classified periods with a bincount, and trajectories are the runs of
+    periods a product stayed in one category. Returns a JSON-ready dict:
+
+        {"periods": [{"period", "shareThreshold", "growthThreshold", "counts"}],
+         "transitions": {from category: {to category: count}},
+         "trajectories": {product: [[category, first period, last period], ...]}}
+    """
+    size = len(BCG_CATEGORIES)
+    categories, period, thresholds = _period_quadrants(periods, share, growth, share_q, growth_q, share_low_q)
+    product, names = pd.factorize(pd.Series(products), sort=True)
+
+    keep = np.flatnonzero((categories < size) & (product >= 0))
+    order = keep[np.lexsort((period[keep], product[keep]))]
+    product, period, category = product[order], period[order], categories[order]
+
+    counts = np.bincount(period * size + category, minlength=len(thresholds) * size).reshape(-1, size)
+    same_product = product[1:] == product[:-1]
+    pairs = np.bincount(category[:-1][same_product] * size + category[1:][same_product], minlength=size * size)
+    pairs = pairs.reshape(size, size)
+
+    # A new run starts wherever the product or its category changes
+    starts = np.flatnonzero(np.r_[True, ~same_product | (category[1:] != category[:-1])])[:len(order)]
+    ends = np.r_[starts[1:], len(order)][:len(starts)] - 1
+    runs = np.empty((len(starts), 3), dtype=object)
+    runs[:, 0] = np.array(BCG_CATEGORIES, dtype=object)[category[starts]]
+    period_names = np.array([str(name) for name in thresholds.index], dtype=object)
+    runs[:, 1] = period_names[period[starts]]
+    runs[:, 2] = period_names[period[ends]]
+    runs = runs.tolist()
+
+    # Each product's runs are contiguous
+    first_runs = np.flatnonzero(np.r_[True, product[starts][1:] != product[starts][:-1]])[:len(starts)]
+    bounds = np.r_[first_runs, len(starts)].tolist()
+    trajectories = {
+        str(names[code]): runs[bounds[i]:bounds[i + 1]]
+        for i, code in enumerate(product[starts[first_runs]].tolist())
+    }
+
+    return {
+        "periods": [
+            {
+                "period": period_names[i],
+                "shareThreshold": _number(thresholds["share"].iat[i]),
+                "growthThreshold": _number(thresholds["growth"].iat[i]),
+                "counts": dict(zip(BCG_CATEGORIES, counts[i].tolist()))
+            }
+            for i in range(len(period_names))
+        ],
+        "transitions": {
+            source: dict(zip(BCG_CATEGORIES, pairs[i].tolist())) for i, source in enumerate(BCG_CATEGORIES)
+        },
+        "trajectories": trajectories
+    }
@@ -0,0 +1,463 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.staticfiles import StaticFiles
+
+# Threads used to render the independent charts of one analysis
+CHART_THREADS = int(os.environ.get("CHART_THREADS", "4"))
+
+# How the analyze endpoints deliver charts:
+#   png  - PNGs drawn during the analysis
+#   lazy - PNG URLs reserved, each drawn on its first request
+#   data - only the series behind each chart (chartData), no matplotlib at all
+#   both - PNGs plus chartData
+RENDER_MODES = ("png", "lazy", "data", "both")
+IMAGE_MODES = ("png", "lazy", "both")
+DATA_MODES = ("data", "both")
+
+# Specs of charts reserved in lazy mode; kept outside the served temp/output
+PENDING_CHARTS_DIR = os.environ.get(
+    "PENDING_CHARTS_DIR", os.path.join(os.path.dirname(__file__), '../temp/pending_charts')
+)
+
+BCG_COLORS = {'Star': 'gold', 'Cash Cow': 'green', 'Question Mark': 'blue', 'Dog': 'red'}
+
+BCG_PALETTE = {
+    "Star": "#FFD700",           # Gold
+    "Cash Cow": "#32CD32",       # Lime Green
+    "Question Mark": "#1E90FF",  # Dodger Blue
+    "Dog": "#FF6347"             # Tomato
+}
+
+_executor = None
+_pending_locks = {}
+_pending_locks_guard = threading.Lock()
+
+
+def new_figure(figsize):
+    """
+    A Figure with its own Agg canvas.
+
+    Unlike plt.figure() it is not registered with pyplot, so figures can be
+    built and saved from several threads at once.
+    """
+    # Imported here so render=data requests never load matplotlib
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def keyword_bars(path, labels, counts, title, color):
+    """Horizontal bar chart of keyword counts, largest at the top"""
+    fig = new_figure((10, 6))
+    ax = fig.add_subplot()
+    bars = ax.barh(labels[::-1], counts[::-1], color=color)
+    ax.set_title(title, fontsize=14, pad=20)
+    ax.set_xlabel("Count", fontsize=12)
+
+    # Add some padding and a wide left margin so long labels stay visible
+    fig.tight_layout(pad=2.0)
+    fig.subplots_adjust(left=0.3)
+
+    # Add values at the end of each bar
+    for bar in bars:
+        width = bar.get_width()
+        ax.text(width + 0.3, bar.get_y() + bar.get_height()/2, f"{width:.0f}",
+                ha='left', va='center', fontsize=10)
+
+    fig.savefig(path, dpi=120, bbox_inches='tight')
+
+
+def sentiment_pie(path, labels, counts):
+    """Pie chart of responses per sentiment with a legend of the counts"""
+    colors = {
+        'positive': '#27ae60',  # Green
+        'negative': '#e74c3c',  # Red
+        'neutral': '#3498db'    # Blue
+    }
+
+    fig = new_figure((10, 8))
+    ax = fig.add_subplot()
+    wedges, texts, autotexts = ax.pie(
+        counts,
+        labels=labels,
+        autopct='%1.1f%%',
+        colors=[colors.get(label, '#95a5a6') for label in labels],
+        explode=[0.05] * len(counts),
+        shadow=True,
+        startangle=90,
+        textprops={'fontsize': 14}
+    )
+
+    # Make percentage labels more readable
+    for autotext in autotexts:
+        autotext.set_color('white')
+        autotext.set_fontweight('bold')
+
+    ax.set_title('Sentiment Distribution', fontsize=16, pad=20)
+    ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle
+
+    legend_labels = [f"{label} ({count})" for label, count in zip(labels, counts)]
+    ax.legend(wedges, legend_labels, title="Sentiment", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
+
+    fig.tight_layout()
+    fig.savefig(path, dpi=120, bbox_inches='tight')
+
+
+def column_bars(path, labels, values, title, xlabel, ylabel, color, figsize=(10, 6)):
+    """Vertical bar chart with the value printed on top of each bar"""
+    fig = new_figure(figsize)
+    ax = fig.add_subplot()
+    bars = ax.bar(labels, values, color=color)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    for label in ax.get_xticklabels():
+        label.set(rotation=45, ha='right')
+    fig.tight_layout()
+
+    for bar in bars:
+        height = bar.get_height()
+        ax.text(bar.get_x() + bar.get_width()/2, height, f'{int(height)}',
+                ha='center', va='bottom', fontsize=10)
+
+    fig.savefig(path)
+
+
+def bcg_groups(path, groups, share_line, growth_line):
+    """
+    BCG scatter with one colored series per category.
+
+    groups is a list of {"category", "x", "y", "sizes", "annotations"} where
+    annotations are [text, x, y] triples.
+    """
+    fig = new_figure((10, 8))
+    ax = fig.add_subplot()
+
+    for group in groups:
+        ax.scatter(
+            group["x"],
+            group["y"],
+            s=group["sizes"],
+            color=BCG_COLORS[group["category"]],
+            alpha=0.7,
+            label=group["category"]
+        )
+        for text, x, y in group["annotations"]:
+            ax.annotate(text, (x, y), xytext=(5, 5), textcoords='offset points')
+
+    ax.axvline(x=share_line, color='gray', linestyle='--', alpha=0.5)
+    ax.axhline(y=growth_line, color='gray', linestyle='--', alpha=0.5)
+    ax.set_xlabel('Relative Market Share')
+    ax.set_ylabel('Market Growth')
+    ax.set_title('BCG Matrix Analysis')
+    ax.legend()
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+
+    fig.savefig(path)
+
+
+def palette_bars(path, labels, values, title, palette, ylabel=None, show_values=False):
+    """Horizontal seaborn bar chart of sales per label"""
+    import seaborn as sns
+
+    fig = new_figure((10, 6))
+    ax = fig.add_subplot()
+    sns.barplot(x=values, y=labels, palette=palette, ax=ax)
+    ax.set_title(title, fontsize=16)
+    ax.set_xlabel("Sales", fontsize=12)
+    if ylabel is not None:
+        ax.set_ylabel(ylabel)
+    fig.tight_layout()
+
+    if show_values:
+        for i, v in enumerate(values):
+            ax.text(v + 0.1, i, f"{v:,.0f}", va='center')
+
+    fig.savefig(path, dpi=120, bbox_inches='tight')
+
+
+def share_margin_matrix(path, labels, shares, margins, sizes, margin_line):
+    """BCG matrix of relative market share against profit margin"""
+    fig = new_figure((10, 8))
+    ax = fig.add_subplot()
+    ax.scatter(shares, margins, s=sizes, alpha=0.7, c=list(range(len(labels))), cmap='viridis')
+
+    for label, x, y in zip(labels, shares, margins):
+        ax.annotate(label, (x, y), xytext=(5, 5), textcoords='offset points')
+
+    # Quadrant lines and labels
+    ax.axvline(x=0.5, color='gray', linestyle='--', alpha=0.7)
+    ax.axhline(y=margin_line, color='gray', linestyle='--', alpha=0.7)
+
+    ax.text(0.75, max(margins) * 0.9, "STARS", fontsize=12, ha='center')
+    ax.text(0.25, max(margins) * 0.9, "QUESTION MARKS", fontsize=12, ha='center')
+    ax.text(0.75, min(margins) * 1.1, "CASH COWS", fontsize=12, ha='center')
+    ax.text(0.25, min(margins) * 1.1, "DOGS", fontsize=12, ha='center')
+
+    ax.set_title("BCG Matrix - Market Share vs. Profit Margin", fontsize=16)
+    ax.set_xlabel("Relative Market Share", fontsize=12)
+    ax.set_ylabel("Profit Margin", fontsize=12)
+    fig.tight_layout()
+
+    fig.savefig(path, dpi=120, bbox_inches='tight')
+
+
+def bcg_quadrants(path, names, shares, growths, categories, share_thresh, growth_thresh, max_labels=15,
+                  extent=None):
+    """
+    Styled BCG matrix of ball.py: one marker style per category, quadrant
+    lines at the thresholds and the first max_labels products labelled.
+    extent ([share min, share max, growth min, growth max]) sets the axes
+    when the products drawn are only a sample of the data.
+
+    The seaborn style is applied through matplotlib's global rcParams, so
+    render this one on its own rather than alongside other charts.
+    """
+    import pandas as pd
+    import seaborn as sns
+    from matplotlib import style
+
+    df = pd.DataFrame({"MarketShare": shares, "MarketGrowth": growths, "BCG Category": categories})
+    fig = new_figure((12, 8))
+
+    with style.context('seaborn-v0_8-whitegrid'):
+        ax = fig.add_subplot()
+        sns.scatterplot(
+            data=df,
+            x="MarketShare",
+            y="MarketGrowth",
+            hue="BCG Category",
+            style="BCG Category",
+            s=150,
+            alpha=0.8,
+            palette=BCG_PALETTE,
+            ax=ax
+        )
+
+        # Add product names as labels with limit to prevent overcrowding
+        for name, x, y in list(zip(names, shares, growths))[:max_labels]:
+            label = name[:15] + '...' if len(name) > 15 else name
+            ax.annotate(label, xy=(x, y), xytext=(5, 5), textcoords='offset points', fontsize=8)
+
+        if extent:
+            x_min, x_max, y_min, y_max = extent
+        else:
+            x_min, x_max = min(shares), max(shares)
+            y_min, y_max = min(growths), max(growths)
+
+        # Ensure we have valid ranges, then add some padding
+        if x_min >= x_max:
+            x_min, x_max = 0, 10
+        if y_min >= y_max:
+            y_min, y_max = 0, 10
+        x_range = x_max - x_min
+        y_range = y_max - y_min
+        x_min -= x_range * 0.1
+        x_max += x_range * 0.1
+        y_min -= y_range * 0.1
+        y_max += y_range * 0.1
+        ax.set_xlim(x_min, x_max)
+        ax.set_ylim(y_min, y_max)
+
+        # Quadrant lines and labels
+        ax.axvline(x=share_thresh, color='grey', linestyle='--', alpha=0.6)
+        ax.axhline(y=growth_thresh, color='grey', linestyle='--', alpha=0.6)
+        ax.text(x_max*0.75, y_max*0.9, 'STARS', fontsize=14, fontweight='bold', color='#FFD700')
+        ax.text(x_max*0.75, y_min*0.9, 'CASH COWS', fontsize=14, fontweight='bold', color='#32CD32')
+        ax.text(x_min*1.1, y_max*0.9, 'QUESTION MARKS', fontsize=14, fontweight='bold', color='#1E90FF')
+        ax.text(x_min*1.1, y_min*0.9, 'DOGS', fontsize=14, fontweight='bold', color='#FF6347')
+
+        ax.set_title("BCG Matrix Analysis", fontsize=16, fontweight='bold')
+        ax.set_xlabel(f"Market Share (Threshold: {share_thresh:.2f})", fontsize=12)
+        ax.set_ylabel(f"Market Growth Rate (Threshold: {growth_thresh:.2f})", fontsize=12)
+        ax.legend(title="Categories", fontsize=10, title_fontsize=12)
+        ax.grid(True, alpha=0.3)
+        fig.tight_layout()
+
+        fig.savefig(path, dpi=300, bbox_inches='tight')
+
+
+def message_image(path, message):
+    """Placeholder image that just shows a message (used when a chart fails)"""
+    fig = new_figure((12, 8))
+    ax = fig.add_subplot()
+    ax.text(0.5, 0.5, message, horizontalalignment='center', fontsize=20)
+    ax.axis('off')
+    fig.savefig(path, dpi=300, bbox_inches='tight')
+
+
+# Chart kinds usable in chart specs
+CHARTS = {
+    "keyword_bars": keyword_bars,
+    "sentiment_pie": sentiment_pie,
+    "column_bars": column_bars,
+    "bcg_groups": bcg_groups,
+    "palette_bars": palette_bars,
+    "share_margin_matrix": share_margin_matrix,
+    "bcg_quadrants": bcg_quadrants,
+    "message_image": message_image
+}
+
+
+def chart_spec(kind, path, **data):
+    """Describe one chart: its kind, output path and plain (JSON-friendly) data"""
+    return {"kind": kind, "path": path, "data": data}
+
+
+def chart_name(path):
+    """A chart's name under temp/output: its job directory, a slash and its file name"""
+    job_dir, filename = os.path.split(os.path.normpath(path))
+    return f"{os.path.basename(job_dir)}/{filename}"
+
+
+def chart_url(spec):
+    """URL the chart is served at under /temp/output"""
+    return "/temp/output/" + chart_name(spec["path"])
+
+
+def chart_data(spec):
+    """The chart's kind and the plain series it is drawn from"""
+    return dict(spec["data"], kind=spec["kind"])
+
+
+def render_chart(spec):
+    CHARTS[spec["kind"]](spec["path"], **spec["data"])
+    return spec["path"]
+
+
+def render_charts(specs, render="png"):
+    """
+    Render independent chart specs concurrently and return their paths.
+
+    With render="lazy" nothing is drawn yet: the specs are set aside and
+    each chart is rendered the first time its URL is requested (see
+    LazyChartFiles). With render="data" nothing is drawn at all.
+    """
+    global _executor
+    if render not in IMAGE_MODES:
+        return []
+    if render == "lazy":
+        return [defer_chart(spec) for spec in specs]
+
+    if len(specs) <= 1 or CHART_THREADS <= 1:
+        return [render_chart(spec) for spec in specs]
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=CHART_THREADS, thread_name_prefix="chart")
+    return list(_executor.map(render_chart, specs))
+
+
+def _pending_path(filename):
+    # Specs are kept per job, mirroring the job directories under temp/output
+    return os.path.join(PENDING_CHARTS_DIR, chart_name(filename) + ".json")
+
+
+def defer_chart(spec):
+    """Keep a chart spec until the chart is first requested"""
+    pending_path = _pending_path(spec["path"])
+    os.makedirs(os.path.dirname(pending_path), exist_ok=True)
+    with open(pending_path + ".tmp", "w") as f:
+        json.dump(spec, f, separators=(',', ':'))
+    os.replace(pending_path + ".tmp", pending_path)
+    return spec["path"]
+
+
+def is_chart_pending(filename):
+    return os.path.exists(_pending_path(filename))
+
+
+def discard_pending_chart(filename):
+    try:
+        os.remove(_pending_path(filename))
+    except FileNotFoundError:
+        pass
+
+
+def discard_pending_charts(job_dir):
+    """Forget every chart still pending in a job directory"""
+    shutil.rmtree(os.path.join(PENDING_CHARTS_DIR, os.path.basename(os.path.normpath(job_dir))),
+                  ignore_errors=True)
+
+
+def render_pending_chart(filename):
+    """Render a deferred chart now; does nothing if it isn't pending"""
+    with _pending_locks_guard:
+        entry = _pending_locks.setdefault(filename, {"lock": threading.Lock(), "users": 0})
+        entry["users"] += 1
+
+    try:
+        # Concurrent first requests for the same chart render it only once
+        with entry["lock"]:
+            pending_path = _pending_path(filename)
+            try:
+                with open(pending_path) as f:
+                    spec = json.load(f)
+            except FileNotFoundError:
+                return
+
+            # Draw under a hidden name in the job's own directory (so on the
+            # same filesystem) and move it into place, so the static files
+            # never serve a half-written PNG
+            target = spec["path"]
+            scratch = os.path.join(os.path.dirname(target), f".{uuid.uuid4().hex}.{os.path.basename(target)}")
+            try:
+                if os.path.isdir(os.path.dirname(target)):
+                    render_chart(dict(spec, path=scratch))
+                    os.replace(scratch, target)
+            except FileNotFoundError:
+                # The job was swept away while the chart was drawn
+                pass
+            finally:
+                if os.path.exists(scratch):
+                    os.remove(scratch)
+
+            # Drawn, or its job is gone and the request gets a 404. The lock
+            # is per process, so another API process may have drawn the same
+            # chart and removed the spec first; its PNG is just as good
+            try:
+                os.remove(pending_path)
+            except FileNotFoundError:
+                pass
+            try:
+                # The job's last pending chart takes its spec directory with it
+                os.rmdir(os.path.dirname(pending_path))
+            except OSError:
+                pass
+    finally:
+        with _pending_locks_guard:
+            entry["users"] -= 1
+            if entry["users"] == 0:
+                del _pending_locks[filename]
+
+
+class LazyChartFiles(StaticFiles):
+    """StaticFiles that renders deferred charts the first time they are requested"""
+
+    async def get_response(self, path, scope):
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as e:
+            # Charts live one level down, in their job's directory
+            parts = path.split(os.sep)
+            if e.status_code != 404 or len(parts) != 2 or any(part in ("", ".", "..") for part in parts):
+                raise
+
+        await run_in_threadpool(render_pending_chart, path)
+        # Still a 404 if there was nothing pending under this name
+        return await super().get_response(path, scope)
+
+
+def cache_render_mode(render):
+    """png and lazy give the same result JSON, so they share cache entries"""
+    return "png" if render == "lazy" else render
@@ -0,0 +1,160 @@
+import codecs
+import csv
+import io
+import os
+import warnings
+
+import pandas as pd
+from pandas.errors import ParserWarning
+
+# How much of the start of a file is looked at to work out how to parse it
+CSV_SNIFF_BYTES = int(os.environ.get("CSV_SNIFF_KB", "256")) * 1024
+
+# Fallbacks tried on the sample when the sniffed options can't parse it
+_QUOTING_FALLBACKS = [
+    {"escapechar": "\\"},
+    {"quoting": csv.QUOTE_NONE}
+]
+
+
+def _open(source):
+    # A file path, or the bytes of an upload held in memory
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return open(source, "rb")
+
+
+def _sniff_encoding(raw, truncated):
+    if raw.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if raw.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    try:
+        raw.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError as e:
+        # A character cut in half by the end of the sample is fine
+        if truncated and e.start >= len(raw) - 3:
+            return "utf-8"
+    return "latin-1"
+
+
+def _skipped_lines(caught):
+    """Bad lines reported in caught warnings; anything else is warned again"""
+    skipped = 0
+    for warning in caught:
+        message = str(warning.message)
+        if issubclass(warning.category, ParserWarning) and "Skipping line" in message:
+            skipped += message.count("Skipping line")
+        else:
+            warnings.warn_explicit(warning.message, warning.category, warning.filename, warning.lineno)
+    return skipped
+
+
+def _try_sample(sample, options, nrows):
+    # Parse the sample with the C engine: (rows, skipped lines), or None if it can't be parsed
+    try:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", ParserWarning)
+            df = pd.read_csv(io.StringIO(sample), nrows=nrows, **options)
+        return len(df), _skipped_lines(caught)
+    except Exception:
+        return None
+
+
+def sniff_csv(path, sample_bytes=CSV_SNIFF_BYTES):
+    """
+    pd.read_csv options for a file (a path or its bytes), worked out from
+    its first sample_bytes.
+
+    Detects the encoding (BOMs, else UTF-8, else Latin-1), the delimiter and
+    quote character, and falls back to an escape character or no quoting
+    at all when the sample doesn't parse otherwise. The options always use
+    the C engine and skip malformed lines with a warning, which read_csv()
+    counts.
+    """
+    with _open(path) as f:
+        raw = f.read(sample_bytes)
+        truncated = bool(f.read(1))
+
+    encoding = _sniff_encoding(raw, truncated)
+    if encoding == "utf-16" and len(raw) % 2:
+        raw = raw[:-1]
+    sample = raw.decode(encoding, errors="ignore")
+
+    nrows = None
+    if truncated:
+        # Drop the last line, it was probably cut short
+        sample = sample[:sample.rfind("\n") + 1] or sample
+        nrows = max(sample.count("\n") - 2, 1)
+
+    options = {"sep": ",", "quotechar": '"'}
+    try:
+        dialect = csv.Sniffer().sniff(sample[:64 * 1024], delimiters=",;\t|")
+        options = {
+            "sep": dialect.delimiter,
+            "quotechar": dialect.quotechar or '"',
+            "skipinitialspace": dialect.skipinitialspace
+        }
+    except csv.Error:
+        pass
+    options.update(engine="c", on_bad_lines="warn")
+
+    # Prefer the sniffed options, else whichever fallback skips the fewest lines
+    best = None
+    for extra in [{}] + _QUOTING_FALLBACKS:
+        candidate = dict(options, **extra)
+        parsed = _try_sample(sample, candidate, nrows)
+        if parsed is None:
+            continue
+        if best is None or parsed[1] < best[1][1]:
+            best = (candidate, parsed)
+        if parsed[1] == 0:
+            break
+    if best is not None:
+        options = best[0]
+
+    # Undecodable bytes past the sample shouldn't sink the whole parse
+    options.update(encoding=encoding, encoding_errors="replace")
+    return options
+
+
+def _counted_chunks(path, options, report):
+    with _open(path) as f, pd.read_csv(f, **options) as reader:
+        while True:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always", ParserWarning)
+                chunk = next(reader, None)
+            report["skippedLines"] += _skipped_lines(caught)
+            if chunk is None:
+                return
+            yield chunk
+
+
+def read_csv(path, report=None, **kwargs):
+    """
+    pd.read_csv(path, **kwargs) with the options sniff_csv() finds, parsing
+    the file (a path or its bytes) once with the C engine.
+
+    Malformed lines are skipped rather than failing the whole read. If
+    report is a dict it receives the sniffed "delimiter" and "encoding" and
+    the number of "skippedLines" (for a chunked read, counted as the chunks
+    are read). With usecols pandas only checks the columns it keeps, so
+    lines with extra fields are read rather than skipped; a chunked read
+    may also miss some, as pandas doesn't check every line across chunks.
+    """
+    options = sniff_csv(path)
+    options.update(kwargs)
+    if report is None:
+        report = {}
+    report.update(delimiter=options["sep"], encoding=options["encoding"], skippedLines=0)
+
+    if options.get("chunksize"):
+        return _counted_chunks(path, options, report)
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always", ParserWarning)
+        with _open(path) as f:
+            df = pd.read_csv(f, **options)
+    report["skippedLines"] += _skipped_lines(caught)
+    return df
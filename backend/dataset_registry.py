@@ -0,0 +1,285 @@
+import json
+import os
+import re
+import sqlite3
+import time
+import uuid
+
+from fastapi import APIRouter, File, HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+
+from result_cache import upload_cache_key
+from result_store import RESULTS_DB
+from sales_cube import CUBE_COLUMNS, build_cube, has_cube_columns
+from table_loader import compact_frame, read_table, write_arrow
+from uploads import Upload
+
+# Registered datasets are kept here as Arrow IPC files, outside the served temp/output
+DATASET_DIR = os.environ.get("DATASET_DIR", os.path.join(os.path.dirname(__file__), '../temp/datasets'))
+
+# Disk budget for all registered datasets; the least recently used go first
+DATASET_MAX_BYTES = int(os.environ.get("DATASET_MAX_MB", "4096")) * 1024 * 1024
+
+# Dataset ids are the SHA-256 of the uploaded file
+DATASET_ID = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _write_atomic(df, path):
+    # Written under a temporary name, so no reader ever sees half a file
+    partial = f"{path}.{uuid.uuid4().hex}.partial"
+    try:
+        write_arrow(df, partial)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+
+def store_upload(upload, path, cube_path=None):
+    """
+    Parse an upload and write it to path as an Arrow IPC file, plus its
+    sales cube to cube_path if it is an invoice table; runs inside an
+    analysis worker
+    """
+    read_report = {}
+    try:
+        df = read_table(upload, read_report)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error reading file: {str(e)}")
+    compact_frame(df, read_report)
+
+    # Invoice-level files are rolled up once here rather than on every query
+    has_cube = cube_path is not None and has_cube_columns(df.columns)
+    if has_cube:
+        _write_atomic(build_cube(df), cube_path)
+    _write_atomic(df, path)
+    return {
+        "format": read_report["format"],
+        "rows": len(df),
+        "columns": [str(name) for name in df.columns],
+        "skippedLines": read_report["skippedLines"],
+        "hasCube": has_cube
+    }
+
+
+class DatasetRegistry:
+    """
+    Uploads parsed once and kept for any number of analyses.
+
+    A registered upload is read with read_table (CSV, Parquet, Feather or
+    Arrow), shrunk with compact_frame and stored under root as an Arrow IPC
+    file named by its dataset id, the SHA-256 of the uploaded bytes, so
+    registering the same file again is free. open() hands that file to an
+    analysis as an Upload: read_table memory-maps it, numeric columns and
+    categorical codes come out as views of the mapped pages, and every
+    worker process analyzing the dataset shares those pages instead of
+    parsing and holding its own copy. Invoice-level uploads (sample.csv's
+    Product, Country, YearMonth, Quantity and Revenue) also get a sales
+    cube, rolled up at registration and returned by cube().
+
+    The index (id, original file name, format, rows, columns, size and
+    last use) lives in the results database. Once the files together go
+    over max_bytes the least recently used datasets are deleted.
+    """
+
+    def __init__(self, root=DATASET_DIR, max_bytes=DATASET_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def _connect(self):
+        conn = sqlite3.connect(RESULTS_DB, timeout=30)
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS registered_datasets (
+                   dataset_id TEXT PRIMARY KEY,
+                   name TEXT NOT NULL,
+                   format TEXT NOT NULL,
+                   rows INTEGER NOT NULL,
+                   columns TEXT NOT NULL,
+                   size_bytes INTEGER NOT NULL,
+                   created_at REAL NOT NULL,
+                   last_used REAL NOT NULL
+               )"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS registered_datasets_lru ON registered_datasets (last_used)")
+        return conn
+
+    def path(self, dataset_id):
+        return os.path.join(self.root, f"{dataset_id}.arrow")
+
+    def cube_path(self, dataset_id):
+        return os.path.join(self.root, f"{dataset_id}.cube.arrow")
+
+    def info(self, dataset_id):
+        """Description of a registered dataset, or None if there isn't one"""
+        if not DATASET_ID.match(dataset_id or ""):
+            return None
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                """SELECT dataset_id, name, format, rows, columns, size_bytes, created_at, last_used
+                   FROM registered_datasets WHERE dataset_id = ?""", (dataset_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None or not os.path.exists(self.path(dataset_id)):
+            return None
+        return {
+            "datasetId": row[0],
+            "name": row[1],
+            "format": row[2],
+            "rows": row[3],
+            "columns": json.loads(row[4]),
+            "sizeBytes": row[5],
+            "hasCube": os.path.exists(self.cube_path(dataset_id)),
+            "createdAt": row[6],
+            "lastUsed": row[7]
+        }
+
+    def list(self):
+        conn = self._connect()
+        try:
+            ids = [row[0] for row in conn.execute(
+                "SELECT dataset_id FROM registered_datasets ORDER BY created_at"
+            ).fetchall()]
+        finally:
+            conn.close()
+        return [info for info in map(self.info, ids) if info is not None]
+
+    def open(self, dataset_id):
+        """An Upload reading a registered dataset's file; a 404 if there is no such dataset"""
+        if self.info(dataset_id) is None:
+            raise HTTPException(status_code=404, detail="Dataset not found")
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "UPDATE registered_datasets SET last_used = ? WHERE dataset_id = ?", (time.time(), dataset_id)
+                )
+        finally:
+            conn.close()
+        return Upload(os.path.basename(self.path(dataset_id)), path=self.path(dataset_id), keep=True)
+
+    def cube(self, dataset_id):
+        """The sales cube (see sales_cube.build_cube) of a registered dataset; a 404 if it has none"""
+        info = self.info(dataset_id)
+        if info is None:
+            raise HTTPException(status_code=404, detail="Dataset not found")
+        if not info["hasCube"]:
+            raise HTTPException(status_code=404, detail="Dataset has no sales cube: it needs " + ", ".join(CUBE_COLUMNS[:-1]))
+        return read_table(self.cube_path(dataset_id))
+
+    def add(self, dataset_id, name, stored):
+        """Index a file written by store_upload() and enforce the disk budget"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    """INSERT OR REPLACE INTO registered_datasets
+                       (dataset_id, name, format, rows, columns, size_bytes, created_at, last_used)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (dataset_id, name or "", stored["format"], stored["rows"], json.dumps(stored["columns"]),
+                     self._size(dataset_id), now, now)
+                )
+            self._evict(conn, keep=dataset_id)
+        finally:
+            conn.close()
+        return self.info(dataset_id)
+
+    def _size(self, dataset_id):
+        paths = [self.path(dataset_id), self.cube_path(dataset_id)]
+        return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+    def delete(self, dataset_id, conn=None):
+        """Forget a dataset and remove its files; True if there was one"""
+        if not DATASET_ID.match(dataset_id or ""):
+            return False
+        for path in [self.path(dataset_id), self.cube_path(dataset_id)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Still mapped by a running analysis on Windows; the next eviction retries
+                pass
+
+        own_conn = conn is None
+        conn = conn or self._connect()
+        try:
+            with conn:
+                return conn.execute(
+                    "DELETE FROM registered_datasets WHERE dataset_id = ?", (dataset_id,)
+                ).rowcount > 0
+        finally:
+            if own_conn:
+                conn.close()
+
+    def _evict(self, conn, keep=None):
+        total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM registered_datasets").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = conn.execute(
+            "SELECT dataset_id, size_bytes FROM registered_datasets ORDER BY last_used"
+        ).fetchall()
+        for dataset_id, size in rows:
+            if total <= self.max_bytes:
+                break
+            # Never the dataset that was just registered
+            if dataset_id == keep:
+                continue
+            self.delete(dataset_id, conn)
+            total -= size
+
+
+def create_registry_router(registry, pool):
+    """Routes for registering uploads as datasets, parsed in the given AnalysisPool"""
+    router = APIRouter()
+
+    @router.post("/registry")
+    async def register_dataset(file: UploadFile = File(...)):
+        """
+        Parse an upload once and keep it as a dataset; returns its datasetId,
+        which the analyze endpoints accept in place of a file.
+        """
+        try:
+            dataset_id = await run_in_threadpool(upload_cache_key, file.file, "dataset")
+            info = await run_in_threadpool(registry.info, dataset_id)
+            if info is not None:
+                return JSONResponse(content=info)
+
+            os.makedirs(registry.root, exist_ok=True)
+            upload = await run_in_threadpool(Upload.receive, file)
+            try:
+                stored = await pool.run(store_upload, upload, registry.path(dataset_id), registry.cube_path(dataset_id))
+            finally:
+                upload.discard()
+            info = await run_in_threadpool(registry.add, dataset_id, file.filename, stored)
+            info["skippedLines"] = stored["skippedLines"]
+            return JSONResponse(status_code=201, content=info)
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Registering the dataset failed: {str(e)}")
+
+    @router.get("/registry")
+    async def list_datasets():
+        return JSONResponse(content=registry.list())
+
+    @router.get("/registry/{dataset_id}")
+    async def get_dataset(dataset_id: str):
+        info = registry.info(dataset_id)
+        if info is None:
+            raise HTTPException(status_code=404, detail="Dataset not found")
+        return JSONResponse(content=info)
+
+    @router.delete("/registry/{dataset_id}")
+    async def delete_dataset(dataset_id: str):
+        if not registry.delete(dataset_id):
+            raise HTTPException(status_code=404, detail="Dataset not found")
+        return JSONResponse(content={"deleted": dataset_id})
+
+    return router
@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:  # pandas < 2.2
+    from pandas._libs.tslibs.parsing import guess_datetime_format
+
+# Transaction-level columns (as in sample.csv); Invoice and Quantity are optional
+INVOICE_COLUMNS = ['Invoice', 'InvoiceDate', 'Product', 'Revenue', 'Quantity']
+
+ROLLUP_MEASURES = ['revenue', 'quantity', 'lines', 'invoices']
+
+
+def has_invoice_columns(columns):
+    """True if a table has the columns rollup_invoices() needs"""
+    return all(column in columns for column in ['InvoiceDate', 'Product', 'Revenue'])
+
+
+def guess_date_format(dates):
+    """
+    The format the first 1000 dates are written in, e.g. "%d/%m/%Y %H:%M":
+    day/month or month/day, whichever parses more of them. None if there
+    is no single format.
+    """
+    sample = pd.Series(dates).dropna().head(1000).astype(str)
+    best, parsed = None, 0
+    for dayfirst in (False, True):
+        date_format = guess_datetime_format(sample.iloc[0], dayfirst=dayfirst) if len(sample) else None
+        if date_format is None:
+            continue
+        count = int(pd.to_datetime(sample, format=date_format, errors='coerce').notna().sum())
+        if count > parsed:
+            best, parsed = date_format, count
+    return best
+
+
+def invoice_months(dates, date_format=None):
+    """
+    Months since 1970-01 of each date (strings or datetimes), and a mask of
+    the ones that parsed. Strings are parsed with date_format, guessed if
+    not given; an explicit format keeps parsing vectorized and every chunk
+    of a file reading its dates the same way.
+    """
+    dates = pd.Series(dates)
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        # Invoice logs repeat their timestamps, so each distinct one is parsed
+        # once; only the month matters, so times are cut off first and each
+        # distinct day is parsed once
+        codes, uniques = _codes(dates)
+        uniques = pd.Series(uniques).astype(str)
+        date_format = date_format or guess_date_format(uniques) or 'mixed'
+        day_format, _, time_format = date_format.partition(' ')
+        if time_format and '%' in day_format:
+            day_codes, days = pd.factorize(uniques.str.replace(r' .*', '', regex=True))
+            months, valid = _months(pd.to_datetime(pd.Series(days), errors='coerce', format=day_format))
+            months, valid = months[day_codes], valid[day_codes]
+        else:
+            months, valid = _months(pd.to_datetime(uniques, errors='coerce', format=date_format))
+        return np.where(codes >= 0, months[codes], 0), valid[codes] & (codes >= 0)
+    return _months(dates)
+
+
+def _months(dates):
+    valid = dates.notna().to_numpy()
+    months = dates.to_numpy(dtype='datetime64[ns]').astype('datetime64[M]').astype(np.int64)
+    return np.where(valid, months, 0), valid
+
+
+def _codes(values, sort=False):
+    # Integer codes plus the distinct values they index
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = values.cat.categories
+        codes = values.cat.codes.to_numpy()
+        if sort and not categories.is_monotonic_increasing:
+            rank = np.argsort(np.argsort(categories.to_numpy()))
+            categories = categories.sort_values()
+            codes = np.where(codes >= 0, rank[codes], -1)
+        return codes, categories
+    return pd.factorize(values, sort=sort)
+
+
+def rollup_invoices(df, date_format=None):
+    """
+    Roll invoice lines up into one row per Product and month: revenue,
+    quantity, number of lines and number of distinct invoices.
+
+    Everything is done on integer codes with a single sort, by product,
+    month and invoice, after which the rows of each product-month are
+    contiguous and are summed with np.add.reduceat; a new invoice starts
+    wherever the invoice code changes inside a group. Lines whose date
+    doesn't parse are left out. Rows come out sorted by Product and month
+    (months since 1970-01, see invoice_months).
+    """
+    products, names = _codes(df['Product'], sort=True)
+    months, valid = invoice_months(df['InvoiceDate'], date_format)
+    revenue = pd.to_numeric(df['Revenue'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+    quantity = pd.to_numeric(df['Quantity'], errors='coerce').fillna(0).to_numpy(dtype=np.int64) \
+        if 'Quantity' in df.columns else np.zeros(len(df), dtype=np.int64)
+    invoices = _codes(df['Invoice'])[0] if 'Invoice' in df.columns else np.arange(len(df))
+
+    keep = np.flatnonzero(valid & (products >= 0))
+    if not len(keep):
+        return pd.DataFrame({'Product': pd.Series([], dtype=object), 'month': np.array([], dtype=np.int64),
+                             **{measure: np.array([], dtype=np.int64) for measure in ROLLUP_MEASURES}})
+
+    # One sort: product, then month, then invoice
+    first_month = months[keep].min()
+    span = months[keep].max() - first_month + 1
+    group = products.astype(np.int64) * span + (months - first_month)
+    order = keep[np.lexsort((invoices[keep], group[keep]))]
+    group = group[order]
+    invoices = invoices[order]
+
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    new_invoice = np.r_[True, invoices[1:] != invoices[:-1]]
+    new_invoice[starts] = True
+    return pd.DataFrame({
+        'Product': np.asarray(names, dtype=object)[products[order[starts]]],
+        'month': months[order[starts]],
+        'revenue': np.add.reduceat(revenue[order], starts),
+        'quantity': np.add.reduceat(quantity[order], starts),
+        'lines': np.diff(np.r_[starts, len(order)]),
+        'invoices': np.add.reduceat(new_invoice.astype(np.int64), starts)
+    })
+
+
+def rollup_invoice_chunks(chunks):
+    """
+    rollup_invoices() over an iterator of DataFrames (e.g. read_table with
+    chunksize), combining the chunks' rollups as it goes. The date format
+    is settled on the first chunk. An invoice whose lines straddle two
+    chunks counts once in each.
+    """
+    rollup = None
+    date_format = None
+    for chunk in chunks:
+        if date_format is None and pd.api.types.is_string_dtype(chunk['InvoiceDate']):
+            date_format = guess_date_format(chunk['InvoiceDate'])
+        part = rollup_invoices(chunk, date_format)
+        if rollup is not None:
+            part = pd.concat([rollup, part], ignore_index=True)
+            part = part.groupby(['Product', 'month'], sort=True)[ROLLUP_MEASURES].sum().reset_index()
+        rollup = part
+    return rollup if rollup is not None else rollup_invoices(pd.DataFrame(columns=INVOICE_COLUMNS))
+
+
+def market_metrics(rollup):
+    """
+    Per-product monthly metrics from a rollup_invoices() table:
+
+    - YearMonth ("YYYY-MM"), revenue, quantity, lines and invoices
+    - marketRevenue: every product's revenue that month
+    - marketShare: revenue / marketRevenue
+    - growth: month-over-month change in the product's revenue, NaN in
+      its first month and after a month without sales
+
+    The rollup is already sorted by product and month, so the market
+    totals and the previous month come from grouped window operations
+    (transform and shift) rather than a loop over products.
+    """
+    metrics = rollup.copy()
+    metrics['YearMonth'] = metrics['month'].to_numpy().astype('datetime64[M]').astype(str)
+    metrics['marketRevenue'] = metrics.groupby('month', sort=False)['revenue'].transform('sum')
+    metrics['marketShare'] = metrics['revenue'] / metrics['marketRevenue'].where(metrics['marketRevenue'] != 0)
+
+    by_product = metrics.groupby('Product', sort=False)
+    previous = by_product['revenue'].shift()
+    consecutive = by_product['month'].shift() == metrics['month'] - 1
+    metrics['growth'] = (metrics['revenue'] / previous.where(consecutive & (previous != 0)) - 1)
+    return metrics
+
+
+def product_snapshot(metrics, month=None):
+    """
+    One row per product for a BCG matrix, from market_metrics(): its
+    MarketShare of the given month's revenue (the latest month by default),
+    its MarketGrowth over the month before and its Quantity and Revenue
+    that month. Products that sold the month before but not this one are
+    kept, with no share and a growth of -1.
+    """
+    if month is None:
+        month = metrics['month'].max()
+    elif isinstance(month, str):
+        month = np.datetime64(month, 'M').astype(np.int64)
+
+    current = metrics[metrics['month'] == month].set_index('Product')
+    previous = metrics[metrics['month'] == month - 1].set_index('Product')
+    products = current.index.union(previous.index)
+
+    revenue = current['revenue'].reindex(products, fill_value=0)
+    earlier = previous['revenue'].reindex(products)
+    market = revenue.sum()
+    return pd.DataFrame({
+        'Product': products.astype(str),
+        'MarketShare': (revenue / market if market else revenue * 0).to_numpy(),
+        'MarketGrowth': (revenue / earlier.where(earlier != 0) - 1).to_numpy(),
+        'Quantity': current['quantity'].reindex(products, fill_value=0).to_numpy(),
+        'Revenue': revenue.to_numpy()
+    })
@@ -0,0 +1,121 @@
+import asyncio
+import time
+import uuid
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+
+# Finished jobs (and their results) kept in memory for polling
+MAX_FINISHED_JOBS = 500
+
+
+class JobStore:
+    """
+    In-memory registry of background analyses.
+
+    submit() starts the work in an asyncio task and returns straight away;
+    clients then poll /jobs/{id} for queued/running/done/failed plus timings
+    and fetch the result JSON from /jobs/{id}/result once it is done.
+    """
+
+    def __init__(self, max_finished=MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self.jobs = {}
+        self.results = {}
+        self.tasks = {}
+
+    def submit(self, kind, work, *args):
+        """
+        Run `await work(*args, on_start=callback)` in the background.
+
+        work is called right away and must return an awaitable; it calls
+        on_start once the analysis actually begins running (the
+        AnalysisPool does this when a worker becomes free).
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            "jobId": job_id,
+            "kind": kind,
+            "status": "queued",
+            "submittedAt": time.time(),
+            "startedAt": None,
+            "finishedAt": None,
+            "error": None
+        }
+        self.jobs[job_id] = job
+
+        def on_start():
+            job["status"] = "running"
+            job["startedAt"] = time.time()
+
+        awaitable = work(*args, on_start=on_start)
+        self.tasks[job_id] = asyncio.ensure_future(self._run(job, awaitable))
+        return job
+
+    async def _run(self, job, awaitable):
+        try:
+            self.results[job["jobId"]] = await awaitable
+            job["status"] = "done"
+        except HTTPException as e:
+            job["status"] = "failed"
+            job["error"] = e.detail
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = f"Analysis failed: {str(e)}"
+        finally:
+            job["finishedAt"] = time.time()
+            self.tasks.pop(job["jobId"], None)
+            self._evict()
+
+    def _evict(self):
+        finished = [j for j in self.jobs.values() if j["finishedAt"] is not None]
+        if len(finished) <= self.max_finished:
+            return
+        finished.sort(key=lambda j: j["finishedAt"])
+        for job in finished[:len(finished) - self.max_finished]:
+            self.jobs.pop(job["jobId"], None)
+            self.results.pop(job["jobId"], None)
+
+    def status(self, job_id):
+        """Job record with derived timings, or None if unknown"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+
+        now = time.time()
+        status = dict(job)
+        started = job["startedAt"]
+        finished = job["finishedAt"]
+        status["queuedSeconds"] = round((started or finished or now) - job["submittedAt"], 3)
+        status["runSeconds"] = round((finished or now) - started, 3) if started else None
+        if job["status"] == "done":
+            status["resultUrl"] = f"/jobs/{job_id}/result"
+        return status
+
+    def result(self, job_id):
+        return self.results.get(job_id)
+
+
+def create_job_router(store):
+    """Routes for polling the jobs of one JobStore"""
+    router = APIRouter()
+
+    @router.get("/jobs/{job_id}")
+    async def get_job(job_id: str):
+        status = store.status(job_id)
+        if status is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return JSONResponse(content=status)
+
+    @router.get("/jobs/{job_id}/result")
+    async def get_job_result(job_id: str):
+        status = store.status(job_id)
+        if status is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if status["status"] == "failed":
+            raise HTTPException(status_code=500, detail=status["error"])
+        if status["status"] != "done":
+            raise HTTPException(status_code=409, detail=f"Job is still {status['status']}")
+        return JSONResponse(content=store.result(job_id))
+
+    return router
@@ -0,0 +1,225 @@
+import json
+import os
+from typing import Any, Dict, Union
+
+import pandas as pd
+
+from bcg import classify_quadrants, threshold
+from charts import IMAGE_MODES, DATA_MODES, chart_spec, chart_url, chart_data, render_charts
+from table_loader import compact_frame, read_table
+from uploads import Upload
+
+# Where each analysis's charts go, one directory per job (created by the API's ArtifactStore)
+output_dir = os.path.join(os.path.dirname(__file__), '../temp/output')
+
+# Every column analyze_market_data may pick (see its column_mapping), so
+# uploads can be read with only these
+MARKET_COLUMNS = ['category', 'product_category', 'niche', 'segment', 'product_type',
+                  'sales', 'revenue', 'amount', 'sales_amount', 'volume',
+                  'profit_margin', 'margin', 'profit', 'profitability',
+                  'customer_segment', 'customer', 'demographic', 'audience', 'product']
+
+# Of those, the ones analyze_market_data groups by, held as categoricals
+MARKET_CATEGORIES = ['category', 'product_category', 'niche', 'segment', 'product_type',
+                     'customer_segment', 'customer', 'demographic', 'audience']
+
+def run_market_analysis(file_path: Union[str, Upload], job_id: str, render: str = "png") -> Dict[str, Any]:
+    """Load an uploaded CSV and find niche markets; runs inside an analysis worker"""
+    # CSV, Parquet, Feather or Arrow; only the columns we might use are read
+    read_report = {}
+    df = read_table(file_path, read_report, columns=MARKET_COLUMNS)
+    compact_frame(df, read_report, categories=MARKET_CATEGORIES)
+    print(f"Data held in {read_report['memoryAfter'] / 1e6:.1f} MB ({read_report['memoryBefore'] / 1e6:.1f} MB as parsed)")
+    
+    # Process the data to find niche markets
+    results = analyze_market_data(df, job_id, render)
+    results["skippedLines"] = read_report["skippedLines"]
+    results["memory"] = {"before": read_report["memoryBefore"], "after": read_report["memoryAfter"]}
+    return results
+
+def analyze_market_data(df: pd.DataFrame, job_id: str, render: str = "png") -> Dict[str, Any]:
+    """Analyze market data to identify profitable niche markets; charts go in the job's directory"""
+    results = {
+        "success": True,
+        "topNiches": [],
+        "marketPotential": [],
+        "recommendations": [],
+        "graphs": {}
+    }
+    
+    try:
+        # Ensure required columns exist or use reasonable defaults
+        required_columns = ['category', 'sales', 'profit_margin', 'customer_segment']
+        
+        # Check if columns exist or find suitable alternatives
+        column_mapping = {}
+        for req_col in required_columns:
+            if req_col in df.columns:
+                column_mapping[req_col] = req_col
+            else:
+                # Try to find alternative columns
+                if req_col == 'category' and any(col in df.columns for col in ['product_category', 'niche', 'segment', 'product_type']):
+                    for alt in ['product_category', 'niche', 'segment', 'product_type']:
+                        if alt in df.columns:
+                            column_mapping[req_col] = alt
+                            break
+                elif req_col == 'sales' and any(col in df.columns for col in ['revenue', 'amount', 'sales_amount', 'volume']):
+                    for alt in ['revenue', 'amount', 'sales_amount', 'volume']:
+                        if alt in df.columns:
+                            column_mapping[req_col] = alt
+                            break
+                elif req_col == 'profit_margin' and any(col in df.columns for col in ['margin', 'profit', 'profitability']):
+                    for alt in ['margin', 'profit', 'profitability']:
+                        if alt in df.columns:
+                            column_mapping[req_col] = alt
+                            break
+                elif req_col == 'customer_segment' and any(col in df.columns for col in ['customer', 'segment', 'demographic', 'audience']):
+                    for alt in ['customer', 'segment', 'demographic', 'audience']:
+                        if alt in df.columns:
+                            column_mapping[req_col] = alt
+                            break
+        
+        # Check if we have the minimum required data
+        if 'category' not in column_mapping or ('sales' not in column_mapping and 'profit_margin' not in column_mapping):
+            raise ValueError("Could not find required columns in the dataset")
+        
+        # Extract data with mapped columns
+        category_col = column_mapping.get('category')
+        sales_col = column_mapping.get('sales')
+        profit_margin_col = column_mapping.get('profit_margin')
+        segment_col = column_mapping.get('customer_segment')
+        chart_specs = {}
+        
+        # Analyze sales by niche/category
+        if sales_col:
+            # Group by category and sum sales
+            sales_by_niche = df.groupby(category_col, observed=True)[sales_col].sum().sort_values(ascending=False)
+            
+            # Get top niches by sales
+            top_niches = sales_by_niche.head(5).index.tolist()
+            results["topNiches"] = top_niches
+            
+            # Create market potential data
+            market_potential = []
+            for niche, sales in sales_by_niche.head(10).items():
+                potential = "High" if sales > sales_by_niche.median() * 1.5 else "Medium" if sales > sales_by_niche.median() else "Low"
+                market_potential.append({
+                    "niche": niche,
+                    "potential": potential,
+                    "sales": float(sales)
+                })
+            results["marketPotential"] = market_potential
+            
+            # Create sales by niche visualization
+            chart_specs["salesByNiche"] = chart_spec(
+                "palette_bars", f"{output_dir}/{job_id}/sales_by_niche.png",
+                labels=[str(n) for n in sales_by_niche.head(10).index], values=sales_by_niche.head(10).tolist(),
+                title="Top  Niches by Sales", palette="viridis", ylabel=category_col, show_values=True
+            )
+            
+            # Create a visualization of top products within top niches if product column exists
+            if 'product' in df.columns:
+                top_niche = top_niches[0]
+                top_products = df[df[category_col] == top_niche].groupby('product', observed=True)[sales_col].sum().sort_values(ascending=False).head(5)
+                
+                chart_specs["topProducts"] = chart_spec(
+                    "palette_bars", f"{output_dir}/{job_id}/top_products.png",
+                    labels=[str(p) for p in top_products.index], values=top_products.tolist(),
+                    title=f"Top Products in {top_niche} Niche", palette="magma", ylabel='product'
+                )
+        
+        # Generate BCG Matrix if we have both sales and profit margin
+        if sales_col and profit_margin_col:
+            # Calculate market share (relative to highest sales in category)
+            df_bcg = df.groupby(category_col, observed=True).agg({
+                sales_col: 'sum',
+                profit_margin_col: 'mean'
+            }).reset_index()
+            
+            # Normalize market share relative to largest category
+            df_bcg['relative_market_share'] = df_bcg[sales_col] / df_bcg[sales_col].max()
+            
+            # Create BCG Matrix, sized by sales
+            chart_specs["bcgMatrix"] = chart_spec(
+                "share_margin_matrix", f"{output_dir}/{job_id}/bcg_matrix.png",
+                labels=df_bcg[category_col].astype(str).tolist(),
+                shares=df_bcg['relative_market_share'].tolist(),
+                margins=df_bcg[profit_margin_col].tolist(),
+                sizes=(df_bcg[sales_col] / df_bcg[sales_col].max() * 500).tolist(),
+                margin_line=float(df_bcg[profit_margin_col].median())
+            )
+            
+            # Generate recommendations based on BCG matrix (profit margin stands in for growth)
+            quadrant = classify_quadrants(
+                df_bcg['relative_market_share'], df_bcg[profit_margin_col],
+                0.5, threshold(df_bcg[profit_margin_col]), unclassified=None
+            )
+            stars = df_bcg[category_col][quadrant == "Star"].tolist()
+            question_marks = df_bcg[category_col][quadrant == "Question Mark"].tolist()
+            cash_cows = df_bcg[category_col][quadrant == "Cash Cow"].tolist()
+            dogs = df_bcg[category_col][quadrant == "Dog"].tolist()
+            
+            recommendations = []
+            
+            if stars:
+                recommendations.append(f"Invest in {stars[0]} - high growth and high market share make it a prime opportunity.")
+            
+            if question_marks:
+                recommendations.append(f"Evaluate {question_marks[0]} - high growth potential but needs investment to increase market share.")
+            
+            if cash_cows:
+                recommendations.append(f"Maintain {cash_cows[0]} - use the steady cash flow to fund growth in other areas.")
+            
+            if dogs:
+                recommendations.append(f"Consider divesting from {dogs[0]} - low market share and low growth indicate poor prospects.")
+            
+            # Add general recommendations
+            recommendations.append(f"Focus marketing efforts on {top_niches[0]} which shows the highest sales potential.")
+            
+            if len(top_niches) > 1:
+                recommendations.append(f"Develop specialized product offerings for {top_niches[1]} to capture this growing niche.")
+            
+            results["recommendations"] = recommendations
+            
+            # Create a summary of the BCG matrix
+            bcg_summary = {
+                "stars": stars,
+                "question_marks": question_marks,
+                "cash_cows": cash_cows,
+                "dogs": dogs
+            }
+            
+            # Save BCG summary as JSON
+            with open(f"{output_dir}/{job_id}/bcg_matrix_summary.json", "w") as f:
+                json.dump(bcg_summary, f)
+            results["bcgMatrix"] = bcg_summary
+        
+        # Charts go out as PNG URLs, as the series behind them, or both
+        if render in IMAGE_MODES:
+            results["graphs"] = {name: chart_url(spec) for name, spec in chart_specs.items()}
+        if render in DATA_MODES:
+            results["chartData"] = {name: chart_data(spec) for name, spec in chart_specs.items()}
+        
+        # The charts don't depend on each other, so draw them concurrently
+        # (or, in lazy mode, only when their URLs are first requested)
+        render_charts(list(chart_specs.values()), render)
+        
+        # Add graphUrl for frontend display
+        if "salesByNiche" in results["graphs"]:
+            results["graphUrl"] = f"http://localhost:8002{results['graphs']['salesByNiche']}"
+        elif "bcgMatrix" in results["graphs"]:
+            results["graphUrl"] = f"http://localhost:8002{results['graphs']['bcgMatrix']}"
+        
+        return results
+    
+    except Exception as e:
+        print(f"Error in market analysis: {str(e)}")
+        # Return basic results with error info
+        return {
+            "success": False,
+            "error": str(e),
+            "topNiches": ["Error in analysis"],
+            "marketPotential": [],
+            "recommendations": ["Could not analyze the data. Please check the file format."],
+            "graphs": {}
+        }
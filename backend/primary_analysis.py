@@ -0,0 +1,219 @@
+import os
+
+import numpy as np
+
+from charts import IMAGE_MODES, DATA_MODES, chart_spec, chart_url, chart_data, render_charts
+from quote_selection import get_representative_quotes
+from table_loader import compact_frame, read_table
+from text_features import build_text_features, sentiment_texts, phrase_counts, tfidf_matrix, StreamingTextStats
+
+# Where each analysis's charts go, one directory per job (created by the API's ArtifactStore)
+output_dir = os.path.join(os.path.dirname(__file__), '../temp/output')
+
+# Rows per chunk when an upload is read chunk by chunk
+STREAMING_CHUNK_ROWS = int(os.environ.get("PRIMARY_STREAMING_CHUNK_ROWS", "50000"))
+
+# The only columns the sentiment analysis reads from an upload
+FEEDBACK_COLUMNS = ['feedback', 'sentiment']
+
+def run_primary_analysis(file_path, job_id, streaming=False, render="png"):
+    """Load an uploaded CSV and analyze it; runs inside an analysis worker"""
+    # CSV, Parquet, Feather or Arrow; only the needed columns are read
+    read_report = {}
+    if streaming:
+        # A chunk at a time
+        chunks = read_table(file_path, read_report, columns=FEEDBACK_COLUMNS, chunksize=STREAMING_CHUNK_ROWS)
+        results = analyze_sentiment_stream(chunks, job_id, render)
+    else:
+        df = read_table(file_path, read_report, columns=FEEDBACK_COLUMNS)
+        df = df.dropna(subset=['feedback', 'sentiment'])
+        df['feedback'] = df['feedback'].astype(str)
+        compact_frame(df, read_report, categories=['sentiment'], keep=['feedback'])
+        
+        # Process the data using functions from primary.py
+        results = analyze_sentiment_data(df, job_id, render)
+        results["memory"] = {"before": read_report["memoryBefore"], "after": read_report["memoryAfter"]}
+    
+    results["skippedLines"] = read_report["skippedLines"]
+    return results
+
+def analyze_sentiment_data(df, job_id, render="png"):
+    """Analyze sentiment data and create visualizations"""
+    # Tokenize the feedback once; every text stage below slices this matrix
+    features = build_text_features(df)
+    
+    # Get representative quotes
+    pos_texts = sentiment_texts(features, 'positive')
+    neg_texts = sentiment_texts(features, 'negative')
+    
+    X_pos, _ = tfidf_matrix(features, 'positive')
+    X_neg, _ = tfidf_matrix(features, 'negative')
+    
+    summary = {
+        "sentimentCounts": df['sentiment'].value_counts(),
+        "topPositiveQuotes": get_representative_quotes(pos_texts, n=5, X=X_pos),
+        "topNegativeQuotes": get_representative_quotes(neg_texts, n=5, X=X_neg),
+        "negativePhrases": None,
+        "positivePhrases": None,
+        "opportunityTerms": []
+    }
+    
+    # Use bigrams and trigrams for more context
+    if neg_texts:
+        summary["negativePhrases"] = phrase_counts(features, 'negative', ngram_range=(2,3), max_features=30)
+    
+    if pos_texts:
+        summary["positivePhrases"] = phrase_counts(features, 'positive', ngram_range=(2,3), max_features=30)
+        
+        # Also add separate opportunities extraction as in primary.py
+        Xp_opp, phrases_opp = tfidf_matrix(features, 'positive', max_features=20)
+        scores_opp = np.asarray(Xp_opp.sum(axis=0)).ravel()
+        summary["opportunityTerms"] = [phrases_opp[i] for i in scores_opp.argsort()[::-1][:5]]
+    
+    return build_sentiment_results(summary, job_id, render)
+
+def analyze_sentiment_stream(chunks, job_id, render="png"):
+    """
+    Analyze sentiment data delivered as an iterator of DataFrame chunks.
+    
+    Only sentiment counts, bounded n-gram tables and a bounded sample of
+    feedback for quotes/opportunities are kept between chunks, so peak
+    memory does not grow with the size of the upload.
+    """
+    stats = StreamingTextStats()
+    for chunk in chunks:
+        chunk = chunk.dropna(subset=['feedback', 'sentiment'])
+        chunk['feedback'] = chunk['feedback'].astype(str)
+        stats.update(chunk)
+    
+    # Quotes and opportunities come from the bounded feedback sample
+    sample = stats.sample_frame()
+    features = build_text_features(sample)
+    pos_texts = sentiment_texts(features, 'positive')
+    neg_texts = sentiment_texts(features, 'negative')
+    
+    X_pos, _ = tfidf_matrix(features, 'positive')
+    X_neg, _ = tfidf_matrix(features, 'negative')
+    
+    summary = {
+        "sentimentCounts": stats.sentiment_counts(),
+        "topPositiveQuotes": get_representative_quotes(pos_texts, n=5, X=X_pos),
+        "topNegativeQuotes": get_representative_quotes(neg_texts, n=5, X=X_neg),
+        "negativePhrases": stats.phrase_counts('negative', max_features=30),
+        "positivePhrases": stats.phrase_counts('positive', max_features=30),
+        "opportunityTerms": []
+    }
+    
+    if pos_texts:
+        Xp_opp, phrases_opp = tfidf_matrix(features, 'positive', max_features=20)
+        scores_opp = np.asarray(Xp_opp.sum(axis=0)).ravel()
+        summary["opportunityTerms"] = [phrases_opp[i] for i in scores_opp.argsort()[::-1][:5]]
+    
+    return build_sentiment_results(summary, job_id, render)
+
+def build_sentiment_results(summary, job_id, render="png"):
+    """Turn aggregated sentiment statistics into the API result and charts in the job's directory"""
+    results = {
+        "success": True,
+        "metrics": {},
+        "graphs": {},
+        "topPositiveQuotes": summary["topPositiveQuotes"],
+        "topNegativeQuotes": summary["topNegativeQuotes"],
+        "painPoints": [],
+        "positivePoints": [],
+        "opportunities": []
+    }
+    chart_specs = {}
+    
+    # Calculate metrics
+    sentiment_counts = summary["sentimentCounts"]
+    results["metrics"] = {
+        "totalResponses": int(sentiment_counts.sum()),
+        "positiveCount": int(sentiment_counts.get('positive', 0)),
+        "negativeCount": int(sentiment_counts.get('negative', 0)),
+        "neutralCount": int(sentiment_counts.get('neutral', 0))
+    }
+    
+    # Generate pain points visualization (improved version); feedback with
+    # nothing but stop words has no phrases to chart
+    if summary["negativePhrases"] is not None and len(summary["negativePhrases"][1]):
+        scores_n, phrases_n = summary["negativePhrases"]
+        top_pain_points = [phrases_n[i] for i in scores_n.argsort()[::-1][:10]]
+        
+        # Define negative keywords for filtering
+        negative_keywords = [
+            'not', 'no', 'poor', 'bad', 'terrible', 'broke', 'never', 'worst',
+            'disappoint', 'problem', 'issue', 'fail', 'hate', 'awful', 'broken',
+            'difficult', 'slow', 'unhappy', 'unacceptable', 'complain', 'refund'
+        ]
+        filtered_pain_points = [p for p in top_pain_points if any(neg in p for neg in negative_keywords)]
+        
+        # If we don't have enough filtered points, use the top ones without filtering
+        if len(filtered_pain_points) < 5:
+            pain_points_to_display = top_pain_points[:5]
+        else:
+            pain_points_to_display = filtered_pain_points[:5]
+        
+        # Create pain points bar chart
+        freqs = [scores_n[phrases_n.tolist().index(p)] for p in pain_points_to_display]
+        chart_specs["painPointsGraph"] = chart_spec(
+            "keyword_bars", f"{output_dir}/{job_id}/pain_points.png",
+            labels=list(pain_points_to_display), counts=[int(f) for f in freqs],
+            title="Top Pain-Point Keywords", color='#e74c3c'
+        )
+        
+        # Add pain points to results
+        results["painPoints"] = pain_points_to_display
+    
+    # Generate positive points visualization (improved version)
+    if summary["positivePhrases"] is not None and len(summary["positivePhrases"][1]):
+        scores_pos, phrases_pos = summary["positivePhrases"]
+        top_positive_points = [phrases_pos[i] for i in scores_pos.argsort()[::-1][:10]]
+        
+        # Define positive keywords for filtering
+        positive_keywords = [
+            'great', 'amazing', 'excellent', 'value', 'fast', 'recommend', 'satisfied',
+            'love', 'best', 'happy', 'perfect', 'wonderful', 'pleased', 'awesome'
+        ]
+        filtered_positive_points = [p for p in top_positive_points if any(pos in p for pos in positive_keywords)]
+        
+        # If we don't have enough filtered points, use the top ones without filtering
+        if len(filtered_positive_points) < 5:
+            pos_points_to_display = top_positive_points[:5]
+        else:
+            pos_points_to_display = filtered_positive_points[:5]
+        
+        # Create positive points bar chart
+        freqs_pos = [scores_pos[phrases_pos.tolist().index(p)] for p in pos_points_to_display]
+        chart_specs["opportunitiesGraph"] = chart_spec(
+            "keyword_bars", f"{output_dir}/{job_id}/opportunities.png",
+            labels=list(pos_points_to_display), counts=[int(f) for f in freqs_pos],
+            title="Top Positive-Point Keywords", color="#27ae60"
+        )
+        
+        # Add positive points to results
+        results["positivePoints"] = pos_points_to_display
+        
+    if summary["opportunityTerms"]:
+        results["opportunities"] = [
+            f"Enhance *{feat}*. Rationale: praised frequently in positive feedback." 
+            for feat in summary["opportunityTerms"]
+        ]
+    
+    # Generate sentiment distribution pie chart
+    chart_specs["sentimentGraph"] = chart_spec(
+        "sentiment_pie", f"{output_dir}/{job_id}/sentiment_dist.png",
+        labels=[str(label) for label in sentiment_counts.index], counts=[int(c) for c in sentiment_counts]
+    )
+    
+    # Charts go out as PNG URLs, as the series behind them, or both
+    if render in IMAGE_MODES:
+        results["graphs"] = {name: chart_url(spec) for name, spec in chart_specs.items()}
+    if render in DATA_MODES:
+        results["chartData"] = {name: chart_data(spec) for name, spec in chart_specs.items()}
+    
+    # The charts don't depend on each other, so draw them concurrently
+    # (or, in lazy mode, only when their URLs are first requested)
+    render_charts(list(chart_specs.values()), render)
+    
+    return results
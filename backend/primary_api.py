@@ -1,22 +1,25 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, FileResponse, HTMLResponse
-from fastapi.staticfiles import StaticFiles
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from wordcloud import WordCloud
+from fastapi.concurrency import run_in_threadpool
 import os
 import tempfile
 import time
 import json
-import shutil
 from typing import Optional
 import io
 from jinja2 import Environment, FileSystemLoader
 
+from analysis_pool import AnalysisPool
+from artifacts import ArtifactStore
+from charts import RENDER_MODES, LazyChartFiles, cache_render_mode
+from dataset_registry import DatasetRegistry, create_registry_router
+from jobs import JobStore, create_job_router
+from primary_analysis import output_dir, run_primary_analysis
+from result_cache import ResultCache, dataset_cache_key, upload_cache_key
+from result_store import save_result, load_result
+from uploads import Upload
+
 # Try to import WeasyPrint, but make it optional
 try:
     from weasyprint import HTML
@@ -38,270 +41,135 @@ app.add_middleware(
 )
 
 # Create output directory if it doesn't exist
-output_dir = os.path.join(os.path.dirname(__file__), '../temp/output')
 os.makedirs(output_dir, exist_ok=True)
 
-# Mount the static directory for serving images
-app.mount("/temp/output", StaticFiles(directory=output_dir), name="output")
+# Mount the static directory for serving images; charts reserved with
+# render=lazy are drawn the first time they are requested
+app.mount("/temp/output", LazyChartFiles(directory=output_dir), name="output")
+
+# Uploads larger than this are read chunk by chunk instead of all at once
+STREAMING_THRESHOLD_BYTES = int(os.environ.get("PRIMARY_STREAMING_THRESHOLD_MB", "100")) * 1024 * 1024
+
+# CPU-bound analysis runs here instead of on the event loop; the workers
+# import the analysis module, never this one (its app, weasyprint probe, ...)
+analysis_pool = AnalysisPool(warm_modules=["primary_analysis"])
+
+# Background analyses submitted with job=true, polled via /jobs/{id}
+job_store = JobStore()
+app.include_router(create_job_router(job_store))
+
+# Re-uploads of the same file return the earlier result instead of re-running
+result_cache = ResultCache(output_dir)
+
+# Each analysis writes its charts into its own directory under output_dir
+artifact_store = ArtifactStore(output_dir)
+
+# Uploads registered once via /registry and then analyzed by dataset_id;
+# the three APIs share the stored files
+dataset_registry = DatasetRegistry()
+app.include_router(create_registry_router(dataset_registry, analysis_pool))
+
+@app.on_event("startup")
+def start_analysis_pool():
+    analysis_pool.start()
+    artifact_store.start()
+
+@app.on_event("shutdown")
+def stop_analysis_pool():
+    analysis_pool.shutdown()
+    artifact_store.stop()
 
 @app.post("/analyze_primary")
 async def analyze_primary_research(
-    file: UploadFile = File(...),
-    description: Optional[str] = Form(None)
+    file: Optional[UploadFile] = File(None),
+    dataset_id: Optional[str] = Form(None),
+    description: Optional[str] = Form(None),
+    streaming: Optional[bool] = Form(None),
+    job: bool = Form(False),
+    render: str = Form("png")
 ):
-    # Create a timestamp for unique filenames
+    # When the analysis ran; the report shows it
     timestamp = int(time.time() * 1000)
     
     try:
-        # Save uploaded file to a temporary location
-        temp_file_path = f"{output_dir}/temp_{timestamp}_{file.filename}"
-        with open(temp_file_path, "wb") as temp_file:
-            shutil.copyfileobj(file.file, temp_file)
-        
-        # Load and process the data
-        df = pd.read_csv(temp_file_path)
-        df = df.dropna(subset=['feedback', 'sentiment'])
-        df['feedback'] = df['feedback'].astype(str)
+        if render not in RENDER_MODES:
+            raise HTTPException(status_code=400, detail=f"render must be one of: {', '.join(RENDER_MODES)}")
+        if (file is None) == (dataset_id is None):
+            raise HTTPException(status_code=400, detail="Send either a file or the dataset_id of a registered dataset")
+        
+        # A registered dataset is read from its stored file instead of an upload
+        registered = dataset_registry.open(dataset_id) if dataset_id is not None else None
+        
+        # Decide on streaming mode from the upload size unless the client chose
+        if streaming is None:
+            if registered is not None:
+                size = os.path.getsize(registered.path)
+            else:
+                file.file.seek(0, os.SEEK_END)
+                size = file.file.tell()
+                file.file.seek(0)
+            streaming = size > STREAMING_THRESHOLD_BYTES
+        
+        # Identical uploads (or the same registered dataset) with identical
+        # options share one cached result
+        params = {"streaming": streaming, "render": cache_render_mode(render)}
+        if registered is not None:
+            cache_key = dataset_cache_key(dataset_id, "primary", params)
+        else:
+            cache_key = await run_in_threadpool(upload_cache_key, file.file, "primary", params)
         
-        # Process the data using functions from primary.py
-        results = analyze_sentiment_data(df, timestamp)
+        if job:
+            analysis_pool.check_capacity()
         
-        # Add timestamp to the results
-        results["timestamp"] = timestamp
+        # Take the upload from the request's spooled file (spilled outside
+        # the served directory if it is big), even if the result is cached
+        # now: the entry may be gone by the time the analysis starts.
+        # start_upload discards it, but leaves a registered dataset's file alone
+        upload = registered or await run_in_threadpool(Upload.receive, file)
         
-        # Clean up temporary file
-        os.remove(temp_file_path)
+        # In job mode, answer right away and let the client poll /jobs/{id}
+        if job:
+            queued = job_store.submit("primary", result_cache.start_upload, cache_key, "primary",
+                                      process_primary_upload, upload, timestamp, streaming, render)
+            return JSONResponse(status_code=202, content=job_store.status(queued["jobId"]))
         
+        results = await result_cache.start_upload(cache_key, "primary", process_primary_upload, upload, timestamp, streaming, render)
         return JSONResponse(content=results)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
-def analyze_sentiment_data(df, timestamp):
-    """Analyze sentiment data and create visualizations"""
-    results = {
-        "success": True,
-        "metrics": {},
-        "graphs": {},
-        "topPositiveQuotes": [],
-        "topNegativeQuotes": [],
-        "painPoints": [],
-        "positivePoints": [],
-        "opportunities": []
-    }
-    
-    # Calculate metrics
-    results["metrics"] = {
-        "totalResponses": len(df),
-        "positiveCount": len(df[df.sentiment == 'positive']),
-        "negativeCount": len(df[df.sentiment == 'negative']),
-        "neutralCount": len(df[df.sentiment == 'neutral']) if 'neutral' in df.sentiment.unique() else 0
-    }
-    
-    # Get representative quotes
-    pos_texts = df.loc[df.sentiment=='positive', 'feedback'].unique().tolist()
-    neg_texts = df.loc[df.sentiment=='negative', 'feedback'].unique().tolist()
-    
-    results["topPositiveQuotes"] = get_representative_quotes(pos_texts, n=5)
-    results["topNegativeQuotes"] = get_representative_quotes(neg_texts, n=5)
-    
-    # Generate pain points visualization (improved version)
-    if neg_texts:
-        # Use bigrams and trigrams for more context
-        cv = CountVectorizer(stop_words='english', ngram_range=(2,3), max_features=30)
-        Xn = cv.fit_transform(neg_texts)
-        scores_n = np.asarray(Xn.sum(axis=0)).ravel()
-        phrases_n = cv.get_feature_names_out()
-        top_pain_points = [phrases_n[i] for i in scores_n.argsort()[::-1][:10]]
-        
-        # Define negative keywords for filtering
-        negative_keywords = [
-            'not', 'no', 'poor', 'bad', 'terrible', 'broke', 'never', 'worst',
-            'disappoint', 'problem', 'issue', 'fail', 'hate', 'awful', 'broken',
-            'difficult', 'slow', 'unhappy', 'unacceptable', 'complain', 'refund'
-        ]
-        filtered_pain_points = [p for p in top_pain_points if any(neg in p for neg in negative_keywords)]
-        
-        # If we don't have enough filtered points, use the top ones without filtering
-        if len(filtered_pain_points) < 5:
-            pain_points_to_display = top_pain_points[:5]
-        else:
-            pain_points_to_display = filtered_pain_points[:5]
-        
-        # Create pain points bar chart
-        freqs = [scores_n[phrases_n.tolist().index(p)] for p in pain_points_to_display]
-        plt.figure(figsize=(10, 6))  # Increase figure size for better visibility
-        ax = plt.gca()
-        bars = ax.barh(pain_points_to_display[::-1], freqs[::-1], color='#e74c3c')
-        plt.title("Top Pain-Point Keywords", fontsize=14, pad=20)
-        plt.xlabel("Count", fontsize=12)
-        
-        # Add some padding to ensure text is fully visible
-        plt.tight_layout(pad=2.0)
-        
-        # Adjust the left margin to ensure long labels are fully visible
-        plt.subplots_adjust(left=0.3)
-        
-        # Add values at the end of each bar
-        for i, bar in enumerate(bars):
-            width = bar.get_width()
-            ax.text(width + 0.3, bar.get_y() + bar.get_height()/2, f"{width:.0f}",
-                    ha='left', va='center', fontsize=10)
-        
-        # Save the chart with higher DPI for better quality
-        pain_points_path = f"{output_dir}/pain_points_{timestamp}.png"
-        plt.savefig(pain_points_path, dpi=120, bbox_inches='tight')
-        plt.close()
-        results["graphs"]["painPointsGraph"] = f"/temp/output/pain_points_{timestamp}.png"
-        
-        # Add pain points to results
-        results["painPoints"] = pain_points_to_display
-    
-    # Generate positive points visualization (improved version)
-    if pos_texts:
-        # Use bigrams and trigrams for more context in positive feedback
-        cv_pos = CountVectorizer(stop_words='english', ngram_range=(2,3), max_features=30)
-        Xp_pos = cv_pos.fit_transform(pos_texts)
-        scores_pos = np.asarray(Xp_pos.sum(axis=0)).ravel()
-        phrases_pos = cv_pos.get_feature_names_out()
-        top_positive_points = [phrases_pos[i] for i in scores_pos.argsort()[::-1][:10]]
-        
-        # Define positive keywords for filtering
-        positive_keywords = [
-            'great', 'amazing', 'excellent', 'value', 'fast', 'recommend', 'satisfied',
-            'love', 'best', 'happy', 'perfect', 'wonderful', 'pleased', 'awesome'
-        ]
-        filtered_positive_points = [p for p in top_positive_points if any(pos in p for pos in positive_keywords)]
-        
-        # If we don't have enough filtered points, use the top ones without filtering
-        if len(filtered_positive_points) < 5:
-            pos_points_to_display = top_positive_points[:5]
-        else:
-            pos_points_to_display = filtered_positive_points[:5]
-        
-        # Create positive points bar chart
-        freqs_pos = [scores_pos[phrases_pos.tolist().index(p)] for p in pos_points_to_display]
-        plt.figure(figsize=(10, 6))  # Increase figure size for better visibility
-        ax = plt.gca()
-        bars = ax.barh(pos_points_to_display[::-1], freqs_pos[::-1], color="#27ae60")  # Better green color
-        plt.title("Top Positive-Point Keywords", fontsize=14, pad=20)
-        plt.xlabel("Count", fontsize=12)
-        
-        # Add some padding to ensure text is fully visible
-        plt.tight_layout(pad=2.0)
-        
-        # Adjust the left margin to ensure long labels are fully visible
-        plt.subplots_adjust(left=0.3)
-        
-        # Add values at the end of each bar
-        for i, bar in enumerate(bars):
-            width = bar.get_width()
-            ax.text(width + 0.3, bar.get_y() + bar.get_height()/2, f"{width:.0f}",
-                    ha='left', va='center', fontsize=10)
-        
-        # Save the chart with higher DPI for better quality
-        opp_path = f"{output_dir}/opportunities_{timestamp}.png"
-        plt.savefig(opp_path, dpi=120, bbox_inches='tight')
-        plt.close()
-        results["graphs"]["opportunitiesGraph"] = f"/temp/output/opportunities_{timestamp}.png"
-        
-        # Add positive points to results
-        results["positivePoints"] = pos_points_to_display
-        
-        # Also add separate opportunities extraction as in primary.py
-        tfidf_opp = TfidfVectorizer(stop_words='english', max_features=20)
-        Xp_opp = tfidf_opp.fit_transform(pos_texts)
-        scores_opp = np.asarray(Xp_opp.sum(axis=0)).ravel()
-        phrases_opp = tfidf_opp.get_feature_names_out()
-        top5_opp = [phrases_opp[i] for i in scores_opp.argsort()[::-1][:5]]
-        
-        results["opportunities"] = [
-            f"Enhance *{feat}*. Rationale: praised frequently in positive feedback." 
-            for feat in top5_opp
-        ]
-    
-    # Generate sentiment distribution pie chart
-    sentiment_counts = df['sentiment'].value_counts()
-    plt.figure(figsize=(10, 8))
-    
-    # Define better colors with higher contrast
-    colors = {
-        'positive': '#27ae60',  # Green
-        'negative': '#e74c3c',  # Red
-        'neutral': '#3498db'    # Blue
-    }
-    
-    # Get colors in the right order based on the sentiment labels
-    color_list = [colors.get(label, '#95a5a6') for label in sentiment_counts.index]
-    
-    # Create a pie chart with a slight explode effect for better visibility
-    explode = [0.05] * len(sentiment_counts)
-    wedges, texts, autotexts = plt.pie(
-        sentiment_counts, 
-        labels=sentiment_counts.index, 
-        autopct='%1.1f%%', 
-        colors=color_list,
-        explode=explode,
-        shadow=True,
-        startangle=90,
-        textprops={'fontsize': 14}
-    )
-    
-    # Make percentage labels more readable
-    for autotext in autotexts:
-        autotext.set_color('white')
-        autotext.set_fontweight('bold')
-    
-    plt.title('Sentiment Distribution', fontsize=16, pad=20)
-    plt.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle
+async def process_primary_upload(upload, timestamp, streaming, render="png", on_start=None):
+    """Analyze an upload in a worker process and finish off the results"""
+    job_id = await run_in_threadpool(artifact_store.create_job, "primary")
+    try:
+        results = await analysis_pool.run(run_primary_analysis, upload, job_id, streaming, render,
+                                          on_start=on_start)
+    except BaseException:
+        # Nothing will ever point at a failed job's charts
+        await run_in_threadpool(artifact_store.delete_job, job_id)
+        raise
+    finally:
+        upload.discard()
+    await run_in_threadpool(artifact_store.index_job, job_id)
     
-    # Add a legend with counts
-    legend_labels = [f"{label} ({count})" for label, count in zip(sentiment_counts.index, sentiment_counts)]
-    plt.legend(wedges, legend_labels, title="Sentiment", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
+    # Add timestamp and job id to the results
+    results["timestamp"] = timestamp
+    results["jobId"] = job_id
     
-    plt.tight_layout()
-    sentiment_path = f"{output_dir}/sentiment_dist_{timestamp}.png"
-    plt.savefig(sentiment_path, dpi=120, bbox_inches='tight')
-    plt.close()
-    results["graphs"]["sentimentGraph"] = f"/temp/output/sentiment_dist_{timestamp}.png"
+    # Keep the result so reports can be rendered from it later
+    await run_in_threadpool(save_result, "primary", job_id, results)
     
     return results
 
-def get_representative_quotes(texts, n=5):
-    """
-    Pick n 'medoid-like' quotes by:
-      1) building a TF-IDF matrix,
-      2) computing pairwise cosine similarities,
-      3) choosing the text with highest total similarity,
-      4) then greedily picking next texts that maximize the minimum distance
-         (1 – cosine) to any already chosen quote.
-    """
-    if not texts or len(texts) <= n:
-        return texts
-
-    vec = TfidfVectorizer(stop_words='english')
-    X = vec.fit_transform(texts)
-    S = cosine_similarity(X)               # NxN matrix
-
-    total_sim = S.sum(axis=1)
-    selected = [int(total_sim.argmax())]   # first medoid
-
-    for _ in range(1, n):
-        # distance to selected = min over s in selected of (1 – sim[i, s])
-        dists = 1 - S[:, selected]         # shape (N, len(selected))
-        min_dist = dists.min(axis=1)
-        min_dist[selected] = -1            # exclude already chosen
-        chosen = int(min_dist.argmax())
-        selected.append(chosen)
-
-    return [texts[i] for i in selected]
-
-@app.get("/download_primary_report/{timestamp}")
-async def download_primary_report(timestamp: str, format: str = "pdf"):
+@app.get("/download_primary_report/{result_id}")
+async def download_primary_report(result_id: str, format: str = "pdf"):
     """Generate and download a report for primary research analysis
     
     Args:
-        timestamp: The timestamp of the analysis
+        result_id: The job id of the analysis
         format: The format of the report, either 'pdf' or 'html'
     """
     try:
@@ -375,23 +243,29 @@ async def download_primary_report(timestamp: str, format: str = "pdf"):
                     
                     <div class="section">
                         <h2>Sentiment Distribution</h2>
+                        {% if graphs.sentimentGraph %}
                         <div class="chart-container">
                             <img src="{{ base_url }}{{ graphs.sentimentGraph }}" alt="Sentiment Distribution">
                         </div>
+                        {% endif %}
                     </div>
                     
                     <div class="section">
                         <h2>Pain Points Analysis</h2>
+                        {% if graphs.painPointsGraph %}
                         <div class="chart-container">
                             <img src="{{ base_url }}{{ graphs.painPointsGraph }}" alt="Pain Points Analysis">
                         </div>
+                        {% endif %}
                     </div>
                     
                     <div class="section">
                         <h2>Opportunities Analysis</h2>
+                        {% if graphs.opportunitiesGraph %}
                         <div class="chart-container">
                             <img src="{{ base_url }}{{ graphs.opportunitiesGraph }}" alt="Opportunities Analysis">
                         </div>
+                        {% endif %}
                     </div>
                     
                     <div class="section">
@@ -455,66 +329,13 @@ async def download_primary_report(timestamp: str, format: str = "pdf"):
                 </html>
                 ''')
         
-        # Find the result file based on timestamp
-        result_files = [f for f in os.listdir(output_dir) if f.startswith('pain_points_' + timestamp)]
+        # Load the stored analysis result for this job id
+        result = await run_in_threadpool(load_result, "primary", result_id)
         
-        if not result_files:
-            raise HTTPException(status_code=404, detail="No analysis results found for this timestamp")
+        if result is None:
+            raise HTTPException(status_code=404, detail="No analysis results found for this id")
             
-        # Load previously generated analysis results
-        # Since we don't store them, we'll have to reconstruct based on the file paths
-        timestamp_str = timestamp
-        
-        # Create a mock result with the image paths
-        mock_result = {
-            "success": True,
-            "metrics": {
-                "totalResponses": 100,
-                "positiveCount": 65,
-                "negativeCount": 25,
-                "neutralCount": 10
-            },
-            "graphs": {
-                "sentimentGraph": f"/temp/output/sentiment_dist_{timestamp_str}.png",
-                "painPointsGraph": f"/temp/output/pain_points_{timestamp_str}.png",
-                "opportunitiesGraph": f"/temp/output/opportunities_{timestamp_str}.png"
-            },
-            "topPositiveQuotes": [
-                "Love the product, definitely would recommend!",
-                "Customer service was excellent.",
-                "Great value for money.",
-                "The quality exceeded my expectations.",
-                "Shipping was fast and packaging was great."
-            ],
-            "topNegativeQuotes": [
-                "Delivery took way too long.",
-                "The product didn't meet my expectations.",
-                "Too expensive for what it offers.",
-                "Had issues with the customer support.",
-                "The quality could be better."
-            ],
-            "painPoints": [
-                "poor quality",
-                "customer service issue",
-                "delivery too slow",
-                "product not working",
-                "difficult to use"
-            ],
-            "positivePoints": [
-                "great experience",
-                "excellent service",
-                "fast delivery",
-                "best quality",
-                "highly recommend"
-            ],
-            "opportunities": [
-                "Enhance *customer service*. Rationale: praised frequently in positive feedback.",
-                "Enhance *delivery speed*. Rationale: praised frequently in positive feedback.",
-                "Enhance *product quality*. Rationale: praised frequently in positive feedback.",
-                "Enhance *user interface*. Rationale: praised frequently in positive feedback.",
-                "Enhance *packaging*. Rationale: praised frequently in positive feedback."
-            ]
-        }
+        timestamp_str = str(result["timestamp"])
         
         # Create temp directory for rendering
         temp_dir = tempfile.mkdtemp()
@@ -531,13 +352,13 @@ async def download_primary_report(timestamp: str, format: str = "pdf"):
         html_content = template.render(
             timestamp=display_date,
             base_url="http://localhost:8000",
-            metrics=mock_result["metrics"],
-            graphs=mock_result["graphs"],
-            topPositiveQuotes=mock_result["topPositiveQuotes"],
-            topNegativeQuotes=mock_result["topNegativeQuotes"],
-            painPoints=mock_result["painPoints"],
-            positivePoints=mock_result["positivePoints"],
-            opportunities=mock_result["opportunities"]
+            metrics=result["metrics"],
+            graphs=result["graphs"],
+            topPositiveQuotes=result["topPositiveQuotes"],
+            topNegativeQuotes=result["topNegativeQuotes"],
+            painPoints=result["painPoints"],
+            positivePoints=result["positivePoints"],
+            opportunities=result["opportunities"]
         )
         
         # If format is HTML or PDF is not available, return HTML
@@ -568,6 +389,8 @@ async def download_primary_report(timestamp: str, format: str = "pdf"):
                 headers={"Content-Disposition": f"inline; filename=primary_research_report_{timestamp_str}.html"}
             )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate report: {str(e)}")
 
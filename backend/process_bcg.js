@@ -2,13 +2,154 @@ const { spawn } = require('child_process');
 const path = require('path');
 const fs = require('fs');
 
+// Resident `python ball.py --serve` processes handle the BCG jobs, so
+// pandas/matplotlib/seaborn are imported once per process instead of once per
+// request. A worker runs one job at a time, written to its stdin as a JSON
+// line and answered on stdout. Small files share a pool of workers; streamed
+// files have a lane of their own so a long read never holds them up.
+const BCG_WORKERS = Math.max(1, parseInt(process.env.BCG_WORKERS || '2', 10));
+const BCG_STREAM_WORKERS = Math.max(1, parseInt(process.env.BCG_STREAM_WORKERS || '1', 10));
+
+const lanes = {
+  small: { size: BCG_WORKERS, workers: [], queue: [] },
+  stream: { size: BCG_STREAM_WORKERS, workers: [], queue: [] }
+};
+let nextJobId = 1;
+
+// CSVs at least this big are read in chunks by ball.py instead of loaded whole
+const BCG_STREAM_MIN_BYTES = parseInt(process.env.BCG_STREAM_MIN_MB || '100', 10) * 1024 * 1024;
+
+// Leading bytes of the columnar formats the worker reads besides CSV
+const COLUMNAR_MAGIC = ['PAR1', 'ARROW1', 'FEA1'].map((magic) => Buffer.from(magic))
+  .concat([Buffer.from([0xff, 0xff, 0xff, 0xff])]);
+
+function startBcgWorker(lane) {
+  const proc = spawn('python', [path.join(__dirname, 'ball.py'), '--serve']);
+  const worker = { proc, lane, job: null, retired: false, buffer: '' };
+  lane.workers.push(worker);
+  
+  proc.stdout.on('data', (data) => {
+    worker.buffer += data.toString();
+    let newline;
+    while ((newline = worker.buffer.indexOf('\n')) >= 0) {
+      const line = worker.buffer.slice(0, newline).trim();
+      worker.buffer = worker.buffer.slice(newline + 1);
+      if (!line) continue;
+      
+      let message;
+      try {
+        message = JSON.parse(line);
+      } catch (error) {
+        console.log(`Python output: ${line}`);
+        continue;
+      }
+      
+      if (worker.job && message.id === worker.job.id) {
+        finishJob(worker).resolve(message);
+        dispatch(lane);
+      }
+    }
+  });
+  
+  // Progress messages from ball.py
+  proc.stderr.on('data', (data) => {
+    console.log(`Python output: ${data.toString()}`);
+  });
+  
+  // Only the job the worker was running fails; queued jobs go to a new worker
+  const fail = (error) => {
+    if (worker.retired) {
+      return;
+    }
+    retireWorker(worker);
+    if (worker.job) {
+      finishJob(worker).reject(error);
+    }
+    dispatch(lane);
+  };
+  
+  proc.stdin.on('error', (error) => {
+    fail(new Error(`BCG worker is not accepting jobs: ${error.message}`));
+  });
+  
+  proc.on('close', (code) => {
+    if (!worker.retired) {
+      console.error(`BCG worker exited with code ${code}`);
+    }
+    fail(new Error(`BCG worker exited with code ${code}`));
+  });
+  
+  // Handle process error (e.g., Python not found)
+  proc.on('error', (error) => {
+    console.error('Failed to start Python process:', error);
+    fail(new Error(`Failed to start Python process: ${error.message}`));
+  });
+  
+  return worker;
+}
+
+function retireWorker(worker) {
+  worker.retired = true;
+  worker.lane.workers = worker.lane.workers.filter((other) => other !== worker);
+}
+
+function finishJob(worker) {
+  const job = worker.job;
+  worker.job = null;
+  clearTimeout(job.timeout);
+  return job;
+}
+
+// Hand queued jobs to idle workers, starting workers up to the lane's size
+function dispatch(lane) {
+  while (lane.queue.length > 0) {
+    let worker = lane.workers.find((candidate) => !candidate.job);
+    if (!worker) {
+      if (lane.workers.length >= lane.size) {
+        return;
+      }
+      worker = startBcgWorker(lane);
+    }
+    const job = lane.queue.shift();
+    worker.job = job;
+    
+    // The timeout counts from here, not from when the job was queued. A job
+    // stuck past it means its worker is stuck too: fail the job and replace
+    // the worker, the other jobs carry on
+    job.timeout = setTimeout(() => {
+      console.error(`Python process timed out after ${job.timeoutMs/1000} seconds`);
+      retireWorker(worker);
+      finishJob(worker).reject(new Error('Analysis timed out. The file may be too large or complex to process.'));
+      worker.proc.kill();
+      dispatch(lane);
+    }, job.timeoutMs);
+    
+    worker.proc.stdin.write(JSON.stringify({ id: job.id, ...job.request }) + '\n');
+  }
+}
+
+function runBcgJob(csvFilePath, outputFilePath, timeoutMs, stream = false, overTime = false) {
+  const lane = stream ? lanes.stream : lanes.small;
+  return new Promise((resolve, reject) => {
+    lane.queue.push({
+      id: nextJobId++,
+      request: { csv: csvFilePath, output: outputFilePath, stream, overTime },
+      timeoutMs,
+      resolve,
+      reject
+    });
+    dispatch(lane);
+  });
+}
+
 /**
- * Process a CSV file using the Python ball.py script
+ * Process a CSV file with a resident Python ball.py worker
  * @param {string} csvFilePath - Path to the CSV file
  * @param {string} outputDir - Directory where output files will be saved
+ * @param {boolean} overTime - Also track the BCG categories month by month (summary.evolution)
  * @returns {Promise<{imagePath: string, summaryData: object}>}
  */
-async function processBCGMatrix(csvFilePath, outputDir = './temp/output') {
+async function processBCGMatrix(csvFilePath, outputDir = './temp/output', overTime = false) {
   return new Promise((resolve, reject) => {
     // Ensure output directory exists
     if (!fs.existsSync(outputDir)) {
@@ -23,115 +164,80 @@ async function processBCGMatrix(csvFilePath, outputDir = './temp/output') {
     console.log(`Output will be saved to: ${outputFilePath}`);
     
     // Check if input file exists and has content
+    let stats;
     try {
       if (!fs.existsSync(csvFilePath)) {
         return reject(new Error(`Input file does not exist: ${csvFilePath}`));
       }
       
-      const stats = fs.statSync(csvFilePath);
+      stats = fs.statSync(csvFilePath);
       if (stats.size === 0) {
         return reject(new Error(`Input file is empty: ${csvFilePath}`));
       }
       
       // Check if file is readable and has valid CSV format
-      const firstFewLines = fs.readFileSync(csvFilePath, 'utf8', { encoding: 'utf8' }).slice(0, 500);
-      if (!firstFewLines.includes(',')) {
+      const head = Buffer.alloc(500);
+      const fd = fs.openSync(csvFilePath, 'r');
+      const bytesRead = fs.readSync(fd, head, 0, head.length, 0);
+      fs.closeSync(fd);
+      const firstFewLines = head.toString('utf8', 0, bytesRead);
+      // Parquet, Feather and Arrow files are read by the worker as they are
+      const columnar = COLUMNAR_MAGIC.some((magic) => head.subarray(0, bytesRead).indexOf(magic) === 0);
+      if (!columnar && !firstFewLines.includes(',')) {
         return reject(new Error(`Input file does not appear to be a valid CSV: ${csvFilePath}`));
       }
     } catch (fsError) {
       return reject(new Error(`Error reading input file: ${fsError.message}`));
     }
     
-    // Run Python script with timeout
-    const pythonProcess = spawn('python', [
-      path.join(__dirname, 'ball.py'),
-      csvFilePath,
-      outputFilePath
-    ]);
-    
-    let pythonOutput = '';
-    let pythonErrors = '';
-    
-    // Set a timeout to kill the process if it takes too long
-    const timeoutMs = 60000; // 60 seconds
-    const timeout = setTimeout(() => {
-      console.error(`Python process timed out after ${timeoutMs/1000} seconds`);
-      pythonProcess.kill();
-      reject(new Error('Analysis timed out. The file may be too large or complex to process.'));
-    }, timeoutMs);
-    
-    // Collect data from stdout
-    pythonProcess.stdout.on('data', (data) => {
-      const dataStr = data.toString();
-      pythonOutput += dataStr;
-      console.log(`Python output: ${dataStr}`);
-    });
-    
-    // Collect errors from stderr
-    pythonProcess.stderr.on('data', (data) => {
-      const dataStr = data.toString();
-      pythonErrors += dataStr;
-      console.error(`Python error: ${dataStr}`);
-    });
-    
-    // Handle process completion
-    pythonProcess.on('close', (code) => {
-      clearTimeout(timeout);
-      
-      if (code !== 0) {
-        console.error(`Python process exited with code ${code}`);
-        
-        // Create a more user-friendly error message based on common errors
-        let errorMessage = `Python script failed: ${pythonErrors}`;
-        
-        if (pythonErrors.includes('Error tokenizing data') || pythonErrors.includes('EOF inside string')) {
-          errorMessage = 'CSV parsing error: The file contains improperly formatted data. Please check for unclosed quotes or special characters.';
-        } else if (pythonErrors.includes('could not convert string to float')) {
-          errorMessage = 'Data format error: Some numeric values in your CSV are not properly formatted.';
+    // Send the job to a resident Python worker, with a timeout
+    // (streamed files get 30 minutes, they are read twice)
+    const stream = stats.size >= BCG_STREAM_MIN_BYTES;
+    const timeoutMs = stream ? 30 * 60000 : 60000; // 60 seconds
+    runBcgJob(csvFilePath, outputFilePath, timeoutMs, stream, overTime)
+      .then((response) => {
+        if (!response.ok) {
+          console.error(`BCG analysis failed: ${response.error}`);
+          
+          // Create a more user-friendly error message based on common errors
+          let errorMessage = `Python script failed: ${response.error}`;
+          
+          if (response.error.includes('Error tokenizing data') || response.error.includes('EOF inside string')) {
+            errorMessage = 'CSV parsing error: The file contains improperly formatted data. Please check for unclosed quotes or special characters.';
+          } else if (response.error.includes('could not convert string to float')) {
+            errorMessage = 'Data format error: Some numeric values in your CSV are not properly formatted.';
+          }
+          
+          return reject(new Error(errorMessage));
         }
         
-        return reject(new Error(errorMessage));
-      }
-      
-      // Read summary data from JSON file
-      const summaryPath = outputFilePath.replace('.png', '_summary.json');
-      if (!fs.existsSync(summaryPath)) {
-        return reject(new Error('Summary file not found. Analysis may have failed silently.'));
-      }
-      
-      // Check if image was created
-      if (!fs.existsSync(outputFilePath)) {
-        return reject(new Error('Image file not found. Analysis may have failed silently.'));
-      }
-      
-      try {
-        const summaryData = JSON.parse(fs.readFileSync(summaryPath, 'utf8'));
-        
-        // Validate summary data structure
-        if (!summaryData.thresholds || !summaryData.counts) {
-          return reject(new Error('Generated summary data is incomplete or invalid.'));
+        // Check if image was created
+        if (!fs.existsSync(outputFilePath)) {
+          return reject(new Error('Image file not found. Analysis may have failed silently.'));
         }
         
-        // Convert image to base64
-        const imageBuffer = fs.readFileSync(outputFilePath);
-        const base64Image = `data:image/png;base64,${imageBuffer.toString('base64')}`;
-        
-        resolve({
-          imagePath: outputFilePath,
-          imageBase64: base64Image,
-          summaryData
-        });
-      } catch (error) {
-        reject(new Error(`Error processing analysis results: ${error.message}`));
-      }
-    });
-    
-    // Handle process error (e.g., Python not found)
-    pythonProcess.on('error', (error) => {
-      clearTimeout(timeout);
-      console.error('Failed to start Python process:', error);
-      reject(new Error(`Failed to start Python process: ${error.message}`));
-    });
+        try {
+          const summaryData = response.summary;
+          
+          // Validate summary data structure
+          if (!summaryData || !summaryData.thresholds || !summaryData.counts) {
+            return reject(new Error('Generated summary data is incomplete or invalid.'));
+          }
+          
+          // Convert image to base64
+          const imageBuffer = fs.readFileSync(outputFilePath);
+          const base64Image = `data:image/png;base64,${imageBuffer.toString('base64')}`;
+          
+          resolve({
+            imagePath: outputFilePath,
+            imageBase64: base64Image,
+            summaryData
+          });
+        } catch (error) {
+          reject(new Error(`Error processing analysis results: ${error.message}`));
+        }
+      })
+      .catch(reject);
   });
 }
 
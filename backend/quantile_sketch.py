@@ -0,0 +1,128 @@
+import math
+
+import numpy as np
+
+# Default rank error of a QuantileSketch (0.01 = within 1% of the rows)
+SKETCH_ERROR = 0.01
+
+# Compactor capacities shrink by this factor per level below the top one
+_CAPACITY_DECAY = 2 / 3
+
+
+class QuantileSketch:
+    """
+    Mergeable approximate quantiles of a numeric column (a KLL sketch).
+
+    Feed it values chunk by chunk with update(), or build one sketch per
+    chunk, file or worker and combine them with merge(); quantile() then
+    answers for everything seen so far. Values are kept in levels of
+    compactors, where an item on level h stands for 2**h values; a full
+    level is sorted and every other item moved up one level. The answer is
+    within about `error` * count ranks of the true quantile (with high
+    probability), whatever the number of values, while only about
+    3 * 1.7 / error values are stored. Until the first compaction every value
+    is kept and quantile() matches Series.quantile exactly.
+
+    NaNs are ignored. Sketches only merge with sketches of the same error.
+    to_dict()/from_dict() turn one into JSON and back.
+    """
+
+    def __init__(self, error=SKETCH_ERROR, seed=0):
+        self.error = error
+        self.k = max(8, math.ceil(1.7 / error))
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - 1 - level
+        return max(2, math.ceil(self.k * _CAPACITY_DECAY ** depth))
+
+    def _compress(self):
+        while sum(len(level) for level in self.levels) > sum(self._capacity(h) for h in range(len(self.levels))):
+            h = next(h for h, level in enumerate(self.levels) if len(level) >= self._capacity(h))
+            items = np.sort(self.levels[h])
+            # An odd item out stays behind on this level
+            keep = items[len(items) - len(items) % 2:]
+            promoted = items[self._rng.integers(2):len(items) - len(keep):2]
+            self.levels[h] = keep
+            if h + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+
+    def update(self, values):
+        """Add a chunk of values (anything np.asarray understands)"""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return self
+
+        self.count += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """Add everything other has seen to this sketch"""
+        if other.error != self.error:
+            raise ValueError("Can only merge sketches with the same error")
+
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, level in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], level])
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        """Approximate q-quantile, interpolated like Series.quantile; NaN when empty"""
+        if not self.count:
+            return float("nan")
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        values = values[order]
+        # Items cover consecutive ranks; pick the ones covering the two
+        # ranks around q * (count - 1) and interpolate between them
+        last_rank = np.cumsum(weights[order]) - 1
+        position = q * last_rank[-1]
+        lower = values[np.searchsorted(last_rank, math.floor(position))]
+        upper = values[np.searchsorted(last_rank, math.ceil(position))]
+        fraction = position - math.floor(position)
+        # Same rounding as numpy's linear interpolation
+        if fraction >= 0.5:
+            value = upper - (upper - lower) * (1 - fraction)
+        else:
+            value = lower + (upper - lower) * fraction
+        return float(min(max(value, self.min), self.max))
+
+    def to_dict(self):
+        return {
+            "error": self.error,
+            "count": self.count,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "levels": [level.tolist() for level in self.levels]
+        }
+
+    @classmethod
+    def from_dict(cls, data, seed=0):
+        sketch = cls(data["error"], seed=seed)
+        sketch.count = data["count"]
+        if sketch.count:
+            sketch.min = data["min"]
+            sketch.max = data["max"]
+        sketch.levels = [np.asarray(level, dtype=np.float64) for level in data["levels"]]
+        return sketch
@@ -0,0 +1,64 @@
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+
+def select_representative_rows(X, n=5):
+    """
+    Pick n 'medoid-like' rows of an L2-normalised sparse TF-IDF matrix.
+
+    Works directly on the sparse matrix instead of building the dense NxN
+    cosine similarity matrix, so memory stays O(nnz + N):
+      1) the sum of similarities of every row is X @ (X^T 1),
+      2) the first pick is the row with the highest total similarity,
+      3) each next pick maximises the minimum distance (1 – cosine) to the
+         rows already chosen, kept up to date in a running min-distance vector.
+    """
+    N = X.shape[0]
+    if N == 0:
+        return []
+    n = min(n, N)
+
+    # Rows of a TfidfVectorizer matrix are already unit length, so the
+    # dot product of two rows is their cosine similarity.
+    col_sums = np.asarray(X.sum(axis=0)).ravel()
+    total_sim = np.asarray(X @ col_sums).ravel()
+    selected = [int(total_sim.argmax())]   # first medoid
+
+    min_dist = np.full(N, np.inf)
+    is_selected = np.zeros(N, dtype=bool)
+
+    for _ in range(1, n):
+        last = selected[-1]
+        is_selected[last] = True
+
+        # distance to selected = min over s in selected of (1 – sim[i, s]);
+        # only the similarities to the newest pick need to be computed
+        sim_last = np.asarray((X @ X[last].T).todense()).ravel()
+        np.minimum(min_dist, 1 - sim_last, out=min_dist)
+
+        candidates = np.where(is_selected, -1, min_dist)   # exclude already chosen
+        chosen = int(candidates.argmax())
+        selected.append(chosen)
+
+    return selected
+
+
+def get_representative_quotes(texts, n=5, X=None):
+    """
+    Pick n 'medoid-like' quotes by:
+      1) building a TF-IDF matrix,
+      2) choosing the text with highest total cosine similarity,
+      3) then greedily picking next texts that maximize the minimum distance
+         (1 – cosine) to any already chosen quote.
+    See select_representative_rows for how this avoids the NxN matrix.
+    A precomputed TF-IDF matrix whose rows line up with texts can be passed
+    as X to skip vectorizing again.
+    """
+    if not texts or len(texts) <= n:
+        return texts
+
+    if X is None:
+        vec = TfidfVectorizer(stop_words='english')
+        X = vec.fit_transform(texts)
+
+    return [texts[i] for i in select_representative_rows(X, n)]
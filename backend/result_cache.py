@@ -0,0 +1,226 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from charts import discard_pending_chart, is_chart_pending
+from result_store import RESULTS_DB, load_result, delete_result
+from uploads import Upload
+
+# Disk budget for cached results and the chart files they point to
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_MB", "1024")) * 1024 * 1024
+
+
+def upload_cache_key(fileobj, kind, params=None):
+    """
+    SHA-256 of the uploaded bytes (a file object or an uploads.Upload) plus
+    the analysis kind and parameters. Reads the whole upload, so async code
+    calls it through run_in_threadpool.
+    """
+    if isinstance(fileobj, Upload):
+        with fileobj.open() as f:
+            return upload_cache_key(f, kind, params)
+
+    digest = hashlib.sha256()
+    digest.update(json.dumps([kind, params or {}], sort_keys=True).encode())
+
+    fileobj.seek(0)
+    for block in iter(lambda: fileobj.read(1024 * 1024), b""):
+        digest.update(block)
+    fileobj.seek(0)
+
+    return digest.hexdigest()
+
+
+def dataset_cache_key(dataset_id, kind, params=None):
+    """Cache key for analyzing a registered dataset, whose id already hashes its contents"""
+    return hashlib.sha256(json.dumps([kind, params or {}, dataset_id], sort_keys=True).encode()).hexdigest()
+
+
+def _artifact_urls(value):
+    """Every '/temp/output/...' URL referenced anywhere in a result"""
+    if isinstance(value, str):
+        return [value] if value.startswith("/temp/output/") else []
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        return [url for item in value for url in _artifact_urls(item)]
+    return []
+
+
+class ResultCache:
+    """
+    Content-addressed cache of analysis results, keyed by upload_cache_key.
+
+    Entries point at results saved in the result store; a hit hands back
+    the stored JSON (and its existing chart URLs) without re-running the
+    analysis. Identical uploads arriving while the first is still being
+    analyzed wait for that run instead of starting their own. The total
+    size of cached results and their charts is kept under max_bytes by
+    evicting the least recently used entries from disk.
+
+    lookup() and store() touch SQLite and the disk, so the async methods
+    run them in the thread pool rather than on the event loop.
+    """
+
+    def __init__(self, output_dir, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.output_dir = output_dir
+        self.max_bytes = max_bytes
+        self.inflight = {}
+
+    def _connect(self):
+        conn = sqlite3.connect(RESULTS_DB, timeout=30)
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS result_cache (
+                   cache_key TEXT PRIMARY KEY,
+                   kind TEXT NOT NULL,
+                   result_id TEXT NOT NULL,
+                   size_bytes INTEGER NOT NULL,
+                   last_access REAL NOT NULL
+               )"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS result_cache_lru ON result_cache (last_access)")
+        return conn
+
+    def _artifact_path(self, url):
+        return os.path.join(self.output_dir, url[len("/temp/output/"):])
+
+    def _artifact_exists(self, url):
+        # Lazily rendered charts count as long as their spec is still pending
+        path = self._artifact_path(url)
+        return os.path.exists(path) or is_chart_pending(path)
+
+    def lookup(self, key):
+        """The cached result for key, or None on a miss"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT kind, result_id FROM result_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            result = load_result(row[0], row[1])
+            # Charts removed behind our back make the entry useless
+            if result is None or not all(self._artifact_exists(u) for u in _artifact_urls(result)):
+                with conn:
+                    conn.execute("DELETE FROM result_cache WHERE cache_key = ?", (key,))
+                return None
+
+            with conn:
+                conn.execute("UPDATE result_cache SET last_access = ? WHERE cache_key = ?", (time.time(), key))
+            return result
+        finally:
+            conn.close()
+
+    async def start(self, key, kind, work, *args, on_start=None):
+        """
+        The result of `await work(*args, on_start=...)`.
+
+        Served from the cache on a hit and shared with an in-flight run of
+        the same key; otherwise work starts now and its result is cached
+        under the given kind and the result's job id.
+        """
+        if key not in self.inflight:
+            cached = await run_in_threadpool(self.lookup, key)
+            if cached is not None:
+                if on_start is not None:
+                    on_start()
+                return cached
+
+        # No awaits from here on, so one run is started per key
+        entry = self.inflight.get(key)
+        if entry is None:
+            entry = {"started": False, "listeners": []}
+
+            def started():
+                entry["started"] = True
+                for listener in entry["listeners"]:
+                    listener()
+
+            entry["task"] = asyncio.ensure_future(self._compute(key, kind, work, args, started))
+            self.inflight[key] = entry
+
+        if on_start is not None:
+            if entry["started"]:
+                on_start()
+            else:
+                entry["listeners"].append(on_start)
+
+        # Don't let one caller going away cancel the shared run
+        return await asyncio.shield(entry["task"])
+
+    async def start_upload(self, key, kind, work, upload, *args, on_start=None):
+        """
+        start() for work on an uploads.Upload, which the caller always
+        receives: whether or not the key is cached when start() gets to it,
+        the upload is discarded once the result is in, also when the cache
+        or another run of the same key answered and work never saw it.
+        """
+        try:
+            return await self.start(key, kind, work, upload, *args, on_start=on_start)
+        finally:
+            upload.discard()
+
+    async def _compute(self, key, kind, work, args, on_start):
+        try:
+            result = await work(*args, on_start=on_start)
+            await run_in_threadpool(self.store, key, kind, result["jobId"], result)
+            return result
+        finally:
+            self.inflight.pop(key, None)
+
+    def store(self, key, kind, result_id, result):
+        """Record a stored result under key and enforce the size budget"""
+        size = len(json.dumps(result))
+        for url in _artifact_urls(result):
+            path = self._artifact_path(url)
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO result_cache (cache_key, kind, result_id, size_bytes, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, kind, str(result_id), size, time.time())
+                )
+            self._evict(conn)
+        finally:
+            conn.close()
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM result_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = conn.execute(
+            "SELECT cache_key, kind, result_id, size_bytes FROM result_cache ORDER BY last_access"
+        ).fetchall()
+        for key, kind, result_id, size in rows:
+            if total <= self.max_bytes:
+                break
+
+            # Remove the charts and the stored result along with the entry
+            result = load_result(kind, result_id)
+            for url in _artifact_urls(result or {}):
+                path = self._artifact_path(url)
+                if os.path.exists(path):
+                    os.remove(path)
+                discard_pending_chart(path)
+                # Drop the job's directory too once nothing is left in it
+                job_dir = os.path.dirname(path)
+                if os.path.normpath(job_dir) != os.path.normpath(self.output_dir):
+                    try:
+                        os.rmdir(job_dir)
+                    except OSError:
+                        pass
+            delete_result(kind, result_id)
+
+            with conn:
+                conn.execute("DELETE FROM result_cache WHERE cache_key = ?", (key,))
+            total -= size
@@ -0,0 +1,86 @@
+import json
+import os
+import sqlite3
+import time
+
+# Lives next to temp/output, outside the directory served as static files
+RESULTS_DB = os.environ.get(
+    "RESULTS_DB", os.path.join(os.path.dirname(__file__), '../temp/results.db')
+)
+
+
+def _connect():
+    os.makedirs(os.path.dirname(os.path.abspath(RESULTS_DB)), exist_ok=True)
+    conn = sqlite3.connect(RESULTS_DB, timeout=30)
+    # WAL lets the three APIs read while another one writes
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS results (
+               kind TEXT NOT NULL,
+               result_id TEXT NOT NULL,
+               created_at REAL NOT NULL,
+               payload TEXT NOT NULL,
+               PRIMARY KEY (kind, result_id)
+           )"""
+    )
+    return conn
+
+
+def save_result(kind, result_id, result):
+    """
+    Store an analysis result JSON under its id (the job id of the analysis).
+
+    Ids are never reused: storing a second result under the same id raises
+    sqlite3.IntegrityError instead of silently replacing the first one.
+    """
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO results (kind, result_id, created_at, payload) VALUES (?, ?, ?, ?)",
+                (kind, str(result_id), time.time(), json.dumps(result, separators=(',', ':')))
+            )
+    finally:
+        conn.close()
+
+
+def load_result(kind, result_id):
+    """The stored result for this id, or None if there isn't one"""
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT payload FROM results WHERE kind = ? AND result_id = ?",
+            (kind, str(result_id))
+        ).fetchone()
+    finally:
+        conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def delete_result(kind, result_id):
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("DELETE FROM results WHERE kind = ? AND result_id = ?", (kind, str(result_id)))
+    finally:
+        conn.close()
+
+
+def delete_job_results(job_id):
+    """Delete the results stored under a job id, whatever their kind"""
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("DELETE FROM results WHERE result_id = ?", (str(job_id),))
+    finally:
+        conn.close()
+
+
+def expire_results(before):
+    """Delete the results stored before this time; returns how many there were"""
+    conn = _connect()
+    try:
+        with conn:
+            return conn.execute("DELETE FROM results WHERE created_at < ?", (before,)).rowcount
+    finally:
+        conn.close()
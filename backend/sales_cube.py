@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+
+# Invoice-level columns (as in sample.csv) a cube is built from; Rating is optional
+CUBE_DIMENSIONS = ['Product', 'Country', 'YearMonth']
+CUBE_COLUMNS = CUBE_DIMENSIONS + ['Quantity', 'Revenue', 'Rating']
+
+# What each cube cell holds; the mean rating is rating_sum / rating_count
+CUBE_MEASURES = ['revenue', 'quantity', 'count', 'rating_sum', 'rating_count']
+
+# Measures a query can rank by
+QUERY_MEASURES = ['revenue', 'quantity', 'count', 'rating']
+
+
+def has_cube_columns(columns):
+    """True if a table has the invoice columns build_cube() needs"""
+    return all(column in columns for column in CUBE_COLUMNS[:-1])
+
+
+def build_cube(df):
+    """
+    Roll invoice rows up into one row per Product x Country x YearMonth
+    holding their total revenue and quantity, the number of invoice lines
+    and the sum and count of their ratings. The cube is a few thousand rows
+    however many millions of invoices went in, and every query_cube()
+    answer can be computed from it exactly.
+    """
+    rating = pd.to_numeric(df['Rating'], errors='coerce') if 'Rating' in df.columns \
+        else pd.Series(np.nan, index=df.index)
+    rows = pd.DataFrame({
+        'Product': df['Product'].astype(str),
+        'Country': df['Country'].astype(str),
+        'YearMonth': df['YearMonth'].astype(str),
+        'revenue': pd.to_numeric(df['Revenue'], errors='coerce').fillna(0).astype(np.float64),
+        'quantity': pd.to_numeric(df['Quantity'], errors='coerce').fillna(0).astype(np.int64),
+        'count': np.ones(len(df), dtype=np.int64),
+        'rating_sum': rating.fillna(0).astype(np.float64),
+        'rating_count': rating.notna().astype(np.int64)
+    })
+    cube = rows.groupby(CUBE_DIMENSIONS, observed=True, sort=True)[CUBE_MEASURES].sum().reset_index()
+    for column in ['Product', 'Country']:
+        cube[column] = cube[column].astype('category')
+    return cube
+
+
+def _previous_month(year_months):
+    # "2024-10" -> "2024-09"
+    periods = pd.PeriodIndex(year_months, freq='M') - 1
+    return periods.strftime('%Y-%m')
+
+
+def _sum_by(cells, by):
+    totals = cells.groupby(by, observed=True, sort=True)[CUBE_MEASURES].sum().reset_index()
+    totals['rating'] = totals['rating_sum'] / totals['rating_count'].where(totals['rating_count'] > 0)
+    return totals
+
+
+def query_cube(cube, by=('Product',), measure='revenue', top=None, filters=None, start=None, end=None,
+               change=False):
+    """
+    Answer a sales question from a cube built by build_cube().
+
+    Cells are narrowed to the given filters ({dimension: [values]}) and to
+    YearMonths from start to end (inclusive, "YYYY-MM"), then summed per
+    combination of the dimensions in by and sorted by measure, largest
+    first; top keeps only that many rows. Each row carries revenue,
+    quantity, count and the mean rating. With change (by must include
+    YearMonth) rows also get the measure for the month before and the
+    relative change from it, i.e. period-over-period growth.
+
+    Returns a list of dicts. Raises ValueError for unknown dimensions or
+    measures.
+    """
+    by = list(by)
+    unknown = [column for column in by + list(filters or {}) if column not in CUBE_DIMENSIONS]
+    if not by or unknown:
+        raise ValueError(f"Dimensions must be among: {', '.join(CUBE_DIMENSIONS)}")
+    if measure not in QUERY_MEASURES:
+        raise ValueError(f"measure must be one of: {', '.join(QUERY_MEASURES)}")
+    if change and 'YearMonth' not in by:
+        raise ValueError("change compares months, so by must include YearMonth")
+
+    selected = np.ones(len(cube), dtype=bool)
+    for column, values in (filters or {}).items():
+        selected &= cube[column].isin(values).to_numpy()
+    in_period = selected.copy()
+    if start is not None:
+        in_period &= (cube['YearMonth'] >= start).to_numpy()
+    if end is not None:
+        in_period &= (cube['YearMonth'] <= end).to_numpy()
+
+    totals = _sum_by(cube[in_period], by)
+    if change:
+        # The same cell a month earlier, which may lie before start
+        others = [column for column in by if column != 'YearMonth']
+        earlier = _sum_by(cube[selected], by)[others + ['YearMonth', measure]]
+        earlier = earlier.rename(columns={'YearMonth': 'previousMonth', measure: 'previous'})
+        totals['previousMonth'] = _previous_month(totals['YearMonth'])
+        totals = totals.merge(earlier, on=others + ['previousMonth'], how='left').drop(columns='previousMonth')
+        totals['change'] = (totals[measure] - totals['previous']) / totals['previous'].where(totals['previous'] != 0)
+
+    totals = totals.sort_values(measure, ascending=False, kind='stable')
+    if top is not None:
+        totals = totals.head(top)
+
+    columns = by + ['revenue', 'quantity', 'count', 'rating'] + (['previous', 'change'] if change else [])
+    records = totals[columns].astype(object).where(totals[columns].notna(), None).to_dict('records')
+    return [{key: value.item() if hasattr(value, 'item') else value for key, value in record.items()}
+            for record in records]
@@ -0,0 +1,411 @@
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from bcg import classify_quadrants
+from quantile_sketch import QuantileSketch
+
+# Datasets have their own database: an append holds its write lock, and the
+# results database's lock is shared by every analysis of the three APIs
+DATASETS_DB = os.environ.get(
+    "DATASETS_DB", os.path.join(os.path.dirname(__file__), '../temp/sales_datasets.db')
+)
+
+# Rows kept, as a uniform random sample, for the BCG chart and category counts
+DATASET_SAMPLE_ROWS = int(os.environ.get("DATASET_SAMPLE_ROWS", "20000"))
+
+# Rank error of the market share and growth sketches behind the BCG thresholds
+DATASET_SKETCH_ERROR = float(os.environ.get("DATASET_SKETCH_ERROR", "0.001"))
+
+SAMPLE_COLUMNS = ['product_details', 'total_sales', 'relative_market_share', 'market_growth']
+
+
+def _number(value):
+    # numpy scalars to plain Python numbers for JSON
+    return value.item() if hasattr(value, "item") else value
+
+
+def _apportion(counts, total):
+    # Scale counts to add up to total, handing the rounding left-overs to the largest remainders
+    scaled = {key: count * total / sum(counts.values()) for key, count in counts.items()}
+    result = {key: int(value) for key, value in scaled.items()}
+    by_remainder = sorted(scaled, key=lambda key: scaled[key] - result[key], reverse=True)
+    for key in by_remainder[:total - sum(result.values())]:
+        result[key] += 1
+    return result
+
+
+class SalesDataset:
+    """
+    A stored secondary sales dataset, as loaded for analysis by load_dataset().
+
+    append_batch() keeps these running aggregates of every batch of rows
+    (the realistic_shoe_company_data.csv columns) appended so far: per-niche
+    sales and per-product quantity totals, overall sums, quantile sketches
+    of relative market share and market growth for the BCG thresholds, and
+    a uniform random sample of DATASET_SAMPLE_ROWS rows for the BCG chart
+    and category counts. While the sample still holds every row the
+    thresholds and counts are exact, so the results match analyzing all
+    the rows at once; beyond that the thresholds are within the sketches'
+    rank error and the counts are scaled up from the sample.
+    """
+
+    def __init__(self, name, rows, batches, niche_sales, product_qty, total_sales, total_qty_sold,
+                 share, growth, share_sum, growth_sum, sample):
+        self.name = name
+        self.rows = rows
+        self.batches = batches
+        self.niche_sales = niche_sales
+        self.product_qty = product_qty
+        self.total_sales = total_sales
+        self.total_qty_sold = total_qty_sold
+        self.share = share
+        self.growth = growth
+        self.share_sum = share_sum
+        self.growth_sum = growth_sum
+        self.sample = sample
+
+    @property
+    def complete(self):
+        """True while the sample holds every row"""
+        return len(self.sample) == self.rows
+
+    @property
+    def has_market_columns(self):
+        return self.share.count > 0 and self.growth.count > 0
+
+    def market_values(self):
+        """Share and growth to take the BCG thresholds from: the sample while it is complete, else the sketches"""
+        if self.complete:
+            return self.sample['relative_market_share'], self.sample['market_growth']
+        return self.share, self.growth
+
+    def niche_sales_frame(self):
+        """Niches by total sales, like the group-by in analyze_data"""
+        niche_sales = pd.DataFrame({
+            'product_niche': sorted(self.niche_sales),
+            'total_sales': [self.niche_sales[key] for key in sorted(self.niche_sales)]
+        })
+        return niche_sales.sort_values('total_sales', ascending=False)
+
+    def top_products_frame(self, n=5):
+        """The n products with the most units sold, like the group-by in analyze_data"""
+        top_products = pd.DataFrame({
+            'product_details': sorted(self.product_qty),
+            'total_qty_sold': [self.product_qty[key] for key in sorted(self.product_qty)]
+        })
+        return top_products.sort_values('total_qty_sold', ascending=False).head(n)
+
+    def category_counts(self, thresholds):
+        """Products per BCG category: exact while the sample is complete, else scaled from it"""
+        categories = classify_quadrants(
+            self.sample['relative_market_share'], self.sample['market_growth'],
+            thresholds['rms_high'], thresholds['mg_high'], share_low=thresholds['rms_low']
+        )
+        counts = pd.Series(categories).value_counts().to_dict()
+        return counts if self.complete else _apportion(counts, self.rows)
+
+    def means(self):
+        """Average relative market share and market growth over every row"""
+        share = self.share_sum / self.share.count if self.share.count else float("nan")
+        growth = self.growth_sum / self.growth.count if self.growth.count else float("nan")
+        return share, growth
+
+
+def _connect():
+    os.makedirs(os.path.dirname(os.path.abspath(DATASETS_DB)), exist_ok=True)
+    conn = sqlite3.connect(DATASETS_DB, timeout=30, isolation_level=None)
+    # WAL lets analyses read a dataset while a batch is appended to it
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(
+        """CREATE TABLE IF NOT EXISTS datasets (
+               name TEXT PRIMARY KEY,
+               sample_rows INTEGER NOT NULL,
+               sketch_error REAL NOT NULL,
+               rows INTEGER NOT NULL,
+               total_sales NUMERIC NOT NULL,
+               total_qty_sold NUMERIC NOT NULL,
+               share_sum REAL NOT NULL,
+               growth_sum REAL NOT NULL,
+               updated_at REAL NOT NULL
+           );
+           CREATE TABLE IF NOT EXISTS dataset_batches (
+               name TEXT NOT NULL,
+               digest TEXT NOT NULL,
+               rows INTEGER NOT NULL,
+               appended_at REAL NOT NULL,
+               PRIMARY KEY (name, digest)
+           );
+           CREATE TABLE IF NOT EXISTS dataset_niche_sales (
+               name TEXT NOT NULL,
+               niche TEXT NOT NULL,
+               sales NUMERIC NOT NULL,
+               PRIMARY KEY (name, niche)
+           );
+           CREATE TABLE IF NOT EXISTS dataset_product_qty (
+               name TEXT NOT NULL,
+               product TEXT NOT NULL,
+               qty NUMERIC NOT NULL,
+               PRIMARY KEY (name, product)
+           );
+           CREATE TABLE IF NOT EXISTS dataset_sketches (
+               name TEXT NOT NULL,
+               column_name TEXT NOT NULL,
+               state TEXT NOT NULL,
+               PRIMARY KEY (name, column_name)
+           );
+           CREATE TABLE IF NOT EXISTS dataset_sample (
+               name TEXT NOT NULL,
+               row INTEGER NOT NULL,
+               key REAL NOT NULL,
+               product_details TEXT,
+               total_sales REAL,
+               relative_market_share REAL,
+               market_growth REAL
+           );
+           CREATE INDEX IF NOT EXISTS dataset_sample_by_key ON dataset_sample (name, key);"""
+    )
+    return conn
+
+
+def _settings(conn, name):
+    # Sample size and sketch error of a stored dataset, or the defaults for a new one
+    row = conn.execute("SELECT sample_rows, sketch_error FROM datasets WHERE name = ?", (name,)).fetchone()
+    return tuple(row) if row else (DATASET_SAMPLE_ROWS, DATASET_SKETCH_ERROR)
+
+
+def _sums(df, key_column, value_column):
+    sums = df.groupby(key_column, observed=True)[value_column].sum()
+    return [(str(key), _number(value)) for key, value in sums.items()]
+
+
+def _prepare_batch(df, digest, sample_rows, sketch_error):
+    """Everything append_batch() needs from a batch, worked out before taking the write lock"""
+    batch = {
+        "settings": (sample_rows, sketch_error),
+        "rows": len(df),
+        "niche_sales": _sums(df, 'product_niche', 'total_sales'),
+        "product_qty": _sums(df, 'product_details', 'total_qty_sold'),
+        "total_sales": _number(df['total_sales'].sum()),
+        "total_qty_sold": _number(df['total_qty_sold'].sum()),
+        "sketches": {},
+        "sums": {}
+    }
+    for column in ['relative_market_share', 'market_growth']:
+        if column in df.columns:
+            values = np.asarray(df[column], dtype=np.float64)
+            batch["sketches"][column] = QuantileSketch(sketch_error).update(values)
+            batch["sums"][column] = float(np.nansum(values))
+
+    # Random keys seeded by the batch's digest; the rows with the smallest
+    # keys overall are a uniform sample of everything appended. Only the
+    # batch's own sample_rows smallest can make it into the dataset's sample
+    rng = np.random.default_rng(int(digest[:16], 16))
+    sample = pd.DataFrame({'row': np.arange(len(df)), 'key': rng.random(len(df))})
+    for column in SAMPLE_COLUMNS:
+        sample[column] = df[column].to_numpy(dtype=object if column == 'product_details' else np.float64) \
+            if column in df.columns else np.nan
+    sample = sample.nsmallest(sample_rows, 'key')
+    sample['product_details'] = [None if pd.isna(value) else str(value) for value in sample['product_details']]
+    sample = sample.astype(object).where(sample.notna(), None)
+    batch["sample"] = sample
+    return batch
+
+
+def append_batch(name, df, digest):
+    """
+    Fold a batch of rows into the stored dataset with this name, creating
+    it if needed. Returns False, changing nothing, if a batch with this
+    digest was appended before.
+
+    The batch is summed, sketched and sampled before the write lock is
+    taken; the BEGIN IMMEDIATE transaction then only upserts the niches and
+    products the batch has, merges two sketches of a size fixed by their
+    error and swaps sample rows through an index on their keys. So an
+    append costs about as much as its batch, whatever was appended before,
+    and appends from any worker or API process run one after another
+    without losing each other's rows.
+    """
+    conn = _connect()
+    try:
+        batch = _prepare_batch(df, digest, *_settings(conn, name))
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM dataset_batches WHERE name = ? AND digest = ?", (name, digest)).fetchone():
+                conn.execute("ROLLBACK")
+                return False
+
+            settings = _settings(conn, name)
+            if settings != batch["settings"]:
+                # Another process created the dataset with other settings meanwhile
+                batch = _prepare_batch(df, digest, *settings)
+            sample_rows, sketch_error = settings
+
+            conn.execute(
+                """INSERT INTO datasets (name, sample_rows, sketch_error, rows, total_sales, total_qty_sold,
+                                         share_sum, growth_sum, updated_at)
+                   VALUES (?, ?, ?, 0, 0, 0, 0, 0, ?) ON CONFLICT (name) DO NOTHING""",
+                (name, sample_rows, sketch_error, time.time())
+            )
+            offset = conn.execute("SELECT rows FROM datasets WHERE name = ?", (name,)).fetchone()[0]
+
+            conn.executemany(
+                """INSERT INTO dataset_niche_sales (name, niche, sales) VALUES (?, ?, ?)
+                   ON CONFLICT (name, niche) DO UPDATE SET sales = sales + excluded.sales""",
+                [(name, niche, sales) for niche, sales in batch["niche_sales"]]
+            )
+            conn.executemany(
+                """INSERT INTO dataset_product_qty (name, product, qty) VALUES (?, ?, ?)
+                   ON CONFLICT (name, product) DO UPDATE SET qty = qty + excluded.qty""",
+                [(name, product, qty) for product, qty in batch["product_qty"]]
+            )
+
+            for column, sketch in batch["sketches"].items():
+                row = conn.execute(
+                    "SELECT state FROM dataset_sketches WHERE name = ? AND column_name = ?", (name, column)
+                ).fetchone()
+                if row:
+                    sketch = QuantileSketch.from_dict(json.loads(row[0])).merge(sketch)
+                conn.execute(
+                    "INSERT OR REPLACE INTO dataset_sketches (name, column_name, state) VALUES (?, ?, ?)",
+                    (name, column, json.dumps(sketch.to_dict(), separators=(',', ':')))
+                )
+
+            # Keep the sample_rows smallest keys: batch rows only get in
+            # below the largest key kept so far, which then make way
+            sample = batch["sample"]
+            kept = min(offset, sample_rows)
+            if kept == sample_rows:
+                largest = conn.execute("SELECT MAX(key) FROM dataset_sample WHERE name = ?", (name,)).fetchone()[0]
+                sample = sample[sample['key'] < largest]
+            conn.executemany(
+                """INSERT INTO dataset_sample (name, row, key, product_details, total_sales,
+                                               relative_market_share, market_growth)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                [(name, int(row) + offset, *values) for row, *values in
+                 sample[['row', 'key'] + SAMPLE_COLUMNS].itertuples(index=False)]
+            )
+            excess = kept + len(sample) - sample_rows
+            if excess > 0:
+                conn.execute(
+                    """DELETE FROM dataset_sample WHERE rowid IN (
+                           SELECT rowid FROM dataset_sample WHERE name = ? ORDER BY key DESC LIMIT ?)""",
+                    (name, excess)
+                )
+
+            conn.execute(
+                """UPDATE datasets SET rows = rows + ?, total_sales = total_sales + ?,
+                       total_qty_sold = total_qty_sold + ?, share_sum = share_sum + ?,
+                       growth_sum = growth_sum + ?, updated_at = ?
+                   WHERE name = ?""",
+                (batch["rows"], batch["total_sales"], batch["total_qty_sold"],
+                 batch["sums"].get('relative_market_share', 0.0), batch["sums"].get('market_growth', 0.0),
+                 time.time(), name)
+            )
+            conn.execute(
+                "INSERT INTO dataset_batches (name, digest, rows, appended_at) VALUES (?, ?, ?, ?)",
+                (name, digest, batch["rows"], time.time())
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return True
+    finally:
+        conn.close()
+
+
+def _batches(conn, name):
+    return [
+        {"digest": digest, "rows": rows, "appendedAt": appended_at}
+        for digest, rows, appended_at in conn.execute(
+            "SELECT digest, rows, appended_at FROM dataset_batches WHERE name = ? ORDER BY appended_at, rowid",
+            (name,)
+        )
+    ]
+
+
+def dataset_info(name):
+    """Name, size and batches of the stored dataset with this name, or None if there isn't one"""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN")
+        try:
+            row = conn.execute("SELECT rows, sample_rows FROM datasets WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return None
+            rows, sample_rows = row
+            return {"name": name, "rows": rows, "exact": rows <= sample_rows, "batches": _batches(conn, name)}
+        finally:
+            conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def load_dataset(name):
+    """The stored dataset with this name, read in one snapshot, or None if there isn't one"""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN")
+        try:
+            row = conn.execute(
+                """SELECT sketch_error, rows, total_sales, total_qty_sold, share_sum, growth_sum
+                   FROM datasets WHERE name = ?""", (name,)
+            ).fetchone()
+            if row is None:
+                return None
+            sketch_error, rows, total_sales, total_qty_sold, share_sum, growth_sum = row
+
+            sketches = {
+                column: QuantileSketch.from_dict(json.loads(state))
+                for column, state in conn.execute(
+                    "SELECT column_name, state FROM dataset_sketches WHERE name = ?", (name,)
+                )
+            }
+            sample = pd.DataFrame(
+                conn.execute(
+                    """SELECT row, key, product_details, total_sales, relative_market_share, market_growth
+                       FROM dataset_sample WHERE name = ? ORDER BY row""", (name,)
+                ).fetchall(),
+                columns=['row', 'key'] + SAMPLE_COLUMNS
+            )
+            for column in ['key'] + SAMPLE_COLUMNS[1:]:
+                sample[column] = sample[column].astype(np.float64)
+
+            return SalesDataset(
+                name, rows, _batches(conn, name),
+                dict(conn.execute("SELECT niche, sales FROM dataset_niche_sales WHERE name = ?", (name,)).fetchall()),
+                dict(conn.execute("SELECT product, qty FROM dataset_product_qty WHERE name = ?", (name,)).fetchall()),
+                total_sales, total_qty_sold,
+                sketches.get('relative_market_share', QuantileSketch(sketch_error)),
+                sketches.get('market_growth', QuantileSketch(sketch_error)),
+                share_sum, growth_sum, sample
+            )
+        finally:
+            conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def delete_dataset(name):
+    """Forget a dataset; True if there was one"""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            found = conn.execute("DELETE FROM datasets WHERE name = ?", (name,)).rowcount > 0
+            for table in ['dataset_batches', 'dataset_niche_sales', 'dataset_product_qty',
+                          'dataset_sketches', 'dataset_sample']:
+                conn.execute(f"DELETE FROM {table} WHERE name = ?", (name,))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return found
+    finally:
+        conn.close()
@@ -0,0 +1,248 @@
+import os
+
+import pandas as pd
+from fastapi import HTTPException
+
+from bcg import BCG_CATEGORIES, bcg_evolution, classify_quadrants, threshold
+from charts import IMAGE_MODES, DATA_MODES, chart_spec, chart_data, render_charts
+from sales_dataset import append_batch, load_dataset
+from table_loader import compact_frame, read_table
+
+# Where each analysis's charts go, one directory per job (created by the API's ArtifactStore)
+output_dir = os.path.join(os.path.dirname(__file__), '../temp/output')
+
+# The only columns analyze_data reads from an upload
+SECONDARY_COLUMNS = ['product_niche', 'product_details', 'total_sales', 'total_qty_sold',
+                     'relative_market_share', 'market_growth']
+
+# Period of each row, read for over_time analyses ("YYYY-MM" or anything that sorts by time)
+SECONDARY_PERIOD_COLUMN = 'YearMonth'
+
+# Columns analyze_data groups by that are always held as categoricals
+SECONDARY_CATEGORIES = ['product_niche']
+
+def read_secondary_upload(file_path, columns=SECONDARY_COLUMNS):
+    """Read an upload's columns compactly; (df, read report), or a 400 if it can't be read"""
+    # Read the data from the provided file path (CSV, Parquet, Feather or Arrow)
+    try:
+        read_report = {}
+        df = read_table(file_path, read_report, columns=columns)
+        compact_frame(df, read_report, categories=SECONDARY_CATEGORIES)
+        print(f"Successfully read {read_report['format']} file with {len(df)} rows ({read_report['skippedLines']} malformed lines skipped)")
+        print(f"Data held in {read_report['memoryAfter'] / 1e6:.1f} MB ({read_report['memoryBefore'] / 1e6:.1f} MB as parsed)")
+    except Exception as e:
+        print(f"Error reading file {file_path}: {e}")
+        raise HTTPException(status_code=400, detail=f"Error reading file: {str(e)}")
+    return df, read_report
+
+def analyze_data(file_path, job_id, timestamp, render="png", over_time=False):
+    """
+    Analyze secondary research data (quantitative) and create visualizations in the job's directory.
+    With over_time each row is a product in the period of its YearMonth column, and the results also
+    get the evolution of the BCG categories across periods (see bcg_evolution).
+    """
+    columns = SECONDARY_COLUMNS + [SECONDARY_PERIOD_COLUMN] if over_time else SECONDARY_COLUMNS
+    df, read_report = read_secondary_upload(file_path, columns)
+    if over_time:
+        needed = ['relative_market_share', 'market_growth', SECONDARY_PERIOD_COLUMN]
+        missing = [col for col in needed if col not in df.columns]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"over_time needs the columns: {', '.join(missing)}")
+    
+    # Analysis 1: Group by product_niche and sum total_sales
+    niche_sales = df.groupby('product_niche', observed=True)['total_sales'].sum().reset_index()
+    niche_sales = niche_sales.sort_values('total_sales', ascending=False)
+    
+    # Analysis 2: Find top 5 products by total quantity sold
+    top_products = df.groupby('product_details', observed=True)['total_qty_sold'].sum().reset_index()
+    top_products = top_products.sort_values('total_qty_sold', ascending=False).head(5)
+    
+    # Analysis 3: BCG Matrix thresholds, if the market columns are there
+    points = thresholds = None
+    if all(col in df.columns for col in ['relative_market_share', 'market_growth']):
+        points = df
+        thresholds = bcg_thresholds(df['relative_market_share'], df['market_growth'])
+    
+    summary = {
+        'total_products': len(df),
+        'total_sales': int(df['total_sales'].sum()),
+        'total_quantity_sold': int(df['total_qty_sold'].sum()),
+        'timestamp': timestamp
+    }
+    
+    # Add average market metrics if available
+    if 'market_growth' in df.columns and 'relative_market_share' in df.columns:
+        summary['average_market_growth'] = float(df['market_growth'].mean())
+        summary['average_market_share'] = float(df['relative_market_share'].mean())
+    
+    results = build_secondary_results(niche_sales, top_products, summary, job_id, render, points, thresholds)
+    if over_time:
+        # Every period against its own cut-offs, the same percentiles as bcg_thresholds()
+        results['evolution'] = bcg_evolution(
+            df['product_details'], df[SECONDARY_PERIOD_COLUMN].astype(str),
+            df['relative_market_share'], df['market_growth'], share_q=0.66, growth_q=0.66, share_low_q=0.33
+        )
+    results['skippedLines'] = read_report['skippedLines']
+    results['memory'] = {'before': read_report['memoryBefore'], 'after': read_report['memoryAfter']}
+    return results
+
+def bcg_thresholds(share, growth):
+    """BCG cut-offs: market share and growth at their 66th and 33rd percentiles (columns or sketches)"""
+    return {
+        'rms_high': threshold(share, 0.66),
+        'rms_low': threshold(share, 0.33),
+        'mg_high': threshold(growth, 0.66),
+        'mg_low': threshold(growth, 0.33)
+    }
+
+def build_secondary_results(niche_sales, top_products, summary, job_id, render="png", points=None,
+                            thresholds=None, category_counts=None):
+    """
+    Charts, insights and summary of a secondary analysis from its aggregates.
+    
+    points are the rows drawn on the BCG chart (all of them, or a sample),
+    classified against thresholds from bcg_thresholds(); category_counts
+    defaults to counting their categories. Without points there is no BCG
+    analysis.
+    """
+    # Initialize results dictionary
+    results = {
+        "success": True,
+        "charts": [],
+        "insights": [],
+        "summary": {}
+    }
+    
+    # Generate chart 1: Total Sales by Product Niche
+    chart_specs = [chart_spec(
+        "column_bars", f'{output_dir}/{job_id}/sales_by_niche.png',
+        labels=niche_sales['product_niche'].astype(str).tolist(), values=niche_sales['total_sales'].tolist(),
+        title='Total Sales by Product Niche', xlabel='Product Niche', ylabel='Total Sales',
+        color='skyblue', figsize=(10, 6)
+    )]
+    results['charts'].append({
+        'title': 'Total Sales by Product Niche',
+        'path': f'/temp/output/{job_id}/sales_by_niche.png',
+        'description': 'Comparison of total sales across different product niches'
+    })
+    
+    # Generate chart 2: Top 5 Products by Quantity Sold
+    chart_specs.append(chart_spec(
+        "column_bars", f'{output_dir}/{job_id}/top_products.png',
+        labels=top_products['product_details'].astype(str).tolist(), values=top_products['total_qty_sold'].tolist(),
+        title='Top 5 Products by Quantity Sold', xlabel='Product Details', ylabel='Total Quantity Sold',
+        color='orange', figsize=(8, 5)
+    ))
+    results['charts'].append({
+        'title': 'Top 5 Products by Quantity Sold',
+        'path': f'/temp/output/{job_id}/top_products.png',
+        'description': 'The five best-selling products by quantity'
+    })
+    
+    # Analysis 3: BCG Matrix classification
+    if points is not None:
+        classification = pd.Series(classify_quadrants(
+            points['relative_market_share'], points['market_growth'],
+            thresholds['rms_high'], thresholds['mg_high'], share_low=thresholds['rms_low']
+        ), index=points.index)
+        
+        # Generate chart 3: BCG Matrix, labelling the first two products of each category
+        groups = []
+        for category, group in points.groupby(classification):
+            groups.append({
+                "category": category,
+                "x": group['relative_market_share'].tolist(),
+                "y": group['market_growth'].tolist(),
+                "sizes": (group['total_sales']/500).tolist(),  # Size based on sales
+                "annotations": [
+                    [row['product_details'][:10] + '...', float(row['relative_market_share']), float(row['market_growth'])]
+                    for _, row in group.head(2).iterrows()
+                ]
+            })
+        chart_specs.append(chart_spec(
+            "bcg_groups", f'{output_dir}/{job_id}/bcg_matrix.png',
+            groups=groups, share_line=float(thresholds['rms_low']), growth_line=float(thresholds['mg_low'])
+        ))
+        results['charts'].append({
+            'title': 'BCG Matrix Analysis',
+            'path': f'/temp/output/{job_id}/bcg_matrix.png',
+            'description': 'Product portfolio analysis using the BCG matrix'
+        })
+        
+        # Generate insights
+        if category_counts is None:
+            category_counts = classification.value_counts()
+        summary['category_counts'] = {category: int(category_counts.get(category, 0)) for category in BCG_CATEGORIES}
+        results['insights'] = [
+            f"Top selling product niche: {niche_sales.iloc[0]['product_niche']} with ${int(niche_sales.iloc[0]['total_sales'])} in sales",
+            f"Best selling product: {top_products.iloc[0]['product_details']} with {int(top_products.iloc[0]['total_qty_sold'])} units sold",
+            f"Portfolio composition: {category_counts.get('Star', 0)} Stars, {category_counts.get('Cash Cow', 0)} Cash Cows, {category_counts.get('Question Mark', 0)} Question Marks, {category_counts.get('Dog', 0)} Dogs"
+        ]
+    else:
+        results['insights'] = [
+            f"Top selling product niche: {niche_sales.iloc[0]['product_niche']} with ${int(niche_sales.iloc[0]['total_sales'])} in sales",
+            f"Best selling product: {top_products.iloc[0]['product_details']} with {int(top_products.iloc[0]['total_qty_sold'])} units sold"
+        ]
+    
+    # Charts go out as PNG paths, as the series behind them, or both
+    for chart, spec in zip(results['charts'], chart_specs):
+        if render not in IMAGE_MODES:
+            del chart['path']
+        if render in DATA_MODES:
+            chart['data'] = chart_data(spec)
+    
+    # The charts don't depend on each other, so draw them concurrently
+    # (or, in lazy mode, only when their URLs are first requested)
+    render_charts(chart_specs, render)
+    
+    summary['sales_by_niche'] = {
+        str(niche): float(sales) for niche, sales in zip(niche_sales['product_niche'], niche_sales['total_sales'])
+    }
+    results['summary'] = summary
+    return results
+
+def append_to_dataset(name, file_path, digest, job_id, timestamp, render="png"):
+    """Fold an upload into a stored dataset and analyze the whole dataset from its aggregates"""
+    df, read_report = read_secondary_upload(file_path)
+    missing = [col for col in SECONDARY_COLUMNS[:4] if col not in df.columns]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Missing columns: {', '.join(missing)}")
+    
+    # Appends to one dataset from any worker or API process run one at a time
+    if not append_batch(name, df, digest):
+        raise HTTPException(status_code=409, detail="This file has already been appended to the dataset")
+    dataset = load_dataset(name)
+    
+    results = dataset_results(dataset, job_id, timestamp, render)
+    results['dataset'] = {
+        'name': name,
+        'rows': dataset.rows,
+        'batches': len(dataset.batches),
+        'appendedRows': len(df),
+        'exact': dataset.complete
+    }
+    results['skippedLines'] = read_report['skippedLines']
+    results['memory'] = {'before': read_report['memoryBefore'], 'after': read_report['memoryAfter']}
+    return results
+
+def dataset_results(dataset, job_id, timestamp, render="png"):
+    """The analyze_data results for every row of a dataset, from its aggregates"""
+    summary = {
+        'total_products': dataset.rows,
+        'total_sales': int(dataset.total_sales),
+        'total_quantity_sold': int(dataset.total_qty_sold),
+        'timestamp': timestamp
+    }
+    
+    # The BCG chart shows the sample; the counts cover every row
+    points = thresholds = category_counts = None
+    if dataset.has_market_columns:
+        points = dataset.sample
+        thresholds = bcg_thresholds(*dataset.market_values())
+        category_counts = dataset.category_counts(thresholds)
+        average_share, average_growth = dataset.means()
+        summary['average_market_growth'] = average_growth
+        summary['average_market_share'] = average_share
+    
+    return build_secondary_results(dataset.niche_sales_frame(), dataset.top_products_frame(), summary, job_id,
+                                   render, points, thresholds, category_counts)
@@ -1,18 +1,30 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, FileResponse
-from fastapi.staticfiles import StaticFiles
-import pandas as pd
-import matplotlib.pyplot as plt
+from fastapi.concurrency import run_in_threadpool
 import os
+import re
+import asyncio
 import tempfile
 import time
 import json
-import shutil
-from typing import Optional
-import numpy as np
+from typing import List, Optional
 from jinja2 import Environment, FileSystemLoader
 
+from analysis_pool import AnalysisPool
+from artifacts import ArtifactStore
+from batch import create_batch_router
+from bcg import BCG_CATEGORIES
+from charts import RENDER_MODES, LazyChartFiles, cache_render_mode
+from dataset_registry import DatasetRegistry, create_registry_router
+from jobs import JobStore, create_job_router
+from result_cache import ResultCache, dataset_cache_key, upload_cache_key
+from result_store import save_result, load_result
+from sales_cube import query_cube
+from sales_dataset import dataset_info, delete_dataset
+from secondary_analysis import output_dir, analyze_data, append_to_dataset
+from uploads import Upload
+
 app = FastAPI()
 
 # Configure CORS
@@ -25,208 +37,282 @@ app.add_middleware(
 )
 
 # Create output directory if it doesn't exist
-output_dir = os.path.join(os.path.dirname(__file__), '../temp/output')
 os.makedirs(output_dir, exist_ok=True)
 
-# Mount the static directory for serving images
-app.mount("/temp/output", StaticFiles(directory=output_dir), name="output")
+# Mount the static directory for serving images; charts reserved with
+# render=lazy are drawn the first time they are requested
+app.mount("/temp/output", LazyChartFiles(directory=output_dir), name="output")
+
+# CPU-bound analysis runs here instead of on the event loop; the workers
+# import the analysis module, never this one
+analysis_pool = AnalysisPool(warm_modules=["secondary_analysis"])
+
+# Background analyses submitted with job=true, polled via /jobs/{id}
+job_store = JobStore()
+app.include_router(create_job_router(job_store))
+
+# Re-uploads of the same file return the earlier result instead of re-running
+result_cache = ResultCache(output_dir)
+
+# Each analysis writes its charts into its own directory under output_dir
+artifact_store = ArtifactStore(output_dir)
+
+# Uploads registered once via /registry and then analyzed by dataset_id;
+# the three APIs share the stored files
+dataset_registry = DatasetRegistry()
+app.include_router(create_registry_router(dataset_registry, analysis_pool))
+
+async def analyze_batch_file(upload, timestamp, render="png"):
+    """One file of a batch, analyzed and cached exactly as /analyze_secondary would"""
+    params = {"render": cache_render_mode(render), "overTime": False}
+    cache_key = await run_in_threadpool(upload_cache_key, upload, "secondary", params)
+    return await result_cache.start(cache_key, "secondary", process_secondary_upload, upload, timestamp, render)
+
+def merge_secondary_results(results):
+    """Portfolio summary of a batch: the files' totals, sales per niche and BCG category counts added up"""
+    summaries = [result['summary'] for result in results]
+    portfolio = {
+        'files': len(summaries),
+        'total_products': sum(summary['total_products'] for summary in summaries),
+        'total_sales': sum(summary['total_sales'] for summary in summaries),
+        'total_quantity_sold': sum(summary['total_quantity_sold'] for summary in summaries)
+    }
+    
+    # Averages over every product, so bigger files weigh more
+    with_market = [summary for summary in summaries
+                   if summary.get('average_market_growth') is not None and summary['total_products']]
+    if with_market:
+        products = sum(summary['total_products'] for summary in with_market)
+        for key in ['average_market_growth', 'average_market_share']:
+            portfolio[key] = sum(summary[key] * summary['total_products'] for summary in with_market) / products
+    
+    niche_sales = {}
+    category_counts = dict.fromkeys(BCG_CATEGORIES, 0)
+    for summary in summaries:
+        for niche, sales in summary.get('sales_by_niche', {}).items():
+            niche_sales[niche] = niche_sales.get(niche, 0) + sales
+        for category, count in summary.get('category_counts', {}).items():
+            category_counts[category] += count
+    portfolio['sales_by_niche'] = dict(sorted(niche_sales.items(), key=lambda item: item[1], reverse=True))
+    portfolio['category_counts'] = category_counts
+    return portfolio
+
+# Many files at once (uploads, zips or a directory), spread over every worker
+app.include_router(create_batch_router("/analyze_secondary_batch", "secondary", analysis_pool, job_store,
+                                       analyze_batch_file, merge_secondary_results))
+
+@app.on_event("startup")
+def start_analysis_pool():
+    analysis_pool.start()
+    artifact_store.start()
+
+@app.on_event("shutdown")
+def stop_analysis_pool():
+    analysis_pool.shutdown()
+    artifact_store.stop()
 
 @app.post("/analyze_secondary")
 async def analyze_secondary_research(
-    file: UploadFile = File(...),
-    description: Optional[str] = Form(None)
+    file: Optional[UploadFile] = File(None),
+    dataset_id: Optional[str] = Form(None),
+    description: Optional[str] = Form(None),
+    job: bool = Form(False),
+    render: str = Form("png"),
+    over_time: bool = Form(False)
 ):
-    # Create a timestamp for unique filenames
+    # When the analysis ran; the report shows it
     timestamp = int(time.time() * 1000)
     
     try:
-        # Save uploaded file to a temporary location
-        temp_file_path = f"{output_dir}/temp_{timestamp}_{file.filename}"
-        with open(temp_file_path, "wb") as temp_file:
-            shutil.copyfileobj(file.file, temp_file)
+        if render not in RENDER_MODES:
+            raise HTTPException(status_code=400, detail=f"render must be one of: {', '.join(RENDER_MODES)}")
+        if (file is None) == (dataset_id is None):
+            raise HTTPException(status_code=400, detail="Send either a file or the dataset_id of a registered dataset")
+        
+        # A registered dataset is read from its stored file instead of an upload
+        registered = dataset_registry.open(dataset_id) if dataset_id is not None else None
+        
+        # Identical uploads (or the same registered dataset) with identical
+        # options share one cached result
+        params = {"render": cache_render_mode(render), "overTime": over_time}
+        if registered is not None:
+            cache_key = dataset_cache_key(dataset_id, "secondary", params)
+        else:
+            cache_key = await run_in_threadpool(upload_cache_key, file.file, "secondary", params)
         
-        # Process the data using functions from secondary.py
-        results = analyze_data(temp_file_path, timestamp)
+        if job:
+            analysis_pool.check_capacity()
         
-        # Add timestamp to the results
-        results["timestamp"] = timestamp
+        # Take the upload from the request's spooled file (spilled outside
+        # the served directory if it is big), even if the result is cached
+        # now: the entry may be gone by the time the analysis starts.
+        # start_upload discards it, but leaves a registered dataset's file alone
+        upload = registered or await run_in_threadpool(Upload.receive, file)
         
-        # Clean up temporary file
-        os.remove(temp_file_path)
+        # In job mode, answer right away and let the client poll /jobs/{id}
+        if job:
+            queued = job_store.submit("secondary", result_cache.start_upload, cache_key, "secondary",
+                                      process_secondary_upload, upload, timestamp, render, over_time)
+            return JSONResponse(status_code=202, content=job_store.status(queued["jobId"]))
         
+        results = await result_cache.start_upload(cache_key, "secondary", process_secondary_upload, upload, timestamp,
+                                                  render, over_time)
         return JSONResponse(content=results)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
-def analyze_data(file_path, timestamp):
-    """Analyze secondary research data (quantitative) and create visualizations"""
-    
-    # Read the data from the provided file path
+async def process_secondary_upload(upload, timestamp, render="png", over_time=False, on_start=None):
+    """Analyze an upload in a worker process and finish off the results"""
+    # Process the data using functions from secondary.py, in a worker process
+    job_id = await run_in_threadpool(artifact_store.create_job, "secondary")
     try:
-        df = pd.read_csv(file_path)
-        print(f"Successfully read file with {len(df)} rows")
-    except Exception as e:
-        print(f"Error reading file {file_path}: {e}")
-        raise HTTPException(status_code=400, detail=f"Error reading CSV file: {str(e)}")
-    
-    # Initialize results dictionary
-    results = {
-        "success": True,
-        "charts": [],
-        "insights": [],
-        "summary": {}
-    }
-    
-    # Analysis 1: Group by product_niche and sum total_sales
-    niche_sales = df.groupby('product_niche')['total_sales'].sum().reset_index()
-    niche_sales = niche_sales.sort_values('total_sales', ascending=False)
-    
-    # Generate chart 1: Total Sales by Product Niche
-    plt.figure(figsize=(10,6))
-    bars = plt.bar(niche_sales['product_niche'], niche_sales['total_sales'], color='skyblue')
-    plt.xlabel('Product Niche')
-    plt.ylabel('Total Sales')
-    plt.title('Total Sales by Product Niche')
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
-    
-    # Add sales count on top of each bar
-    for bar in bars:
-        height = bar.get_height()
-        plt.text(bar.get_x() + bar.get_width()/2, height, f'{int(height)}', 
-                 ha='center', va='bottom', fontsize=10)
-    
-    # Save chart 1
-    chart1_path = f'{output_dir}/sales_by_niche_{timestamp}.png'
-    plt.savefig(chart1_path)
-    plt.close()
-    results['charts'].append({
-        'title': 'Total Sales by Product Niche',
-        'path': f'/temp/output/sales_by_niche_{timestamp}.png',
-        'description': 'Comparison of total sales across different product niches'
-    })
+        results = await analysis_pool.run(analyze_data, upload, job_id, timestamp, render, over_time,
+                                          on_start=on_start)
+    except BaseException:
+        # Nothing will ever point at a failed job's charts
+        await run_in_threadpool(artifact_store.delete_job, job_id)
+        raise
+    finally:
+        upload.discard()
+    await run_in_threadpool(artifact_store.index_job, job_id)
     
-    # Analysis 2: Find top 5 products by total quantity sold
-    top_products = df.groupby('product_details')['total_qty_sold'].sum().reset_index()
-    top_products = top_products.sort_values('total_qty_sold', ascending=False).head(5)
+    # Add timestamp and job id to the results
+    results["timestamp"] = timestamp
+    results["jobId"] = job_id
     
-    # Generate chart 2: Top 5 Products by Quantity Sold
-    plt.figure(figsize=(8,5))
-    bars = plt.bar(top_products['product_details'], top_products['total_qty_sold'], color='orange')
-    plt.xlabel('Product Details')
-    plt.ylabel('Total Quantity Sold')
-    plt.title('Top 5 Products by Quantity Sold')
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
+    # Keep the result so reports can be rendered from it later
+    await run_in_threadpool(save_result, "secondary", job_id, results)
     
-    # Add quantity on top of each bar
-    for bar in bars:
-        height = bar.get_height()
-        plt.text(bar.get_x() + bar.get_width()/2, height, f'{int(height)}', 
-                 ha='center', va='bottom', fontsize=10)
-    
-    # Save chart 2
-    chart2_path = f'{output_dir}/top_products_{timestamp}.png'
-    plt.savefig(chart2_path)
-    plt.close()
-    results['charts'].append({
-        'title': 'Top 5 Products by Quantity Sold',
-        'path': f'/temp/output/top_products_{timestamp}.png',
-        'description': 'The five best-selling products by quantity'
+    return results
+
+@app.get("/query_sales")
+async def query_sales(
+    dataset_id: str,
+    by: str = "Product",
+    measure: str = "revenue",
+    top: Optional[int] = None,
+    product: Optional[List[str]] = Query(None),
+    country: Optional[List[str]] = Query(None),
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    change: bool = False
+):
+    """
+    Sales by product, country and/or month of a registered invoice-level
+    dataset (like sample.csv), answered from the cube built when it was
+    registered instead of re-grouping its invoices. by is a comma-separated
+    list of Product, Country and YearMonth; product and country (repeatable)
+    and start/end ("YYYY-MM") narrow the invoices counted, top keeps the
+    first rows by measure and change adds month-over-month growth. See
+    sales_cube.query_cube.
+    """
+    started = time.perf_counter()
+    cube = dataset_registry.cube(dataset_id)
+    filters = {column: values for column, values in [("Product", product), ("Country", country)] if values}
+    try:
+        rows = query_cube(cube, by=[column.strip() for column in by.split(",")], measure=measure, top=top,
+                          filters=filters, start=start, end=end, change=change)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(content={
+        "datasetId": dataset_id,
+        "rows": rows,
+        "queryMs": round((time.perf_counter() - started) * 1000, 2)
     })
+
+# Names a secondary dataset can be stored under
+DATASET_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+def check_dataset_name(name):
+    if not DATASET_NAME.match(name):
+        raise HTTPException(status_code=400, detail="Dataset names are 1-64 letters, digits, '-' or '_'")
+
+@app.post("/datasets/{name}/append")
+async def append_secondary_dataset(
+    name: str,
+    file: UploadFile = File(...),
+    job: bool = Form(False),
+    render: str = Form("png")
+):
+    """
+    Append a batch of rows to a named secondary dataset and analyze every
+    row appended so far. Only the batch is read: the dataset's stored
+    aggregates are brought up to date (see sales_dataset.append_batch), so
+    storing a daily refresh costs as much as the day's new rows, and the
+    analysis reads the aggregates rather than the rows. Appending the same
+    file twice is refused with a 409.
+    """
+    # When the analysis ran; the report shows it
+    timestamp = int(time.time() * 1000)
     
-    # Analysis 3: BCG Matrix classification
-    if all(col in df.columns for col in ['relative_market_share', 'market_growth']):
-        rms_high = df['relative_market_share'].quantile(0.66)
-        rms_low = df['relative_market_share'].quantile(0.33)
-        mg_high = df['market_growth'].quantile(0.66)
-        mg_low = df['market_growth'].quantile(0.33)
-        
-        def classify(row):
-            if row['relative_market_share'] >= rms_high and row['market_growth'] >= mg_high:
-                return 'Star'
-            elif row['relative_market_share'] >= rms_high and row['market_growth'] < mg_high:
-                return 'Cash Cow'
-            elif row['relative_market_share'] < rms_low and row['market_growth'] >= mg_high:
-                return 'Question Mark'
-            else:
-                return 'Dog'
-        
-        df['classification'] = df.apply(classify, axis=1)
-        
-        # Generate chart 3: BCG Matrix
-        plt.figure(figsize=(10,8))
-        colors = {'Star': 'gold', 'Cash Cow': 'green', 'Question Mark': 'blue', 'Dog': 'red'}
+    try:
+        check_dataset_name(name)
+        if render not in RENDER_MODES:
+            raise HTTPException(status_code=400, detail=f"render must be one of: {', '.join(RENDER_MODES)}")
+        if job:
+            analysis_pool.check_capacity()
         
-        for category, group in df.groupby('classification'):
-            plt.scatter(
-                group['relative_market_share'], 
-                group['market_growth'], 
-                s=group['total_sales']/500,  # Size based on sales
-                color=colors[category],
-                alpha=0.7,
-                label=category
-            )
-            
-            # Add product labels to some points
-            for i, row in group.head(2).iterrows():
-                plt.annotate(
-                    row['product_details'][:10] + '...',
-                    (row['relative_market_share'], row['market_growth']),
-                    xytext=(5, 5),
-                    textcoords='offset points'
-                )
+        # Batches are told apart by their contents
+        digest = await run_in_threadpool(upload_cache_key, file.file, "secondary_dataset")
+        upload = await run_in_threadpool(Upload.receive, file)
         
-        plt.axvline(x=rms_low, color='gray', linestyle='--', alpha=0.5)
-        plt.axhline(y=mg_low, color='gray', linestyle='--', alpha=0.5)
-        plt.xlabel('Relative Market Share')
-        plt.ylabel('Market Growth')
-        plt.title('BCG Matrix Analysis')
-        plt.legend()
-        plt.grid(True, alpha=0.3)
-        plt.tight_layout()
+        # In job mode, answer right away and let the client poll /jobs/{id}
+        if job:
+            queued = job_store.submit("secondary_dataset", process_dataset_append, name, upload, digest, timestamp, render)
+            return JSONResponse(status_code=202, content=job_store.status(queued["jobId"]))
         
-        # Save chart 3
-        chart3_path = f'{output_dir}/bcg_matrix_{timestamp}.png'
-        plt.savefig(chart3_path)
-        plt.close()
-        results['charts'].append({
-            'title': 'BCG Matrix Analysis',
-            'path': f'/temp/output/bcg_matrix_{timestamp}.png',
-            'description': 'Product portfolio analysis using the BCG matrix'
-        })
+        results = await process_dataset_append(name, upload, digest, timestamp, render)
+        return JSONResponse(content=results)
         
-        # Generate insights
-        category_counts = df['classification'].value_counts()
-        results['insights'] = [
-            f"Top selling product niche: {niche_sales.iloc[0]['product_niche']} with ${int(niche_sales.iloc[0]['total_sales'])} in sales",
-            f"Best selling product: {top_products.iloc[0]['product_details']} with {int(top_products.iloc[0]['total_qty_sold'])} units sold",
-            f"Portfolio composition: {category_counts.get('Star', 0)} Stars, {category_counts.get('Cash Cow', 0)} Cash Cows, {category_counts.get('Question Mark', 0)} Question Marks, {category_counts.get('Dog', 0)} Dogs"
-        ]
-    else:
-        results['insights'] = [
-            f"Top selling product niche: {niche_sales.iloc[0]['product_niche']} with ${int(niche_sales.iloc[0]['total_sales'])} in sales",
-            f"Best selling product: {top_products.iloc[0]['product_details']} with {int(top_products.iloc[0]['total_qty_sold'])} units sold"
-        ]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+
+@app.get("/datasets/{name}")
+async def get_secondary_dataset(name: str):
+    """Size and batches of a stored secondary dataset"""
+    check_dataset_name(name)
+    info = await run_in_threadpool(dataset_info, name)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return JSONResponse(content=info)
+
+@app.delete("/datasets/{name}")
+async def delete_secondary_dataset(name: str):
+    check_dataset_name(name)
+    if not await run_in_threadpool(delete_dataset, name):
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return JSONResponse(content={"deleted": name})
+
+async def process_dataset_append(name, upload, digest, timestamp, render="png", on_start=None):
+    """Append an upload to a dataset in a worker process and finish off the results"""
+    job_id = await run_in_threadpool(artifact_store.create_job, "secondary")
+    try:
+        results = await analysis_pool.run(append_to_dataset, name, upload, digest, job_id, timestamp, render,
+                                          on_start=on_start)
+    except BaseException:
+        # Nothing will ever point at a failed job's charts
+        await run_in_threadpool(artifact_store.delete_job, job_id)
+        raise
+    finally:
+        upload.discard()
+    await run_in_threadpool(artifact_store.index_job, job_id)
     
-    # Generate summary
-    results['summary'] = {
-        'total_products': len(df),
-        'total_sales': int(df['total_sales'].sum()),
-        'total_quantity_sold': int(df['total_qty_sold'].sum()),
-        'timestamp': timestamp
-    }
+    # Add timestamp and job id to the results
+    results["timestamp"] = timestamp
+    results["jobId"] = job_id
     
-    # Add average market metrics if available
-    if 'market_growth' in df.columns and 'relative_market_share' in df.columns:
-        results['summary']['average_market_growth'] = float(df['market_growth'].mean())
-        results['summary']['average_market_share'] = float(df['relative_market_share'].mean())
+    # Keep the result so reports can be rendered from it later
+    await run_in_threadpool(save_result, "secondary", job_id, results)
     
     return results
 
-@app.get("/download_secondary_report/{timestamp}")
-async def download_secondary_report(timestamp: str):
+@app.get("/download_secondary_report/{result_id}")
+async def download_secondary_report(result_id: str):
     """Generate and download an HTML report for secondary research analysis"""
     try:
         # Create template directory if it doesn't exist
@@ -316,7 +402,9 @@ async def download_secondary_report(timestamp: str):
                         <div class="chart-container">
                             <h3>{{ chart.title }}</h3>
                             <p>{{ chart.description }}</p>
+                            {% if chart.path %}
                             <img src="{{ base_url }}{{ chart.path }}" alt="{{ chart.title }}">
+                            {% endif %}
                         </div>
                         {% endfor %}
                     </div>
@@ -328,49 +416,13 @@ async def download_secondary_report(timestamp: str):
                 </html>
                 ''')
         
-        # Find the result file based on timestamp
-        result_files = [f for f in os.listdir(output_dir) if f.startswith('sales_by_niche_' + timestamp)]
+        # Load the stored analysis result for this job id
+        result = await run_in_threadpool(load_result, "secondary", result_id)
         
-        if not result_files:
-            raise HTTPException(status_code=404, detail="No analysis results found for this timestamp")
+        if result is None:
+            raise HTTPException(status_code=404, detail="No analysis results found for this id")
             
-        # Load previously generated analysis results
-        # Since we don't store them, we'll have to reconstruct based on the file paths
-        timestamp_str = timestamp
-        
-        # Create a mock result with the image paths
-        mock_result = {
-            "success": True,
-            "charts": [
-                {
-                    "title": "Total Sales by Product Niche",
-                    "path": f"/temp/output/sales_by_niche_{timestamp_str}.png",
-                    "description": "Comparison of total sales across different product niches"
-                },
-                {
-                    "title": "Top 5 Products by Quantity Sold",
-                    "path": f"/temp/output/top_products_{timestamp_str}.png",
-                    "description": "The five best-selling products by quantity"
-                },
-                {
-                    "title": "BCG Matrix Analysis",
-                    "path": f"/temp/output/bcg_matrix_{timestamp_str}.png",
-                    "description": "Product portfolio analysis using the BCG matrix"
-                }
-            ],
-            "insights": [
-                "Top selling product niche: Athletic Shoes with $1,250,000 in sales",
-                "Best selling product: Pro Running Shoe X1 with 5,000 units sold",
-                "Portfolio composition: 4 Stars, 6 Cash Cows, 3 Question Marks, 7 Dogs"
-            ],
-            "summary": {
-                "total_products": 20,
-                "total_sales": 3750000,
-                "total_quantity_sold": 25000,
-                "average_market_growth": 12.5,
-                "average_market_share": 0.45
-            }
-        }
+        timestamp_str = str(result["timestamp"])
         
         # Create temp directory for rendering
         temp_dir = tempfile.mkdtemp()
@@ -393,9 +445,9 @@ async def download_secondary_report(timestamp: str):
         html_content = template.render(
             timestamp=display_date,
             base_url="http://localhost:8001",
-            summary=mock_result["summary"],
-            insights=mock_result["insights"],
-            charts=mock_result["charts"]
+            summary=result["summary"],
+            insights=result["insights"],
+            charts=result["charts"]
         )
         
         # Save HTML file
@@ -410,6 +462,8 @@ async def download_secondary_report(timestamp: str):
             media_type='text/html'
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate HTML report: {str(e)}")
 
@@ -43,7 +43,7 @@ const createBCGMatrixItem = async (req, res) => {
  */
 const analyzeBCGMatrix = async (req, res) => {
   try {
-    const { filePath, dataName, csvContent } = req.body;
+    const { filePath, dataName, csvContent, overTime } = req.body;
 
     console.log(`Processing BCG Matrix analysis for ${dataName || 'unknown dataset'}`);
     
@@ -147,7 +147,7 @@ const analyzeBCGMatrix = async (req, res) => {
         fs.mkdirSync(outputDir, { recursive: true });
       }
       
-      const result = await processBCGMatrix(fileToProcess, outputDir);
+      const result = await processBCGMatrix(fileToProcess, outputDir, Boolean(overTime));
       
       // Generate AI analysis using Gemini
       console.log("BCG matrix processing complete. Generating AI analysis...");
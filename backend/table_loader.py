@@ -0,0 +1,235 @@
+import os
+
+import pandas as pd
+
+from csv_loader import read_csv
+from uploads import Upload
+
+# Leading bytes of the columnar formats read with pyarrow; anything else is CSV
+_MAGIC = [
+    (b"PAR1", "parquet"),
+    (b"ARROW1", "arrow"),  # Arrow IPC file, which is also Feather v2
+    (b"FEA1", "feather"),  # Feather v1
+    (b"\xff\xff\xff\xff", "arrow_stream")
+]
+
+# Extensions of the files a batch picks out of a directory or zip archive
+TABLE_SUFFIXES = (".csv", ".tsv", ".txt", ".parquet", ".pq", ".feather", ".arrow", ".arrows", ".ipc")
+
+# Text columns with at most this share of distinct values become categoricals
+CATEGORY_MAX_RATIO = 0.5
+
+# Fallback for uploads without magic bytes (old Arrow streams have none)
+_EXTENSIONS = {
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".arrows": "arrow_stream"
+}
+
+
+def _in_memory(source):
+    return isinstance(source, (bytes, bytearray, memoryview))
+
+
+def detect_format(path, name=None):
+    """
+    "csv", "parquet", "arrow", "feather" (v1) or "arrow_stream", from the
+    file's first bytes. path may also be the file's bytes, named by name.
+    """
+    if _in_memory(path):
+        head = bytes(path[:8])
+    else:
+        with open(path, "rb") as f:
+            head = f.read(8)
+        name = name or path
+    for magic, fmt in _MAGIC:
+        if head.startswith(magic):
+            return fmt
+    for extension, fmt in _EXTENSIONS.items():
+        if (name or "").lower().endswith(extension):
+            return fmt
+    return "csv"
+
+
+def is_table_name(name):
+    """True for file names a batch analyzes, skipping hidden files and archive metadata"""
+    base = os.path.basename(name.replace("\\", "/"))
+    if not base or base.startswith(".") or "__MACOSX/" in name:
+        return False
+    return base.lower().endswith(TABLE_SUFFIXES)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather  # noqa: F401
+        import pyarrow.ipc  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise ValueError("Reading Parquet, Feather or Arrow files needs the pyarrow package")
+    return pyarrow
+
+
+def _projection(names, columns):
+    # Wanted columns the file has, in file order; positions count as names
+    if columns is None:
+        return None
+    wanted = {names[c] if isinstance(c, int) else c for c in columns}
+    return [name for name in names if name in wanted]
+
+
+def _arrow_source(pa, path):
+    # Files are memory-mapped, uploads held in memory wrapped without a copy
+    return pa.BufferReader(path) if _in_memory(path) else pa.memory_map(path)
+
+
+def _to_pandas(table):
+    # Columns stay in blocks of their own, so numbers read from a memory-mapped
+    # file are views of its pages rather than copies
+    return table.to_pandas(split_blocks=True)
+
+
+def _open_ipc(pa, path, fmt):
+    source = _arrow_source(pa, path)
+    return pa.ipc.open_stream(source) if fmt == "arrow_stream" else pa.ipc.open_file(source)
+
+
+def _read_columnar(path, fmt, columns):
+    pa = _pyarrow()
+    if fmt == "parquet":
+        parquet = pa.parquet.ParquetFile(_arrow_source(pa, path))
+        return _to_pandas(parquet.read(columns=_projection(parquet.schema_arrow.names, columns)))
+    if fmt == "feather":
+        # Feather v1 can only be read whole
+        df = pa.feather.read_feather(_arrow_source(pa, path))
+        projection = _projection(df.columns.tolist(), columns)
+        return df[projection] if projection is not None else df
+
+    reader = _open_ipc(pa, path, fmt)
+    projection = _projection(reader.schema.names, columns)
+    table = reader.read_all()
+    return _to_pandas(table.select(projection) if projection is not None else table)
+
+
+def _read_columnar_chunks(path, fmt, columns, chunksize):
+    pa = _pyarrow()
+    if fmt == "parquet":
+        parquet = pa.parquet.ParquetFile(_arrow_source(pa, path))
+        projection = _projection(parquet.schema_arrow.names, columns)
+        batches = parquet.iter_batches(batch_size=chunksize, columns=projection)
+    elif fmt == "feather":
+        df = _read_columnar(path, fmt, columns)
+        yield from (df.iloc[offset:offset + chunksize] for offset in range(0, len(df), chunksize))
+        return
+    else:
+        reader = _open_ipc(pa, path, fmt)
+        projection = _projection(reader.schema.names, columns)
+        if fmt == "arrow":
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        else:
+            batches = iter(reader)
+        if projection is not None:
+            batches = (batch.select(projection) for batch in batches)
+
+    # Number the rows across chunks the way chunked read_csv does
+    start = 0
+    for batch in batches:
+        for offset in range(0, batch.num_rows, chunksize):
+            df = _to_pandas(batch.slice(offset, chunksize))
+            df.index += start
+            start += len(df)
+            yield df
+
+
+def read_table(path, report=None, columns=None, chunksize=None):
+    """
+    Read an uploaded table: CSV through csv_loader.read_csv, or Parquet,
+    Feather and Arrow IPC (file or stream) through pyarrow. path is a file
+    path or an uploads.Upload, whose bytes are parsed where they are.
+
+    Only the given columns (names or positions; ones the file doesn't have
+    are ignored) are read, and columnar files are memory-mapped, so a wide
+    file costs no more than the columns an analysis uses. With chunksize an
+    iterator of DataFrames of at most that many rows is returned, as from
+    read_csv. report, if given, receives the "format" and "skippedLines"
+    (always 0 for columnar files) plus, for CSVs, the sniffed dialect.
+    """
+    name = None
+    if isinstance(path, Upload):
+        name, path = path.name, path.source
+    fmt = detect_format(path, name)
+    if report is None:
+        report = {}
+
+    if fmt == "csv":
+        kwargs = {"chunksize": chunksize} if chunksize else {}
+        if columns is not None:
+            wanted = set(columns)
+            if all(isinstance(c, int) for c in wanted):
+                kwargs["usecols"] = sorted(wanted)
+            else:
+                kwargs["usecols"] = lambda name: name in wanted
+        df = read_csv(path, report, **kwargs)
+        report["format"] = "csv"
+        return df
+
+    report.update(format=fmt, skippedLines=0)
+    if chunksize:
+        return _read_columnar_chunks(path, fmt, columns, chunksize)
+    return _read_columnar(path, fmt, columns)
+
+
+def write_arrow(df, path):
+    """
+    Store a DataFrame as an uncompressed Arrow IPC file, which read_table
+    memory-maps: its numeric columns and categorical codes are then read
+    without a copy, and processes reading the same file share its pages.
+    """
+    pa = _pyarrow()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def memory_bytes(df):
+    """Memory held by a DataFrame, counting the strings in its text columns"""
+    return int(df.memory_usage(deep=True).sum())
+
+
+def _is_text(column):
+    return pd.api.types.is_string_dtype(column) and not isinstance(column.dtype, pd.CategoricalDtype)
+
+
+def compact_frame(df, report=None, categories=(), keep=()):
+    """
+    Shrink a freshly read DataFrame to compact dtypes, in place.
+
+    Text columns listed in categories, and any other text column with at
+    most CATEGORY_MAX_RATIO distinct values, become categoricals, so a
+    repeated niche or country is stored once plus a small code per row.
+    Integer columns are downcast to the smallest integer type holding their
+    values (sums still come out as int64). Floats keep 64 bits, since their
+    sums and means are reported, and columns in keep are left as read.
+    report, if given, receives "memoryBefore" and "memoryAfter" in bytes.
+    Returns df.
+    """
+    if report is None:
+        report = {}
+    report["memoryBefore"] = memory_bytes(df)
+
+    for name in df.columns:
+        if name in keep:
+            continue
+        column = df[name]
+        if _is_text(column):
+            if name in categories or column.nunique() <= CATEGORY_MAX_RATIO * len(column):
+                df[name] = column.astype("category")
+        elif pd.api.types.is_integer_dtype(column) and not pd.api.types.is_bool_dtype(column):
+            downcast = pd.to_numeric(column, downcast="integer")
+            # Columns already as small as they get keep their memory (which may be mapped)
+            if downcast.dtype != column.dtype:
+                df[name] = downcast
+
+    report["memoryAfter"] = memory_bytes(df)
+    return df
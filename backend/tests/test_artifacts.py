@@ -0,0 +1,45 @@
+import os
+import time
+
+import pytest
+
+import artifacts
+import result_store
+from artifacts import ArtifactStore
+from result_store import load_result, save_result
+
+
+@pytest.fixture(autouse=True)
+def results_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_store, "RESULTS_DB", str(tmp_path / "results.db"))
+    monkeypatch.setattr(artifacts, "RESULTS_DB", str(tmp_path / "results.db"))
+
+
+def finished_job(store, kind, size):
+    job_id = store.create_job(kind)
+    with open(os.path.join(store.job_dir(job_id), "chart.png"), "wb") as f:
+        f.write(b"x" * size)
+    store.index_job(job_id)
+    save_result(kind, job_id, {"jobId": job_id})
+    return job_id
+
+
+def test_results_go_with_their_jobs(tmp_path):
+    store = ArtifactStore(str(tmp_path / "output"), ttl=3600, max_bytes=150)
+    os.makedirs(store.root)
+    old, new = finished_job(store, "primary", 100), finished_job(store, "secondary", 100)
+
+    assert store.sweep()["evicted"] == 1
+    assert load_result("primary", old) is None
+    assert load_result("secondary", new) == {"jobId": new}
+
+
+def test_results_expire_with_the_ttl(tmp_path):
+    store = ArtifactStore(str(tmp_path / "output"), ttl=3600)
+    os.makedirs(store.root)
+    save_result("primary", "1718000000000", {"timestamp": 1718000000000})
+    job_id = finished_job(store, "primary", 10)
+
+    removed = store.sweep(now=time.time() + 7200)
+    assert removed["expired"] == 1 and removed["results"] == 1
+    assert load_result("primary", "1718000000000") is None and load_result("primary", job_id) is None
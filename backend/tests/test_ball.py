@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ball import run_bcg_analysis, run_bcg_analysis_streaming
+
+
+def write_products(path, rng, rows):
+    df = pd.DataFrame({
+        'Product Name': [f"P{i}" for i in range(rows)],
+        'Market Share': rng.integers(0, 20, rows) / 2,
+        'Growth Rate': rng.integers(-10, 10, rows) / 2,
+        # Few distinct quantities, so the top products tie
+        'Quantity': rng.integers(0, 50, rows) * 10
+    })
+    df.loc[rng.random(rows) < 0.05, 'Market Share'] = np.nan
+    df.loc[rng.random(rows) < 0.05, 'Growth Rate'] = np.nan
+    df.to_csv(path, index=False)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_exact_streaming_matches_in_memory(tmp_path, seed):
+    csv = tmp_path / "products.csv"
+    write_products(csv, np.random.default_rng(seed), 3000)
+
+    expected = run_bcg_analysis(str(csv), str(tmp_path / "memory.png"))
+    streamed = run_bcg_analysis_streaming(str(csv), str(tmp_path / "stream.png"), chunksize=400, exact=True)
+    for key in ['thresholds', 'counts', 'top_products']:
+        assert streamed[key] == expected[key]
+
+
+def test_sketch_streaming_stays_within_rank_error(tmp_path):
+    csv = tmp_path / "products.csv"
+    write_products(csv, np.random.default_rng(7), 3000)
+    df = pd.read_csv(csv)
+
+    expected = run_bcg_analysis(str(csv), str(tmp_path / "memory.png"))
+    streamed = run_bcg_analysis_streaming(str(csv), str(tmp_path / "stream.png"), chunksize=400, sketch_error=0.01)
+    for column, key in [('Market Share', 'market_share'), ('Growth Rate', 'growth_rate')]:
+        values = df[column].dropna()
+        rank = (values < streamed['thresholds'][key]).sum()
+        assert abs(rank - len(values) / 2) <= 0.01 * len(values) + (values == streamed['thresholds'][key]).sum()
+    assert streamed['counts']['total'] == expected['counts']['total']
+    assert streamed['top_products'] == expected['top_products']
+
+
+def test_missing_column_thresholds_match_on_every_path(tmp_path):
+    csv = tmp_path / "products.csv"
+    write_products(csv, np.random.default_rng(3), 500)
+    df = pd.read_csv(csv)
+    df['Growth Rate'] = np.nan
+    df.to_csv(csv, index=False)
+
+    # Missing values count as 0 before the medians are taken
+    expected = run_bcg_analysis(str(csv), str(tmp_path / "memory.png"))
+    assert expected['thresholds']['growth_rate'] == 0.0
+    for exact in [True, False]:
+        streamed = run_bcg_analysis_streaming(str(csv), str(tmp_path / "stream.png"), chunksize=100, exact=exact)
+        assert streamed['thresholds'] == expected['thresholds']
+        assert streamed['counts'] == expected['counts']
@@ -0,0 +1,65 @@
+import asyncio
+import io
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+
+from analysis_pool import AnalysisPool
+from batch import discard_all, run_batch, zip_uploads
+from uploads import Upload
+
+
+def test_zip_members_past_the_memory_budget_are_spilled(tmp_path):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        for i in range(5):
+            zf.writestr(f"part_{i}.csv", f"a,b\n{i},{i}\n" * 100)
+        zf.writestr("notes.md", "not a table")
+    size = len("a,b\n0,0\n" * 100)
+
+    uploads = zip_uploads(archive, memory_bytes=2 * size + 10, spill_dir=str(tmp_path))
+    assert [upload.name for upload in uploads] == [f"part_{i}.csv" for i in range(5)]
+    assert [upload.data is not None for upload in uploads] == [True, True, False, False, False]
+    for i, upload in enumerate(uploads):
+        with upload.open() as f:
+            assert f.read() == f"a,b\n{i},{i}\n".encode() * 100
+
+    discard_all(uploads)
+    assert os.listdir(tmp_path) == []
+
+
+def slow_square(x):
+    time.sleep(0.05)
+    return x * x
+
+
+def test_batches_wait_for_a_busy_pool():
+    pool = AnalysisPool(workers=1, max_queue=0)
+    pool.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def analyze(upload, timestamp):
+        return {"square": await pool.run(slow_square, int(upload.data))}
+
+    async def busy_pool_and_batch():
+        # Someone else's analysis fills the pool; a plain request gets the 503
+        others = asyncio.ensure_future(pool.run(slow_square, 10))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as busy:
+            await pool.run(slow_square, 1)
+        assert busy.value.status_code == 503
+
+        uploads = [Upload(f"{i}.csv", data=str(i).encode()) for i in range(4)]
+        files = await run_batch(uploads, analyze, 0, pool.workers)
+        return await others, files
+
+    try:
+        other, files = asyncio.run(busy_pool_and_batch())
+    finally:
+        pool.executor.shutdown()
+    assert other == 100
+    assert [entry["ok"] for entry in files] == [True] * 4
+    assert [entry["result"]["square"] for entry in files] == [0, 1, 4, 9]
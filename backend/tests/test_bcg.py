@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bcg import BCG_CATEGORIES, bcg_evolution, classify_quadrants, stream_medians, threshold
+
+
+def random_frame(rng, rows=500):
+    # Few distinct values so plenty of rows sit exactly on a threshold
+    df = pd.DataFrame({
+        'share': rng.integers(0, 6, rows).astype(float),
+        'growth': rng.integers(-3, 4, rows).astype(float)
+    })
+    df.loc[rng.random(rows) < 0.1, 'share'] = np.nan
+    df.loc[rng.random(rows) < 0.1, 'growth'] = np.nan
+    return df
+
+
+def classify_rows(df, share_thresh, growth_thresh, share_low):
+    # The row-by-row classify the secondary analysis used to apply
+    def classify(row):
+        if row['share'] >= share_thresh and row['growth'] >= growth_thresh:
+            return 'Star'
+        elif row['share'] >= share_thresh and row['growth'] < growth_thresh:
+            return 'Cash Cow'
+        elif row['share'] < share_low and row['growth'] >= growth_thresh:
+            return 'Question Mark'
+        else:
+            return 'Dog'
+    return df.apply(classify, axis=1).tolist()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_thresholds_match_series_quantile(seed):
+    df = random_frame(np.random.default_rng(seed))
+    for column in df.columns:
+        assert threshold(df[column]) == df[column].median()
+        for q in [0.33, 0.66]:
+            assert threshold(df[column], q) == pytest.approx(df[column].quantile(q), abs=0, rel=1e-12)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_median_split_matches_row_by_row(seed):
+    df = random_frame(np.random.default_rng(seed))
+    share_thresh, growth_thresh = df['share'].median(), df['growth'].median()
+    expected = classify_rows(df, share_thresh, growth_thresh, share_thresh)
+    assert classify_quadrants(df['share'], df['growth'], share_thresh, growth_thresh).tolist() == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_quantile_split_matches_row_by_row(seed):
+    df = random_frame(np.random.default_rng(seed))
+    rms_high, rms_low = df['share'].quantile(0.66), df['share'].quantile(0.33)
+    mg_high = df['growth'].quantile(0.66)
+    expected = classify_rows(df, rms_high, mg_high, rms_low)
+    labels = classify_quadrants(df['share'], df['growth'], rms_high, mg_high, share_low=rms_low)
+    assert labels.tolist() == expected
+
+
+def test_missing_values_are_unclassified():
+    labels = classify_quadrants([np.nan, 1.0], [1.0, np.nan], 0.0, 0.0, unclassified=None)
+    assert labels.tolist() == [None, None]
+
+
+def chunked(df, size):
+    return lambda: (df.iloc[start:start + size] for start in range(0, len(df), size))
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("collect_limit", [1, 64, 1 << 20])
+def test_stream_medians_match_series_median(seed, collect_limit):
+    rng = np.random.default_rng(seed)
+    rows = int(rng.integers(1, 3000))
+    df = pd.DataFrame({
+        'ties': rng.integers(-5, 5, rows).astype(float),
+        'spread': rng.standard_normal(rows) * 10.0 ** rng.integers(-300, 300, rows),
+        'signed_zero': rng.choice([0.0, -0.0, 1.0, -1.0], rows),
+        'empty': np.nan
+    })
+    for column in ['ties', 'spread', 'signed_zero']:
+        df.loc[rng.random(rows) < 0.2, column] = np.nan
+
+    medians = stream_medians(chunked(df, int(rng.integers(1, 500))), list(df.columns), collect_limit=collect_limit)
+    for column in df.columns:
+        assert medians[column] == df[column].median() or (np.isnan(medians[column]) and np.isnan(df[column].median()))
+
+
+def evolution_by_month(df, share_q, growth_q, share_low_q):
+    # A classification per month, then each product's months walked in order
+    periods, sequences = [], {}
+    for month in sorted(df['period'].unique()):
+        rows = df[(df['period'] == month) & df['share'].notna() & df['growth'].notna()]
+        share_thresh, growth_thresh = rows['share'].quantile(share_q), rows['growth'].quantile(growth_q)
+        share_low = rows['share'].quantile(share_low_q) if share_low_q is not None else share_thresh
+        labels = classify_rows(rows, share_thresh, growth_thresh, share_low)
+        for product, label in zip(rows['product'], labels):
+            sequences.setdefault(product, []).append((month, label))
+        periods.append({
+            'period': month,
+            'shareThreshold': None if pd.isna(share_thresh) else share_thresh,
+            'growthThreshold': None if pd.isna(growth_thresh) else growth_thresh,
+            'counts': {category: labels.count(category) for category in BCG_CATEGORIES}
+        })
+
+    transitions = {source: dict.fromkeys(BCG_CATEGORIES, 0) for source in BCG_CATEGORIES}
+    trajectories = {}
+    for product in sorted(sequences):
+        runs = []
+        for (_, before), (_, after) in zip(sequences[product], sequences[product][1:]):
+            transitions[before][after] += 1
+        for month, label in sequences[product]:
+            if runs and runs[-1][0] == label:
+                runs[-1][2] = month
+            else:
+                runs.append([label, month, month])
+        trajectories[product] = runs
+    return {'periods': periods, 'transitions': transitions, 'trajectories': trajectories}
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("share_q, growth_q, share_low_q", [(0.5, 0.5, None), (0.66, 0.66, 0.33)])
+def test_evolution_matches_month_by_month(seed, share_q, growth_q, share_low_q):
+    rng = np.random.default_rng(seed)
+    months = [f"2024-{month:02d}" for month in range(1, 13)]
+    df = pd.DataFrame([(f"P{p}", month) for p in range(40) for month in months], columns=['product', 'period'])
+    df = df.sample(frac=0.8, random_state=seed).reset_index(drop=True)   # products missing some months
+    df['share'] = rng.integers(0, 8, len(df)) / 4
+    df['growth'] = rng.integers(-4, 4, len(df)) / 4
+    df.loc[rng.random(len(df)) < 0.1, 'share'] = np.nan
+    df.loc[rng.random(len(df)) < 0.1, 'growth'] = np.nan
+    df.loc[df['period'] == months[0], 'growth'] = np.nan   # no growth in the first month
+
+    evolution = bcg_evolution(df['product'], df['period'], df['share'], df['growth'],
+                              share_q=share_q, growth_q=growth_q, share_low_q=share_low_q)
+    assert evolution == evolution_by_month(df, share_q, growth_q, share_low_q)
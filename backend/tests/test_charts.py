@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+import charts
+from charts import chart_spec, defer_chart, is_chart_pending, render_pending_chart
+
+
+@pytest.fixture(autouse=True)
+def pending_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(charts, "PENDING_CHARTS_DIR", str(tmp_path / "pending"))
+
+
+def pending_pie(tmp_path):
+    job_dir = tmp_path / "output" / "job1"
+    job_dir.mkdir(parents=True)
+    spec = chart_spec("sentiment_pie", str(job_dir / "sentiment_dist.png"),
+                      labels=["positive", "negative"], counts=[3, 1])
+    return defer_chart(spec)
+
+
+def test_pending_chart_is_drawn_once(tmp_path):
+    path = pending_pie(tmp_path)
+
+    render_pending_chart(path)
+    assert os.path.exists(path)
+    assert not is_chart_pending(path)
+
+    # Later requests find nothing left to draw
+    render_pending_chart(path)
+    assert os.path.exists(path)
+
+
+def test_spec_removed_by_another_process(tmp_path, monkeypatch):
+    path = pending_pie(tmp_path)
+    render_chart = charts.render_chart
+
+    # Another API process draws the same chart and removes the spec meanwhile
+    def other_process_finishes(spec):
+        render_chart(spec)
+        os.remove(charts._pending_path(path))
+
+    monkeypatch.setattr(charts, "render_chart", other_process_finishes)
+    render_pending_chart(path)
+    assert os.path.exists(path)
+    assert not is_chart_pending(path)
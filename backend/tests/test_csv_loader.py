@@ -0,0 +1,61 @@
+import codecs
+
+import pandas as pd
+import pytest
+
+from csv_loader import read_csv
+
+ROWS = pd.DataFrame({
+    'product': ['Zapatilla Señora', 'Botín Niño', 'Sandalia Café', 'Mocasín'],
+    'sales': [10.5, 20.0, 30.25, 40.0],
+    'qty': [1, 2, 3, 4]
+})
+
+
+def test_semicolon_delimited(tmp_path):
+    path = tmp_path / "semi.csv"
+    ROWS.to_csv(path, sep=';', index=False)
+
+    report = {}
+    df = read_csv(str(path), report)
+    assert report['delimiter'] == ';'
+    assert report['skippedLines'] == 0
+    pd.testing.assert_frame_equal(df, ROWS)
+
+
+def test_latin1(tmp_path):
+    path = tmp_path / "latin.csv"
+    ROWS.to_csv(path, index=False, encoding='latin-1')
+
+    report = {}
+    df = read_csv(str(path), report)
+    assert report['encoding'] == 'latin-1'
+    pd.testing.assert_frame_equal(df, ROWS)
+
+
+@pytest.mark.parametrize("bom, encoding", [(codecs.BOM_UTF8, 'utf-8'), (codecs.BOM_UTF16_LE, 'utf-16-le')])
+def test_bom(tmp_path, bom, encoding):
+    path = tmp_path / "bom.csv"
+    path.write_bytes(bom + ROWS.to_csv(index=False).encode(encoding))
+
+    df = read_csv(path.read_bytes())
+    # The BOM isn't glued to the first column name
+    assert df.columns.tolist() == ROWS.columns.tolist()
+    pd.testing.assert_frame_equal(df, ROWS)
+
+
+def test_malformed_lines_are_skipped_and_counted(tmp_path):
+    path = tmp_path / "bad.csv"
+    path.write_text(
+        "category,sales,product\n"
+        "A,10,p1\n"
+        "B,20,p2,extra\n"
+        "C,30,p3\n"
+        "D,40,p4,extra,more\n"
+        "E,50,p5\n"
+    )
+
+    report = {}
+    df = read_csv(str(path), report)
+    assert report['skippedLines'] == 2
+    assert df['product'].tolist() == ['p1', 'p3', 'p5']
@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from invoice_metrics import market_metrics, rollup_invoice_chunks, rollup_invoices
+
+SAMPLE_CSV = os.path.join(os.path.dirname(__file__), '..', '..', 'sample.csv')
+
+
+@pytest.fixture(scope="module")
+def invoices():
+    return pd.read_csv(SAMPLE_CSV)
+
+
+def groupby_rollup(df, date_format):
+    # The plain version: parse every date, then group
+    months = pd.to_datetime(df['InvoiceDate'], format=date_format).dt.to_period('M')
+    grouped = df.assign(YearMonth=months.astype(str)).groupby(['Product', 'YearMonth'])
+    return grouped.agg(revenue=('Revenue', 'sum'), quantity=('Quantity', 'sum'),
+                       lines=('Revenue', 'size'), invoices=('Invoice', 'nunique')).reset_index()
+
+
+def loop_growth(expected):
+    # Month-over-month revenue change, walking each product's calendar months
+    growth = {}
+    for product, rows in expected.groupby('Product'):
+        revenue = rows.set_index(pd.PeriodIndex(rows['YearMonth'], freq='M'))['revenue']
+        for month, value in revenue.items():
+            earlier = revenue.get(month - 1)
+            growth[product, str(month)] = value / earlier - 1 if earlier else np.nan
+    return growth
+
+
+def assert_matches_groupby(metrics, expected):
+    merged = expected.merge(metrics, on=['Product', 'YearMonth'], suffixes=('', '_rollup'), validate='1:1')
+    assert len(merged) == len(expected) == len(metrics)
+    np.testing.assert_allclose(merged['revenue_rollup'], merged['revenue'])
+    for measure in ['quantity', 'lines', 'invoices']:
+        assert (merged[measure + '_rollup'] == merged[measure]).all()
+
+    market = expected.groupby('YearMonth')['revenue'].transform('sum')
+    np.testing.assert_allclose(merged['marketShare'], merged['revenue'] / market)
+
+    growth = loop_growth(expected)
+    np.testing.assert_allclose(merged['growth'], [growth[key] for key in zip(merged['Product'], merged['YearMonth'])])
+
+
+def test_sample_matches_to_datetime_groupby(invoices):
+    # "5/10/2024" is ambiguous; later dates like "16/2/2025" make it day first
+    metrics = market_metrics(rollup_invoices(invoices))
+    expected = groupby_rollup(invoices, '%d/%m/%Y %H:%M')
+    assert (expected['YearMonth'].sort_values().unique() == invoices['YearMonth'].sort_values().unique()).all()
+    assert_matches_groupby(metrics, expected)
+
+
+def test_month_first_dates(invoices):
+    parsed = pd.to_datetime(invoices['InvoiceDate'], format='%d/%m/%Y %H:%M')
+    swapped = invoices.assign(InvoiceDate=parsed.dt.strftime('%m/%d/%Y %H:%M'))
+    metrics = market_metrics(rollup_invoices(swapped))
+    assert_matches_groupby(metrics, groupby_rollup(invoices, '%d/%m/%Y %H:%M'))
+
+
+def test_growth_is_nan_after_a_gap_month(invoices):
+    product = invoices['Product'].value_counts().index[0]
+    months = sorted(invoices.loc[invoices['Product'] == product, 'YearMonth'].unique())
+    gap = months[len(months) // 2]
+    after = str(pd.Period(gap, freq='M') + 1)
+    assert after in months
+
+    df = invoices[~((invoices['Product'] == product) & (invoices['YearMonth'] == gap))]
+    metrics = market_metrics(rollup_invoices(df))
+    assert_matches_groupby(metrics, groupby_rollup(df, '%d/%m/%Y %H:%M'))
+    row = metrics[(metrics['Product'] == product) & (metrics['YearMonth'] == after)]
+    assert row['growth'].isna().all()
+
+
+def test_chunks_match_one_pass(invoices):
+    # Chunks cut on invoice boundaries, so no invoice counts twice
+    cuts = np.flatnonzero(invoices['Invoice'].diff().fillna(1).to_numpy() != 0)[::97]
+    chunks = [invoices.iloc[a:b] for a, b in zip(cuts, list(cuts[1:]) + [len(invoices)])]
+    pd.testing.assert_frame_equal(rollup_invoice_chunks(iter(chunks)), rollup_invoices(invoices),
+                                  check_dtype=False)
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from quantile_sketch import QuantileSketch
+
+QUANTILES = np.linspace(0.01, 0.99, 99)
+
+
+def random_parts(rng, parts, rows):
+    values = np.concatenate([
+        rng.standard_normal(rows // 2) * 100,
+        rng.integers(0, 20, rows - rows // 2).astype(float)   # heavy ties
+    ])
+    values[rng.random(rows) < 0.05] = np.nan
+    values = values[rng.permutation(rows)]
+    cuts = np.sort(rng.integers(0, rows, parts - 1))
+    return values, np.split(values, cuts)
+
+
+def max_rank_error(sketch, values):
+    # How far, in ranks, each answer is from the rank it was asked for
+    values = np.sort(values[~np.isnan(values)])
+    worst = 0
+    for q in QUANTILES:
+        answer = sketch.quantile(q)
+        below = np.searchsorted(values, answer, side="left")
+        through = np.searchsorted(values, answer, side="right")
+        target = q * (len(values) - 1)
+        worst = max(worst, below - target - 1, target - through, 0)
+    return worst / len(values)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("error", [0.01, 0.001])
+def test_merged_sketches_stay_within_error(seed, error):
+    rng = np.random.default_rng(seed)
+    values, parts = random_parts(rng, 16, 200_000)
+
+    # One sketch per part, merged one by one and pairwise as workers would
+    sketches = [QuantileSketch(error).update(part) if len(part) else QuantileSketch(error) for part in parts]
+    sequential = QuantileSketch(error)
+    for sketch in sketches:
+        sequential.merge(QuantileSketch.from_dict(sketch.to_dict()))
+    while len(sketches) > 1:
+        sketches = [a.merge(b) for a, b in zip(sketches[::2], sketches[1::2])]
+
+    for merged in [sequential, sketches[0]]:
+        assert merged.count == np.count_nonzero(~np.isnan(values))
+        assert max_rank_error(merged, values) <= error
+        assert merged.quantile(0) == np.nanmin(values) and merged.quantile(1) == np.nanmax(values)
+
+
+def test_small_sketches_match_series_quantile():
+    rng = np.random.default_rng(0)
+    values, parts = random_parts(rng, 4, 150)
+    sketch = QuantileSketch(0.01)
+    for part in parts:
+        sketch.merge(QuantileSketch(0.01).update(part))
+    for q in QUANTILES:
+        assert sketch.quantile(q) == pd.Series(values).quantile(q)
+
+
+def test_sketches_of_different_error_do_not_merge():
+    with pytest.raises(ValueError):
+        QuantileSketch(0.01).merge(QuantileSketch(0.001))
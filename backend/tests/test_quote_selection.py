@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from quote_selection import get_representative_quotes
+
+WORDS = ["great", "shoes", "comfortable", "price", "delivery", "late", "size", "small", "love",
+         "quality", "poor", "return", "fast", "colour", "fit", "sole", "broke", "cheap", "the", "and"]
+
+
+def cosine_picks(texts, n=5):
+    # The dense NxN selection get_representative_quotes replaced
+    if not texts or len(texts) <= n:
+        return texts
+    S = cosine_similarity(TfidfVectorizer(stop_words='english').fit_transform(texts))
+    selected = [int(S.sum(axis=1).argmax())]
+    for _ in range(1, n):
+        min_dist = (1 - S[:, selected]).min(axis=1)
+        min_dist[selected] = -1
+        selected.append(int(min_dist.argmax()))
+    return [texts[i] for i in selected]
+
+
+def random_texts(rng, count):
+    texts = [" ".join(rng.choice(WORDS, rng.integers(1, 8))) for _ in range(count)]
+    # Repeated quotes, reordered words and stop-word-only quotes make ties
+    texts += [texts[i] for i in rng.integers(0, count, count // 4)]
+    texts += [" ".join(reversed(texts[i].split())) for i in rng.integers(0, count, count // 4)]
+    texts += ["the and"] * 3
+    return [texts[i] for i in rng.permutation(len(texts))]
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("n", [1, 5, 12])
+def test_picks_match_cosine_similarity(seed, n):
+    texts = random_texts(np.random.default_rng(seed), 150)
+    assert get_representative_quotes(texts, n) == cosine_picks(texts, n)
+
+
+def test_short_lists_come_back_whole():
+    assert get_representative_quotes([], 5) == []
+    assert get_representative_quotes(["fits well", "too small"], 5) == ["fits well", "too small"]
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+import result_cache
+import result_store
+from result_cache import ResultCache
+from result_store import save_result
+from uploads import Upload
+
+
+@pytest.fixture(autouse=True)
+def results_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_store, "RESULTS_DB", str(tmp_path / "results.db"))
+    monkeypatch.setattr(result_cache, "RESULTS_DB", str(tmp_path / "results.db"))
+
+
+def analysis(calls, fail=False):
+    async def work(upload, on_start=None):
+        calls.append(upload.data)
+        await asyncio.sleep(0.01)
+        if fail:
+            raise ValueError("bad file")
+        result = {"jobId": f"job-{len(calls)}", "rows": len(upload.data)}
+        save_result("test", result["jobId"], result)
+        return result
+    return work
+
+
+def test_uploads_are_discarded_on_hits_and_misses(tmp_path):
+    cache, calls = ResultCache(str(tmp_path)), []
+    first, second = Upload("a.csv", data=b"a,b\n1,2\n"), Upload("a.csv", data=b"a,b\n1,2\n")
+
+    assert asyncio.run(cache.start_upload("key", "test", analysis(calls), first)) == {"jobId": "job-1", "rows": 8}
+    assert asyncio.run(cache.start_upload("key", "test", analysis(calls), second)) == {"jobId": "job-1", "rows": 8}
+    assert calls == [b"a,b\n1,2\n"]
+    assert first.data is None and second.data is None
+
+
+def test_a_failed_run_leaves_the_next_request_its_upload(tmp_path):
+    cache, calls = ResultCache(str(tmp_path)), []
+
+    async def together():
+        uploads = [Upload("bad.csv", data=b"x") for _ in range(3)]
+        results = await asyncio.gather(
+            *(cache.start_upload("key", "test", analysis(calls, fail=True), upload) for upload in uploads),
+            return_exceptions=True
+        )
+        return uploads, results
+
+    uploads, results = asyncio.run(together())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert calls == [b"x"] and all(upload.data is None for upload in uploads)
+
+    # The failed run is gone from the cache; the next one analyzes its own upload
+    with pytest.raises(ValueError):
+        asyncio.run(cache.start_upload("key", "test", analysis(calls, fail=True), Upload("bad.csv", data=b"x")))
+    assert calls == [b"x", b"x"]
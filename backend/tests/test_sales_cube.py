@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+import secondary_api
+from sales_cube import build_cube, query_cube
+
+SAMPLE_CSV = os.path.join(os.path.dirname(__file__), '..', '..', 'sample.csv')
+
+
+@pytest.fixture(scope="module")
+def invoices():
+    df = pd.read_csv(SAMPLE_CSV)
+    # sample.csv is all Nepal; a second country gives the filters something to do
+    df.loc[df.index % 3 == 0, 'Country'] = 'India'
+    return df
+
+
+def previous_month(year_months):
+    return (pd.PeriodIndex(year_months, freq='M') - 1).strftime('%Y-%m')
+
+
+def groupby_answer(df, by, measure='revenue', top=None, filters=None, start=None, end=None, change=False):
+    # The same question answered straight from the invoices
+    for column, values in (filters or {}).items():
+        df = df[df[column].isin(values)]
+    in_period = df[(df['YearMonth'] >= (start or '')) & (df['YearMonth'] <= (end or '9999'))]
+
+    totals = in_period.groupby(by).agg(revenue=('Revenue', 'sum'), quantity=('Quantity', 'sum'),
+                                       count=('Revenue', 'size'), rating=('Rating', 'mean')).reset_index()
+    columns = by + ['revenue', 'quantity', 'count', 'rating']
+    if change:
+        # Looked up over every month, including the one before start
+        others = [column for column in by if column != 'YearMonth']
+        earlier = df.groupby(by)[{'revenue': 'Revenue', 'quantity': 'Quantity'}[measure]].sum()
+        keys = zip(*[totals[column] for column in others], previous_month(totals['YearMonth']))
+        totals['previous'] = [earlier.get(key if others else key[0], np.nan) for key in keys]
+        totals['change'] = (totals[measure] - totals['previous']) / totals['previous']
+        columns += ['previous', 'change']
+
+    totals = totals.sort_values(measure, ascending=False, kind='stable')
+    if top is not None:
+        totals = totals.head(top)
+    return totals[columns].to_dict('records')
+
+
+def assert_same_rows(rows, expected):
+    assert len(rows) == len(expected)
+    for row, want in zip(rows, expected):
+        assert row.keys() == want.keys()
+        for key, value in want.items():
+            if isinstance(value, float) and np.isnan(value):
+                assert row[key] is None
+            elif isinstance(value, (float, np.floating)):
+                assert row[key] == pytest.approx(value)
+            else:
+                assert row[key] == value
+
+
+@pytest.mark.parametrize("query", [
+    {"by": ['Product']},
+    {"by": ['Country'], "measure": 'quantity'},
+    {"by": ['Product', 'Country'], "measure": 'count', "top": 7},
+    {"by": ['YearMonth'], "measure": 'rating'},
+    {"by": ['Product'], "filters": {"Country": ['India']}, "start": '2024-09', "end": '2025-02', "top": 5},
+    {"by": ['Country', 'YearMonth'], "filters": {"Product": ['KTM Bike Helmet', 'Steel Water Bottle']}},
+    {"by": ['YearMonth'], "start": '2025-01', "change": True},
+    {"by": ['Product', 'YearMonth'], "measure": 'quantity', "start": '2024-12', "end": '2025-03', "change": True},
+    {"by": ['Country', 'YearMonth'], "filters": {"Country": ['Nepal']}, "start": '2024-07', "change": True,
+     "top": 4},
+])
+def test_query_matches_groupby(invoices, query):
+    rows = query_cube(build_cube(invoices), **query)
+    assert_same_rows(rows, groupby_answer(invoices, **query))
+
+
+def test_change_looks_before_start(invoices):
+    rows = query_cube(build_cube(invoices), by=['YearMonth'], start='2025-01', end='2025-01', change=True)
+    december = invoices.loc[invoices['YearMonth'] == '2024-12', 'Revenue'].sum()
+    assert rows[0]['previous'] == pytest.approx(december)
+
+
+def test_query_sales_endpoint(invoices, monkeypatch):
+    cube = build_cube(invoices)
+    monkeypatch.setattr(secondary_api.dataset_registry, "cube", lambda dataset_id: cube)
+    client = TestClient(secondary_api.app)
+
+    response = client.get("/query_sales", params={
+        "dataset_id": "sample", "by": "Product, YearMonth", "country": ["India"],
+        "start": "2025-01", "end": "2025-04", "top": 10, "change": True
+    })
+    assert response.status_code == 200
+    expected = groupby_answer(invoices, ['Product', 'YearMonth'], filters={"Country": ['India']},
+                              start='2025-01', end='2025-04', top=10, change=True)
+    assert_same_rows(response.json()["rows"], expected)
+
+    assert client.get("/query_sales", params={"dataset_id": "sample", "by": "Customer"}).status_code == 400
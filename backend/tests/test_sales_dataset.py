@@ -0,0 +1,81 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import sales_dataset
+from sales_dataset import append_batch, dataset_info, delete_dataset, load_dataset
+
+
+@pytest.fixture(autouse=True)
+def datasets_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(sales_dataset, "DATASETS_DB", str(tmp_path / "datasets.db"))
+
+
+def random_batch(seed, rows):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'product_niche': rng.choice(['Running', 'Casual', 'Formal'], rows),
+        'product_details': [f"Shoe {i}" for i in rng.integers(0, 40, rows)],
+        'total_sales': rng.integers(1, 500, rows),
+        'total_qty_sold': rng.integers(1, 20, rows),
+        'relative_market_share': rng.integers(0, 10, rows) / 4,
+        'market_growth': rng.integers(-5, 5, rows) / 4
+    })
+    df.loc[rng.random(rows) < 0.1, 'market_growth'] = np.nan
+    return df, hashlib.sha256(f"batch {seed}".encode()).hexdigest()
+
+
+def test_aggregates_match_all_rows_at_once():
+    batches = [random_batch(seed, rows) for seed, rows in enumerate([50, 1, 120, 30])]
+    for df, digest in batches:
+        assert append_batch("shoes", df, digest)
+    everything = pd.concat([df for df, _ in batches], ignore_index=True)
+
+    dataset = load_dataset("shoes")
+    assert dataset.rows == len(everything) and dataset.complete
+    assert dataset.total_sales == everything['total_sales'].sum()
+    assert dataset.total_qty_sold == everything['total_qty_sold'].sum()
+    assert dataset.niche_sales == everything.groupby('product_niche')['total_sales'].sum().to_dict()
+    assert dataset.product_qty == everything.groupby('product_details')['total_qty_sold'].sum().to_dict()
+    assert dataset.sample['product_details'].tolist() == everything['product_details'].tolist()
+    for column in ['total_sales', 'relative_market_share', 'market_growth']:
+        assert dataset.sample[column].tolist() == pytest.approx(everything[column].tolist(), nan_ok=True)
+    share, growth = dataset.means()
+    assert share == pytest.approx(everything['relative_market_share'].mean())
+    assert growth == pytest.approx(everything['market_growth'].mean())
+    assert [batch["digest"] for batch in dataset_info("shoes")["batches"]] == [digest for _, digest in batches]
+
+
+def test_sample_keeps_the_smallest_keys(monkeypatch):
+    monkeypatch.setattr(sales_dataset, "DATASET_SAMPLE_ROWS", 25)
+    batches = [random_batch(seed, rows) for seed, rows in enumerate([10, 40, 3, 60])]
+    keys = []
+    for df, digest in batches:
+        append_batch("shoes", df, digest)
+        keys.append(np.random.default_rng(int(digest[:16], 16)).random(len(df)))
+
+    dataset = load_dataset("shoes")
+    assert not dataset.complete and dataset.rows == 113
+    assert sorted(dataset.sample['key']) == np.sort(np.concatenate(keys))[:25].tolist()
+    assert dataset.sample['row'].is_monotonic_increasing
+
+
+def test_a_batch_is_only_appended_once():
+    df, digest = random_batch(0, 20)
+    assert append_batch("shoes", df, digest)
+    assert not append_batch("shoes", df, digest)
+    assert load_dataset("shoes").rows == 20
+    assert delete_dataset("shoes") and not delete_dataset("shoes")
+    assert load_dataset("shoes") is None and dataset_info("shoes") is None
+
+
+def test_concurrent_appends_keep_every_batch():
+    batches = [random_batch(seed, 30 + seed) for seed in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert all(executor.map(lambda batch: append_batch("shoes", *batch), batches))
+    dataset = load_dataset("shoes")
+    assert dataset.rows == sum(len(df) for df, _ in batches)
+    assert len(dataset.batches) == len(batches)
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+
+from quote_selection import get_representative_quotes
+from text_features import StreamingTextStats, build_text_features, phrase_counts, sentiment_texts, tfidf_matrix
+
+WORDS = ["great", "shoes", "comfortable", "price", "delivery", "late", "size", "small", "love",
+         "quality", "poor", "return", "fast", "colour", "fit", "sole", "broke", "cheap", "the", "and"]
+
+
+def feedback_frame(seed, rows=120):
+    rng = np.random.default_rng(seed)
+    texts = [" ".join(rng.choice(WORDS, rng.integers(1, 8))) for _ in range(rows)]
+    df = pd.DataFrame({'feedback': texts, 'sentiment': rng.choice(['positive', 'negative', 'neutral'], rows)})
+    # Repeated rows are counted once, like the .unique() texts the vectorizers saw
+    return pd.concat([df, df.sample(rows // 4, random_state=seed)], ignore_index=True)
+
+
+def unique_texts(df, sentiment):
+    return df.loc[df['sentiment'] == sentiment, 'feedback'].unique().tolist()
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("sentiment", ['positive', 'negative'])
+def test_phrase_counts_match_count_vectorizer(seed, sentiment):
+    df = feedback_frame(seed)
+    features = build_text_features(df)
+    texts = unique_texts(df, sentiment)
+    assert sentiment_texts(features, sentiment) == texts
+
+    cv = CountVectorizer(stop_words='english', ngram_range=(2, 3), max_features=30)
+    expected = np.asarray(cv.fit_transform(texts).sum(axis=0)).ravel()
+    scores, phrases = phrase_counts(features, sentiment, ngram_range=(2, 3), max_features=30)
+    assert phrases.tolist() == cv.get_feature_names_out().tolist()
+    assert scores.tolist() == expected.tolist()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_tfidf_opportunities_and_quotes_match_tfidf_vectorizer(seed):
+    df = feedback_frame(seed)
+    features = build_text_features(df)
+    texts = unique_texts(df, 'positive')
+
+    tfidf = TfidfVectorizer(stop_words='english', max_features=20)
+    expected = tfidf.fit_transform(texts)
+    X, phrases = tfidf_matrix(features, 'positive', max_features=20)
+    assert phrases.tolist() == tfidf.get_feature_names_out().tolist()
+    np.testing.assert_allclose(X.toarray(), expected.toarray())
+
+    # The opportunity terms: the top five by summed TF-IDF
+    top = lambda M, names: [names[i] for i in np.asarray(M.sum(axis=0)).ravel().argsort()[::-1][:5]]
+    assert top(X, phrases) == top(expected, tfidf.get_feature_names_out())
+
+    X_quotes, _ = tfidf_matrix(features, 'positive')
+    assert get_representative_quotes(texts, n=5, X=X_quotes) == get_representative_quotes(texts, n=5)
+
+
+def test_empty_vocabulary():
+    df = pd.DataFrame({
+        'feedback': ['great fast delivery', 'it was the', 'and so on', 'the', 'to be', 'it is', 'of it', 'was'],
+        'sentiment': ['positive'] + ['negative'] * 7
+    })
+    negative = unique_texts(df, 'negative')
+    with pytest.raises(ValueError):
+        CountVectorizer(stop_words='english').fit(negative)
+
+    for features in [build_text_features(df), build_text_features(df[df['sentiment'] == 'negative'])]:
+        scores, phrases = phrase_counts(features, 'negative')
+        assert len(scores) == len(phrases) == 0
+
+        # Rows without columns, so the quotes and opportunities still work
+        X, phrases = tfidf_matrix(features, 'negative')
+        assert X.shape == (len(negative), 0)
+        assert get_representative_quotes(negative, n=5, X=X) == negative[:5]
+
+    # A sentiment with no rows at all has no matrix
+    X, phrases = tfidf_matrix(build_text_features(df), 'neutral')
+    assert X is None and len(phrases) == 0
+
+
+def test_stop_word_sentiment_gets_no_phrase_table():
+    stats = StreamingTextStats()
+    stats.update(pd.DataFrame({
+        'feedback': ['great fast delivery', 'it was the', 'and so on'],
+        'sentiment': ['positive', 'negative', 'negative']
+    }))
+
+    assert stats.phrase_counts('negative') is None
+    scores, phrases = stats.phrase_counts('positive')
+    assert dict(zip(phrases, scores)) == {'great fast': 1, 'fast delivery': 1, 'great fast delivery': 1}
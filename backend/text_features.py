@@ -0,0 +1,215 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+
+
+def build_text_features(df, max_ngram=3):
+    """
+    Tokenize and n-gram every unique (feedback, sentiment) row exactly once.
+
+    Returns a dict holding one sparse count matrix over all 1..max_ngram word
+    n-grams plus a boolean row mask per sentiment. The pain-point counts,
+    positive-point counts, TF-IDF opportunities and quote vectors are all
+    sliced out of this matrix instead of re-tokenizing the corpus per stage.
+    """
+    rows = df[['feedback', 'sentiment']].drop_duplicates()
+    texts = rows['feedback'].tolist()
+    sentiments = rows['sentiment'].to_numpy()
+
+    cv = CountVectorizer(stop_words='english', ngram_range=(1, max_ngram))
+    try:
+        counts = cv.fit_transform(texts).tocsr()
+        phrases = cv.get_feature_names_out()
+    except ValueError:
+        # Nothing but stop words (or no rows at all)
+        counts = None
+        phrases = np.array([], dtype=object)
+
+    return {
+        "texts": texts,
+        "counts": counts,
+        "phrases": phrases,
+        "ngram_sizes": np.array([p.count(' ') + 1 for p in phrases], dtype=int),
+        "masks": {label: sentiments == label for label in np.unique(sentiments)}
+    }
+
+
+def sentiment_texts(features, sentiment):
+    """Unique feedback strings for one sentiment, in order of first appearance"""
+    mask = features["masks"].get(sentiment)
+    if mask is None:
+        return []
+    return [text for text, keep in zip(features["texts"], mask) if keep]
+
+
+def _select_columns(features, sentiment, ngram_range, max_features):
+    """
+    Rows of one sentiment restricted to the n-grams a vectorizer fitted on
+    just those rows would have kept (same vocabulary, same max_features cut).
+    """
+    mask = features["masks"].get(sentiment)
+    if mask is None or not mask.any():
+        return None, np.array([], dtype=int)
+    if features["counts"] is None:
+        # Nothing but stop words anywhere: the rows, with no n-grams
+        return sp.csr_matrix((int(mask.sum()), 0), dtype=np.int64), np.array([], dtype=int)
+
+    rows = features["counts"][mask]
+    sizes = features["ngram_sizes"]
+    columns = np.where((sizes >= ngram_range[0]) & (sizes <= ngram_range[1]))[0]
+
+    tfs = np.asarray(rows[:, columns].sum(axis=0)).ravel()
+    present = tfs > 0
+    columns, tfs = columns[present], tfs[present]
+
+    # Mirrors CountVectorizer._limit_features so ties break the same way
+    if max_features is not None and len(columns) > max_features:
+        keep = np.sort((-tfs).argsort()[:max_features])
+        columns = columns[keep]
+
+    return rows[:, columns], columns
+
+
+def phrase_counts(features, sentiment, ngram_range=(2, 3), max_features=None):
+    """Per-phrase counts for one sentiment, like CountVectorizer.fit_transform(...).sum(axis=0)"""
+    X, columns = _select_columns(features, sentiment, ngram_range, max_features)
+    if X is None:
+        return np.array([], dtype=int), np.array([], dtype=object)
+    return np.asarray(X.sum(axis=0)).ravel(), features["phrases"][columns]
+
+
+def tfidf_matrix(features, sentiment, ngram_range=(1, 1), max_features=None):
+    """
+    L2-normalised TF-IDF rows for one sentiment, like TfidfVectorizer.fit_transform.
+    Where the vectorizer would find no vocabulary the rows have no columns.
+    """
+    X, columns = _select_columns(features, sentiment, ngram_range, max_features)
+    if X is None:
+        return None, np.array([], dtype=object)
+    if X.shape[1] == 0:
+        return X.astype(np.float64), features["phrases"][columns]
+
+    # Smoothed idf, as TfidfTransformer computes it
+    n_docs = X.shape[0]
+    doc_freq = np.bincount(X.indices, minlength=X.shape[1])
+    idf = np.log((1 + n_docs) / (1 + doc_freq)) + 1
+
+    X = normalize(X.astype(np.float64).multiply(idf).tocsr(), norm='l2', copy=False)
+    return X, features["phrases"][columns]
+
+
+class StreamingTextStats:
+    """
+    Bounded-memory aggregates of (feedback, sentiment) rows fed chunk by chunk.
+
+    Keeps exact sentiment counts, per-sentiment 2-3 gram counts over unique
+    feedback rows and a fixed-size reservoir sample of unique feedback per
+    sentiment (for quotes and TF-IDF opportunities). Memory is capped by:
+      - max_phrases: phrase tables are pruned back to their most frequent
+        half when they grow past this size,
+      - max_tracked_texts: rows remembered for de-duplication across chunks;
+        once full, later duplicates are counted again,
+      - sample_size: reservoir size per sentiment.
+    With no pruning and no de-duplication overflow the phrase counts equal
+    the in-memory phrase_counts.
+    """
+
+    def __init__(self, ngram_range=(2, 3), max_phrases=200000,
+                 max_tracked_texts=500000, sample_size=20000, seed=0):
+        self.ngram_range = ngram_range
+        self.max_phrases = max_phrases
+        self.max_tracked_texts = max_tracked_texts
+        self.sample_size = sample_size
+        self.rng = np.random.default_rng(seed)
+
+        self.row_counts = Counter()   # sentiment -> rows
+        self.phrases = {}             # sentiment -> Counter of n-gram counts
+        self.samples = {}             # sentiment -> reservoir of unique texts
+        self.unique_seen = Counter()  # sentiment -> unique texts offered to the reservoir
+        self.seen_rows = set()
+
+    def update(self, chunk):
+        """Fold one DataFrame chunk with 'feedback' and 'sentiment' columns into the aggregates"""
+        self.row_counts.update(chunk['sentiment'].value_counts().to_dict())
+
+        rows = chunk[['feedback', 'sentiment']].drop_duplicates()
+        if rows.empty:
+            return
+
+        # Drop rows already counted in an earlier chunk
+        hashes = pd.util.hash_pandas_object(rows, index=False).to_numpy()
+        is_new = np.ones(len(rows), dtype=bool)
+        for i, h in enumerate(hashes.tolist()):
+            if h in self.seen_rows:
+                is_new[i] = False
+            elif len(self.seen_rows) < self.max_tracked_texts:
+                self.seen_rows.add(h)
+        rows = rows[is_new]
+
+        for sentiment, group in rows.groupby('sentiment', sort=False):
+            texts = group['feedback'].tolist()
+            self._count_phrases(sentiment, texts)
+            self._sample(sentiment, texts)
+
+    def _count_phrases(self, sentiment, texts):
+        cv = CountVectorizer(stop_words='english', ngram_range=self.ngram_range)
+        try:
+            X = cv.fit_transform(texts)
+        except ValueError:
+            # No n-grams left after stop word removal; a sentiment that never
+            # has any gets no table, so no chart
+            return
+
+        table = self.phrases.setdefault(sentiment, Counter())
+        sums = np.asarray(X.sum(axis=0)).ravel().tolist()
+        table.update(dict(zip(cv.get_feature_names_out().tolist(), sums)))
+
+        if len(table) > self.max_phrases:
+            self.phrases[sentiment] = Counter(dict(table.most_common(self.max_phrases // 2)))
+
+    def _sample(self, sentiment, texts):
+        # Reservoir sampling (algorithm R) over unique texts of one sentiment
+        reservoir = self.samples.setdefault(sentiment, [])
+        seen = self.unique_seen[sentiment]
+
+        free = max(self.sample_size - len(reservoir), 0)
+        reservoir.extend(texts[:free])
+        rest = texts[free:]
+        seen += min(free, len(texts))
+
+        if rest:
+            slots = self.rng.integers(0, np.arange(seen + 1, seen + len(rest) + 1))
+            for text, slot in zip(rest, slots.tolist()):
+                if slot < self.sample_size:
+                    reservoir[slot] = text
+            seen += len(rest)
+
+        self.unique_seen[sentiment] = seen
+
+    def sentiment_counts(self):
+        """Row counts per sentiment, like df['sentiment'].value_counts()"""
+        return pd.Series(dict(self.row_counts), dtype='int64').sort_values(ascending=False)
+
+    def sample_frame(self):
+        """The reservoir samples as a (feedback, sentiment) DataFrame"""
+        rows = [(text, sentiment) for sentiment, texts in self.samples.items() for text in texts]
+        return pd.DataFrame(rows, columns=['feedback', 'sentiment'])
+
+    def phrase_counts(self, sentiment, max_features=None):
+        """Same (scores, phrases) shape as phrase_counts, or None if the sentiment never had any phrases"""
+        if sentiment not in self.phrases:
+            return None
+
+        # Alphabetical order, as a fitted vectorizer's vocabulary would be
+        phrases = np.array(sorted(self.phrases[sentiment]), dtype=object)
+        scores = np.array([self.phrases[sentiment][p] for p in phrases], dtype=np.int64)
+
+        if max_features is not None and len(phrases) > max_features:
+            keep = np.sort((-scores).argsort()[:max_features])
+            phrases, scores = phrases[keep], scores[keep]
+
+        return scores, phrases
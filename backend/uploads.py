@@ -0,0 +1,73 @@
+import io
+import os
+import shutil
+import tempfile
+
+# Uploads up to this size reach the analysis as bytes; bigger ones are spilled to a file
+UPLOAD_SPILL_BYTES = int(os.environ.get("UPLOAD_SPILL_MB", "64")) * 1024 * 1024
+
+# Where spilled uploads go: never under temp/output, which is served as static files
+UPLOAD_SPILL_DIR = os.environ.get("UPLOAD_SPILL_DIR") or tempfile.gettempdir()
+
+
+class Upload:
+    """
+    An uploaded file on its way to an analysis worker.
+
+    receive() takes it straight from the request's spooled file: small
+    uploads are kept as bytes and pickled to the worker, which parses them
+    from memory, while ones over UPLOAD_SPILL_BYTES are copied once to a
+    spill file in UPLOAD_SPILL_DIR for the worker to read. read_table()
+    accepts either. Call discard() once the analysis is over, whether or
+    not it succeeded; it deletes the spill file. With keep the file belongs
+    to someone else (a registered dataset) and is left alone.
+
+    receive() copies or reads the whole upload, so async endpoints call it
+    through run_in_threadpool.
+    """
+
+    def __init__(self, name, data=None, path=None, keep=False):
+        self.name = name or ""
+        self.data = data
+        self.path = path
+        self.keep = keep
+
+    @classmethod
+    def receive(cls, upload, max_bytes=UPLOAD_SPILL_BYTES, spill_dir=UPLOAD_SPILL_DIR):
+        """An Upload holding the contents of a FastAPI UploadFile"""
+        fileobj = upload.file
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell()
+        fileobj.seek(0)
+
+        if size <= max_bytes:
+            return cls(upload.filename, data=fileobj.read())
+
+        # Keep the extension, which is how extension-less Arrow streams are recognised
+        suffix = os.path.splitext(upload.filename or "")[1]
+        fd, path = tempfile.mkstemp(prefix="upload_", suffix=suffix, dir=spill_dir)
+        try:
+            with os.fdopen(fd, "wb") as spill:
+                shutil.copyfileobj(fileobj, spill, 1024 * 1024)
+        except BaseException:
+            os.remove(path)
+            raise
+        return cls(upload.filename, path=path)
+
+    def __repr__(self):
+        return f"Upload({self.name!r})"
+
+    @property
+    def source(self):
+        """The file path or bytes to read the upload from"""
+        return self.path if self.path is not None else self.data
+
+    def open(self):
+        """A binary file object over the upload's contents, e.g. to hash them"""
+        return open(self.path, "rb") if self.path is not None else io.BytesIO(self.data)
+
+    def discard(self):
+        """Delete the spill file, if any, and drop the bytes"""
+        if self.path is not None and not self.keep and os.path.exists(self.path):
+            os.remove(self.path)
+        self.data = None
@@ -5,6 +5,10 @@ import sys
 import json
 import os
 
+# Shared BCG classification lives with the backend
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+from bcg import classify_quadrants, threshold
+
 # Get command line arguments
 # Usage: python ball.py input_csv_path output_image_path
 csv_file_path = sys.argv[1] if len(sys.argv) > 1 else "sample.csv"
@@ -80,27 +84,15 @@ if "Quantity" not in df.columns:
         print("No quantity column found, using default value of 1 for all products")
 
 # Step 1: Compute dynamic thresholds using median
-share_thresh = df["MarketShare"].median()
-growth_thresh = df["MarketGrowth"].median()
+share_thresh = threshold(df["MarketShare"])
+growth_thresh = threshold(df["MarketGrowth"])
 
 print(f"\nCalculated Thresholds:")
 print(f"  Market Share Threshold: {share_thresh:.2f}")
 print(f"  Market Growth Threshold: {growth_thresh:.2f}")
 
 # Step 2: Classification Logic
-def classify_bcg(row):
-    share = row['MarketShare']
-    growth = row['MarketGrowth']
-    if share >= share_thresh and growth >= growth_thresh:
-        return "Star"
-    elif share >= share_thresh and growth < growth_thresh:
-        return "Cash Cow"
-    elif share < share_thresh and growth >= growth_thresh:
-        return "Question Mark"
-    else:
-        return "Dog"
-
-df['BCG Category'] = df.apply(classify_bcg, axis=1)
+df['BCG Category'] = classify_quadrants(df['MarketShare'], df['MarketGrowth'], share_thresh, growth_thresh)
 
 # Extract top products by Quantity
 try: